@@ -1,12 +1,12 @@
 from django.contrib import admin
 from .models import (
     Category, CollectibleItem, Comment, Vote, UserCollection,
-    VisitCount, Poll, PollOption, PollVote
+    VisitCount, VisitTotal, Poll, PollOption, PollVote
 )
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'slug')
+    list_display = ('name', 'slug', 'item_count')
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ('name',)
 
@@ -18,7 +18,7 @@ class CommentInline(admin.TabularInline):
 
 @admin.register(CollectibleItem)
 class CollectibleItemAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'country', 'condition', 'created_at')
+    list_display = ('name', 'category', 'country', 'condition', 'likes_count', 'dislikes_count', 'created_at')
     list_filter = ('category', 'country', 'condition', 'created_at')
     search_fields = ('name', 'description', 'country')
     prepopulated_fields = {'slug': ('name',)}
@@ -55,6 +55,11 @@ class VisitCountAdmin(admin.ModelAdmin):
     date_hierarchy = 'date'
 
 
+@admin.register(VisitTotal)
+class VisitTotalAdmin(admin.ModelAdmin):
+    list_display = ('count',)
+
+
 class PollOptionInline(admin.TabularInline):
     model = PollOption
     extra = 3
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class CatalogConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'catalog'
+
+    def ready(self):
+        # Подключаем обработчики сигналов поиска, фасетов, изображений, опросов, коллекций,
+        # кэша страниц, рекомендаций и метрик соединений и запросов
+        from . import collection_stats, db_pool, facets, images, metrics, page_cache, polls, recommendations, search  # noqa: F401
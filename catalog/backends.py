@@ -0,0 +1,60 @@
+"""
+Бэкенды шаблонов и кэша, которые учитывают время отрисовки и обращения
+к кэшу в метриках текущего запроса (см. catalog.metrics).
+"""
+import time
+
+from django.core.cache.backends import locmem, redis
+from django.template.backends import django as django_backend
+
+from .metrics import record_cache, record_template
+
+_missing = object()
+
+
+class TimedTemplate:
+    """Шаблон, который измеряет время render()"""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            record_template(time.perf_counter() - started)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class CacheMetricsMixin:
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        if value is _missing:
+            record_cache(0, 1)
+            return default
+        record_cache(1, 0)
+        return value
+
+
+class LocMemCache(CacheMetricsMixin, locmem.LocMemCache):
+    # get_many базового класса вызывает get для каждого ключа
+    pass
+
+
+class RedisCache(CacheMetricsMixin, redis.RedisCache):
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = super().get_many(keys, version)
+        record_cache(len(values), len(keys) - len(values))
+        return values
@@ -0,0 +1,138 @@
+"""
+Статистика личной коллекции: количество предметов по категориям, странам
+и состояниям и полнота коллекции по каждой категории.
+
+Одним GROUP BY по коллекции пользователя строятся строки
+(категория, страна, состояние, количество); из них в памяти считаются все
+итоги панели и число предметов для любого набора фильтров. Снимок кэшируется
+по пользователю и сбрасывается после фиксации транзакции, в которой
+изменилась его коллекция. Полнота считается по Category.item_count.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.http import urlencode
+
+from .facets import FACET_TITLES
+from .models import CollectibleItem, UserCollection
+
+# Фильтры страницы коллекции — фасеты каталога без года
+COLLECTION_FILTERS = ('category', 'country', 'condition')
+
+
+def stats_cache_key(user_id):
+    return f'collection:stats:{user_id}'
+
+
+def _load_rows(user_id):
+    """[(slug категории, страна, состояние, количество)] и {slug: (название, предметов в каталоге)}"""
+    rows = []
+    categories = {}
+    grouped = UserCollection.objects.filter(user_id=user_id).order_by().values_list(
+        'item__category__slug', 'item__category__name', 'item__category__item_count',
+        'item__country', 'item__condition',
+    ).annotate(n=Count('pk'))
+    for slug, name, item_count, country, condition, n in grouped:
+        rows.append((slug, country, condition, n))
+        categories[slug] = (name, item_count)
+    return rows, categories
+
+
+def collection_stats(user_id):
+    """
+    Снимок статистики: total, rows (строки группировки) и списки categories,
+    countries, conditions; у категорий есть catalog_count и percentage.
+    """
+    key = stats_cache_key(user_id)
+    stats = cache.get(key)
+    if stats is not None:
+        return stats
+
+    rows, categories = _load_rows(user_id)
+    totals = {facet: {} for facet in COLLECTION_FILTERS}
+    for *values, n in rows:
+        for facet, value in zip(COLLECTION_FILTERS, values):
+            totals[facet][value] = totals[facet].get(value, 0) + n
+
+    conditions = dict(CollectibleItem.CONDITION_CHOICES)
+    stats = {
+        'total': sum(row[-1] for row in rows),
+        'rows': rows,
+        'categories': [],
+        'countries': [],
+        'conditions': [],
+    }
+    for slug, count in totals['category'].items():
+        name, catalog_count = categories[slug]
+        stats['categories'].append({
+            'value': slug,
+            'label': name,
+            'count': count,
+            'catalog_count': catalog_count,
+            # Счетчик каталога мог еще не учесть предмет, поэтому не больше 100 %
+            'percentage': min(round(count / catalog_count * 100), 100) if catalog_count else 100,
+        })
+    for country, count in totals['country'].items():
+        stats['countries'].append({'value': country, 'label': country, 'count': count})
+    for condition, count in totals['condition'].items():
+        stats['conditions'].append({'value': condition, 'label': conditions.get(condition, condition), 'count': count})
+    for entries in (stats['categories'], stats['countries'], stats['conditions']):
+        entries.sort(key=lambda entry: (-entry['count'], str(entry['label'])))
+
+    cache.set(key, stats, getattr(settings, 'COLLECTION_STATS_CACHE_TIMEOUT', 3600))
+    return stats
+
+
+def parse_collection_filters(params, stats):
+    """Фильтры из GET-параметров; значения, которых нет в коллекции, отбрасываются"""
+    present = {
+        'category': {entry['value'] for entry in stats['categories']},
+        'country': {entry['value'] for entry in stats['countries']},
+        'condition': {entry['value'] for entry in stats['conditions']},
+    }
+    filters = {}
+    for facet in COLLECTION_FILTERS:
+        value = params.get(facet, '').strip()
+        if value in present[facet]:
+            filters[facet] = value
+    return filters
+
+
+def filtered_count(stats, filters):
+    """Количество предметов коллекции, подходящих под фильтры"""
+    selected = [(index, filters[facet]) for index, facet in enumerate(COLLECTION_FILTERS) if facet in filters]
+    return sum(
+        row[-1] for row in stats['rows']
+        if all(row[index] == value for index, value in selected)
+    )
+
+
+def filter_panels(stats, filters):
+    """Фасеты для шаблона: значения со счетчиками и ссылками, включающими или снимающими фильтр"""
+    panels = []
+    for facet, entries in zip(COLLECTION_FILTERS, (stats['categories'], stats['countries'], stats['conditions'])):
+        values = []
+        for entry in entries:
+            active = filters.get(facet) == entry['value']
+            params = dict(filters)
+            if active:
+                del params[facet]
+            else:
+                params[facet] = entry['value']
+            values.append(dict(entry, active=active, query=urlencode(sorted(params.items()))))
+        panels.append({'name': facet, 'title': FACET_TITLES[facet], 'values': values})
+    return panels
+
+
+def invalidate_collection_stats(user_id):
+    transaction.on_commit(lambda: cache.delete(stats_cache_key(user_id)))
+
+
+@receiver(post_save, sender=UserCollection)
+@receiver(post_delete, sender=UserCollection)
+def collection_changed(sender, instance, **kwargs):
+    """Сброс статистики коллекции пользователя при изменении коллекции"""
+    invalidate_collection_stats(instance.user_id)
@@ -1,6 +1,7 @@
-from .models import VisitCount
 import datetime
-from django.db.models import Sum # <--- IMPORT Sum HERE
+
+from .counters import get_visit_totals
+
 
 def visit_counter(request):
     """
@@ -8,17 +9,10 @@ def visit_counter(request):
     """
     today = datetime.date.today()
 
-    # Получаем статистику посещений
-    try:
-        today_visits = VisitCount.objects.get(date=today).count
-    except VisitCount.DoesNotExist:
-        today_visits = 0
-
-    # Общее количество посещений
-    total_visits_data = VisitCount.objects.aggregate(total=Sum('count'))
-    total_visits = total_visits_data['total'] or 0
+    # Статистика берется из кэша; общий итог хранится в VisitTotal, без агрегации по таблице
+    today_visits, total_visits = get_visit_totals(today)
 
     return {
         'today_visits': today_visits,
         'total_visits': total_visits,
-    }
\ No newline at end of file
+    }
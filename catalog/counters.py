@@ -0,0 +1,267 @@
+"""
+Счетчики посещений сайта.
+
+Посещение за день — это уникальный посетитель (хэш IP и User-Agent),
+учтенный в наброске HyperLogLog этого дня (см. catalog.hll). Набросок
+хранится в кэше и в VisitCount.sketch вместе с его оценкой sketch_estimate;
+к VisitCount.count и VisitTotal прибавляется только прирост оценки, поэтому
+посещения, учтенные до наброска или поправками, не теряются. Запись в базу
+нужна, только когда посетитель меняет регистр наброска, а сессия для учета
+не используется вовсе.
+"""
+import atexit
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from hitcount.utils import get_ip
+
+from .hll import HyperLogLog, hash64
+from .models import VisitCount, VisitTotal
+
+logger = logging.getLogger(__name__)
+
+VISIT_TOTAL_CACHE_KEY = 'visits:total'
+
+
+def visit_day_cache_key(day):
+    return f'visits:day:{day.isoformat()}'
+
+
+def visit_sketch_cache_key(day):
+    return f'visits:sketch:{day.isoformat()}'
+
+
+def visitor_hash(request):
+    """64-битный хэш посетителя; ключ из SECRET_KEY не позволяет восстановить IP"""
+    key = hashlib.sha256(settings.SECRET_KEY.encode()).digest()
+    return hash64(f"{get_ip(request)}|{request.headers.get('User-Agent', '')}", key)
+
+
+def load_sketch(day):
+    """Сохраненный набросок посетителей за день: из кэша, при промахе — из VisitCount"""
+    key = visit_sketch_cache_key(day)
+    registers = cache.get(key)
+    if registers is None:
+        registers = bytes(VisitCount.objects.filter(date=day).values_list('sketch', flat=True).first() or b'')
+        cache.add(key, registers, getattr(settings, 'VISIT_SKETCH_CACHE_TIMEOUT', 2 * 24 * 3600))
+    return HyperLogLog(registers)
+
+
+def is_new_visitor(day, visitor):
+    """True, если посетитель изменит сохраненный набросок дня"""
+    return not load_sketch(day).contains(visitor)
+
+
+def record_visitors(day, sketch):
+    """
+    Сливает набросок посетителей с сохраненным за день day.
+
+    Строка дня блокируется на время слияния; к count и к VisitTotal
+    прибавляется превышение оценки над наибольшей прежней (оценка может
+    и уменьшиться — тогда счетчики не меняются).
+    """
+    with transaction.atomic():
+        row = _locked_day(day)
+        stored = HyperLogLog(bytes(row.sketch))
+        changed = stored.merge(sketch)
+        delta = 0
+        if changed:
+            estimate = stored.estimate()
+            delta = max(estimate - row.sketch_estimate, 0)
+            row.count += delta
+            row.sketch = stored.to_bytes()
+            row.sketch_estimate = max(estimate, row.sketch_estimate)
+            row.save(update_fields=['count', 'sketch', 'sketch_estimate'])
+            if delta:
+                _upsert_increment(VisitTotal.objects.filter(pk=1), {'pk': 1}, delta)
+
+    def update_cache():
+        # Набросок в кэше обновляется и без изменений: значит, он был устаревшим
+        cache.set(visit_sketch_cache_key(day), stored.to_bytes(),
+                  getattr(settings, 'VISIT_SKETCH_CACHE_TIMEOUT', 2 * 24 * 3600))
+        if delta:
+            cache.set(visit_day_cache_key(day), row.count, getattr(settings, 'VISIT_COUNTER_CACHE_TIMEOUT', 10))
+            _incr_cached(VISIT_TOTAL_CACHE_KEY, delta)
+
+    transaction.on_commit(update_cache)
+    return delta
+
+
+def record_visitor(day, visitor):
+    sketch = HyperLogLog()
+    sketch.add(visitor)
+    return record_visitors(day, sketch)
+
+
+def _locked_day(day):
+    row = VisitCount.objects.select_for_update().filter(date=day).first()
+    if row is not None:
+        return row
+    try:
+        # Вложенная точка сохранения: запись могла появиться в другом воркере
+        with transaction.atomic():
+            return VisitCount.objects.create(date=day)
+    except IntegrityError:
+        return VisitCount.objects.select_for_update().get(date=day)
+
+
+def _incr_cached(key, amount):
+    # Обновляем закэшированное значение, только если оно уже есть в кэше
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        pass
+
+
+def apply_visits(day, amount):
+    """
+    Атомарно прибавляет amount посещений к записи за день day и к общему счетчику.
+
+    Используется UPDATE ... SET count = count + n, поэтому параллельные
+    воркеры не теряют инкременты (в отличие от read-modify-write через save()).
+    Набросок дня не меняется: так вносятся поправки и перенесенные данные,
+    и следующие слияния наброска их не затирают.
+    """
+    if amount <= 0:
+        return
+    with transaction.atomic():
+        _upsert_increment(VisitCount.objects.filter(date=day), {'date': day}, amount)
+        _upsert_increment(VisitTotal.objects.filter(pk=1), {'pk': 1}, amount)
+
+    def update_cache():
+        _incr_cached(visit_day_cache_key(day), amount)
+        _incr_cached(VISIT_TOTAL_CACHE_KEY, amount)
+
+    transaction.on_commit(update_cache)
+
+
+def _upsert_increment(queryset, lookup, amount):
+    if queryset.update(count=F('count') + amount):
+        return
+    try:
+        # Вложенная точка сохранения: запись могла появиться в другом воркере
+        with transaction.atomic():
+            queryset.model.objects.create(count=amount, **lookup)
+    except IntegrityError:
+        queryset.update(count=F('count') + amount)
+
+
+def get_visit_totals(day):
+    """
+    Возвращает (посещения за день, всего посещений).
+
+    Оба значения читаются из кэша; при промахе берутся из записи VisitCount
+    за день и сводной записи VisitTotal и кэшируются на VISIT_COUNTER_CACHE_TIMEOUT.
+    """
+    day_key = visit_day_cache_key(day)
+    cached = cache.get_many([day_key, VISIT_TOTAL_CACHE_KEY])
+    timeout = getattr(settings, 'VISIT_COUNTER_CACHE_TIMEOUT', 10)
+
+    day_visits = cached.get(day_key)
+    if day_visits is None:
+        day_visits = VisitCount.objects.filter(date=day).values_list('count', flat=True).first() or 0
+        cache.set(day_key, day_visits, timeout)
+
+    total_visits = cached.get(VISIT_TOTAL_CACHE_KEY)
+    if total_visits is None:
+        total_visits = VisitTotal.objects.filter(pk=1).values_list('count', flat=True).first()
+        if total_visits is None:
+            total_visits = VisitCount.objects.aggregate(total=Sum('count'))['total'] or 0
+        cache.set(VISIT_TOTAL_CACHE_KEY, total_visits, timeout)
+
+    return day_visits, total_visits
+
+
+class VisitBuffer:
+    """
+    Буфер посетителей с отложенной записью (write-behind).
+
+    Новые посетители копятся в набросках дней в памяти процесса и сливаются
+    с сохраненными, когда истек интервал FLUSH_INTERVAL секунд, накопилось
+    FLUSH_THRESHOLD новых посетителей, либо при завершении воркера.
+    """
+    def __init__(self, flush_interval=None, flush_threshold=None):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._pending = {}
+        self._counts = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def _interval(self):
+        if self.flush_interval is not None:
+            return self.flush_interval
+        return getattr(settings, 'VISIT_COUNTER_FLUSH_INTERVAL', 30)
+
+    def _threshold(self):
+        if self.flush_threshold is not None:
+            return self.flush_threshold
+        return getattr(settings, 'VISIT_COUNTER_FLUSH_THRESHOLD', 100)
+
+    def add(self, day, visitor):
+        """Учитывает посетителя (64-битный хэш); возвращает True, если пора сбросить буфер"""
+        with self._lock:
+            sketch = self._pending.get(day)
+            if sketch is None:
+                sketch = self._pending[day] = HyperLogLog()
+            if sketch.add(visitor):
+                self._counts[day] = self._counts.get(day, 0) + 1
+                self._size += 1
+            return (
+                self._size >= self._threshold()
+                or time.monotonic() - self._last_flush >= self._interval()
+            )
+
+    def pending(self, day):
+        """Количество посетителей за день, еще не слитых с сохраненным наброском"""
+        with self._lock:
+            return self._counts.get(day, 0)
+
+    def flush(self):
+        """Сливает накопленные наброски с сохраненными; возвращает {день: посетителей}"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            counts, self._counts = self._counts, {}
+            self._size = 0
+            self._last_flush = time.monotonic()
+
+        items = sorted(pending.items())
+        for index, (day, sketch) in enumerate(items):
+            try:
+                record_visitors(day, sketch)
+            except Exception:
+                # Возвращаем несохраненные наброски в буфер, чтобы не потерять посетителей
+                self._restore(items[index:], counts)
+                raise
+        return counts
+
+    def _restore(self, items, counts):
+        with self._lock:
+            for day, sketch in items:
+                if day in self._pending:
+                    self._pending[day].merge(sketch)
+                else:
+                    self._pending[day] = sketch
+                self._counts[day] = self._counts.get(day, 0) + counts.get(day, 0)
+                self._size += counts.get(day, 0)
+
+
+visit_buffer = VisitBuffer()
+
+
+def flush_visit_buffer():
+    """Сбрасывает буфер посещений текущего процесса (вызывается при остановке воркера)"""
+    try:
+        visit_buffer.flush()
+    except Exception:
+        logger.exception('Не удалось сбросить буфер посещений')
+
+
+atexit.register(flush_visit_buffer)
@@ -0,0 +1,126 @@
+"""
+Постоянные соединения с базой данных и метрики их использования.
+
+Соединения Django принадлежат потоку, поэтому пул процесса — это соединения
+его рабочих потоков. После запроса соединение не закрывается (CONN_MAX_AGE),
+а перед повторным использованием проверяется (CONN_HEALTH_CHECKS).
+Одновременно работать с базой в процессе могут не больше DB_POOL_SIZE
+запросов; остальные ждут до DB_POOL_TIMEOUT секунд, и ожидание учитывается
+в метриках (см. pool_stats).
+
+Под ASGI ограничение не действует, а постоянные соединения отключаются
+(см. configure_asgi): синхронный код каждого запроса выполняется в своем
+потоке, и соединение потока после запроса больше никому не достанется.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_lock = threading.Lock()
+_local = threading.local()
+_semaphore = None
+
+_stats = {
+    'checkouts': 0,       # запросы, получившие место в пуле
+    'reused': 0,          # из них начатые с уже открытым соединением
+    'waits': 0,           # запросы, ожидавшие свободного места
+    'wait_seconds': 0.0,
+    'timeouts': 0,        # не дождались места и выполнились без ограничения
+    'opened': 0,          # открыто соединений
+    'closed': 0,          # закрыто соединений
+    'lifetime_seconds': 0.0,
+    'max_lifetime_seconds': 0.0,
+}
+
+
+def _increment(**values):
+    with _lock:
+        for name, value in values.items():
+            _stats[name] += value
+
+
+def _get_semaphore():
+    global _semaphore
+    if _semaphore is None:
+        size = getattr(settings, 'DB_POOL_SIZE', 0)
+        if size:
+            with _lock:
+                if _semaphore is None:
+                    _semaphore = threading.BoundedSemaphore(size)
+    return _semaphore
+
+
+def pool_stats():
+    """Снимок метрик пула текущего процесса"""
+    with _lock:
+        stats = dict(_stats)
+    stats['open'] = stats['opened'] - stats['closed']
+    stats['size'] = getattr(settings, 'DB_POOL_SIZE', 0)
+    stats['avg_lifetime_seconds'] = (
+        stats['lifetime_seconds'] / stats['closed'] if stats['closed'] else 0.0
+    )
+    return stats
+
+
+def reset_pool_stats():
+    with _lock:
+        for name in _stats:
+            _stats[name] = type(_stats[name])()
+
+
+def configure_asgi():
+    """Отключение постоянных соединений для процесса под ASGI"""
+    for alias in connections:
+        connections.settings[alias]['CONN_MAX_AGE'] = 0
+
+
+def _record_close(connection):
+    lifetime = time.monotonic() - connection._pool_opened_at
+    del connection._pool_opened_at
+    with _lock:
+        _stats['closed'] += 1
+        _stats['lifetime_seconds'] += lifetime
+        _stats['max_lifetime_seconds'] = max(_stats['max_lifetime_seconds'], lifetime)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    # Повторное открытие без request_finished — соединение закрыла проверка здоровья
+    if hasattr(connection, '_pool_opened_at'):
+        _record_close(connection)
+    connection._pool_opened_at = time.monotonic()
+    _increment(opened=1)
+
+
+@receiver(request_started)
+def checkout(sender, **kwargs):
+    if getattr(_local, 'holding', False):
+        return
+    # Запрос ASGI (сигнал передает scope) не ждет места: сигналы запроса
+    # выполняются в потоке синхронного кода, и ожидание останавливало бы его
+    semaphore = None if 'scope' in kwargs else _get_semaphore()
+    if semaphore is not None and not semaphore.acquire(blocking=False):
+        started = time.monotonic()
+        acquired = semaphore.acquire(timeout=getattr(settings, 'DB_POOL_TIMEOUT', 30))
+        _increment(waits=1, wait_seconds=time.monotonic() - started, timeouts=0 if acquired else 1)
+        if not acquired:
+            return
+    _local.holding = semaphore is not None
+    reused = connections['default'].connection is not None
+    _increment(checkouts=1, reused=1 if reused else 0)
+
+
+@receiver(request_finished)
+def checkin(sender, **kwargs):
+    # Выполняется после close_old_connections: закрытые соединения уже закрыты
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is None and hasattr(connection, '_pool_opened_at'):
+            _record_close(connection)
+    if getattr(_local, 'holding', False):
+        _local.holding = False
+        _semaphore.release()
@@ -0,0 +1,111 @@
+"""
+Потоковая выгрузка каталога и личных коллекций в CSV и JSON Lines.
+
+Строки читаются через QuerySet.iterator(chunk_size=...) — на PostgreSQL это
+серверный курсор — и сразу кодируются, поэтому потребление памяти не зависит
+от объема выгрузки. Колонки каталога совпадают с полями команды import_items.
+
+Под ASGI синхронный итератор ответа Django целиком собирает в список, поэтому
+там ответ получает асинхронный итератор: строки читаются пачками в потоке
+запроса (тот же поток и то же соединение с базой, что у представления).
+"""
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+from .models import CollectibleItem, UserCollection
+
+EXPORT_CHUNK_SIZE = 2000
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+CATALOG_COLUMNS = (
+    ('slug', 'slug'),
+    ('name', 'name'),
+    ('description', 'description'),
+    ('issue_date', 'issue_date'),
+    ('country', 'country'),
+    ('condition', 'condition'),
+    ('category', 'category__slug'),
+    ('image', 'image'),
+    ('created_at', 'created_at'),
+)
+
+COLLECTION_COLUMNS = (
+    ('item', 'item__slug'),
+    ('name', 'item__name'),
+    ('category', 'item__category__slug'),
+    ('notes', 'notes'),
+    ('added_at', 'added_at'),
+)
+
+
+def _rows(queryset, columns):
+    return queryset.values_list(*[lookup for _, lookup in columns]).iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    )
+
+
+def catalog_rows():
+    queryset = CollectibleItem.objects.order_by('pk')
+    return CATALOG_COLUMNS, _rows(queryset, CATALOG_COLUMNS)
+
+
+def collection_rows(user):
+    queryset = UserCollection.objects.filter(user=user).order_by('-added_at', '-pk')
+    return COLLECTION_COLUMNS, _rows(queryset, COLLECTION_COLUMNS)
+
+
+def _value(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+class _Echo:
+    """Буфер для csv.writer, который возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def encode_rows(columns, rows, fmt):
+    """Генератор строк выгрузки в формате fmt ('csv' или 'jsonl')"""
+    names = [name for name, _ in columns]
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(names)
+        for row in rows:
+            yield writer.writerow([_value(value) for value in row])
+    else:
+        for row in rows:
+            record = {name: _value(value) for name, value in zip(names, row)}
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+async def _async_chunks(chunks, size=EXPORT_CHUNK_SIZE):
+    """Асинхронный итератор по синхронному: по size строк за одно обращение к потоку"""
+    take = sync_to_async(lambda: ''.join(islice(chunks, size)), thread_sensitive=True)
+    while True:
+        data = await take()
+        if not data:
+            return
+        yield data
+
+
+def streaming_export(request, columns, rows, fmt, filename):
+    chunks = encode_rows(columns, rows, fmt)
+    if isinstance(request, ASGIRequest):
+        chunks = _async_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
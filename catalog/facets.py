@@ -0,0 +1,169 @@
+"""
+Фасетная навигация по каталогу: страна, состояние, категория и год выпуска.
+
+Одним GROUP BY по всем четырем полям строится «куб» — количество предметов
+для каждой встречающейся комбинации значений. Куб кэшируется, и счетчики
+для любого набора фильтров считаются по нему за один проход в памяти:
+значения фасета считаются с учетом фильтров по остальным фасетам, но без
+фильтра по нему самому. Результаты кэшируются по набору фильтров;
+при изменении предметов или категорий версия кэша увеличивается.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.http import urlencode
+
+from .models import Category, CollectibleItem
+
+FACETS = ('category', 'country', 'condition', 'year')
+
+FACET_TITLES = {
+    'category': 'Категория',
+    'country': 'Страна',
+    'condition': 'Состояние',
+    'year': 'Год выпуска',
+}
+
+VERSION_CACHE_KEY = 'facets:version'
+
+
+def _version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        version = 1
+        cache.add(VERSION_CACHE_KEY, version, None)
+    return version
+
+
+def invalidate_facets():
+    """Делает устаревшими все закэшированные счетчики фасетов"""
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 2, None)
+
+
+def _timeout():
+    return getattr(settings, 'FACETS_CACHE_TIMEOUT', 300)
+
+
+def _load_cube(version):
+    """Строки куба (категория, страна, состояние, год, количество) и названия категорий"""
+    key = f'facets:cube:{version}'
+    cube = cache.get(key)
+    if cube is None:
+        rows = CollectibleItem.objects.order_by().annotate(
+            year=ExtractYear('issue_date')
+        ).values_list('category__slug', 'country', 'condition', 'year').annotate(n=Count('pk'))
+        cube = {
+            'rows': [tuple(row) for row in rows],
+            'categories': dict(Category.objects.values_list('slug', 'name')),
+        }
+        cache.set(key, cube, _timeout())
+    return cube
+
+
+def parse_filters(params):
+    """Выбирает из GET-параметров корректные значения фильтров по фасетам"""
+    filters = {}
+    for facet in FACETS:
+        value = params.get(facet, '').strip()
+        if not value:
+            continue
+        if facet == 'year':
+            if not value.isdigit():
+                continue
+            value = int(value)
+        elif facet == 'condition' and value not in dict(CollectibleItem.CONDITION_CHOICES):
+            continue
+        filters[facet] = value
+    return filters
+
+
+def filter_items(queryset, filters, prefix=''):
+    """Применяет фильтры фасетов к QuerySet предметов (prefix — путь к предмету, например 'item__')"""
+    lookups = {
+        'category': 'category__slug',
+        'country': 'country',
+        'condition': 'condition',
+        'year': 'issue_date__year',
+    }
+    return queryset.filter(**{prefix + lookups[facet]: value for facet, value in filters.items()})
+
+
+def facet_counts(filters):
+    """
+    Счетчики значений всех фасетов для набора фильтров: {фасет: {значение: количество}}.
+    """
+    version = _version()
+    key = 'facets:counts:%s:%s' % (version, urlencode(sorted(filters.items())))
+    counts = cache.get(key)
+    if counts is not None:
+        return counts
+
+    counts = {facet: {} for facet in FACETS}
+    selected = [(index, filters[facet]) for index, facet in enumerate(FACETS) if facet in filters]
+    for row in _load_cube(version)['rows']:
+        *values, n = row
+        failed = [index for index, value in selected if values[index] != value]
+        if len(failed) > 1:
+            continue
+        for index, facet in enumerate(FACETS):
+            # Строка, не прошедшая ровно один фильтр, учитывается только в его фасете
+            if failed and failed[0] != index:
+                continue
+            value = values[index]
+            if value is None:
+                continue
+            counts[facet][value] = counts[facet].get(value, 0) + n
+
+    cache.set(key, counts, _timeout())
+    return counts
+
+
+def build_facets(filters):
+    """
+    Данные для шаблона: список фасетов со значениями, счетчиками и ссылками,
+    которые включают или снимают соответствующий фильтр.
+    """
+    counts = facet_counts(filters)
+    labels = {
+        'category': _load_cube(_version())['categories'],
+        'condition': dict(CollectibleItem.CONDITION_CHOICES),
+    }
+
+    facets = []
+    for facet in FACETS:
+        values = []
+        for value, count in counts[facet].items():
+            active = filters.get(facet) == value
+            params = dict(filters)
+            if active:
+                del params[facet]
+            else:
+                params[facet] = value
+            values.append({
+                'value': value,
+                'label': labels.get(facet, {}).get(value, value),
+                'count': count,
+                'active': active,
+                'query': urlencode(sorted(params.items())),
+            })
+        if facet == 'year':
+            values.sort(key=lambda entry: entry['value'], reverse=True)
+        else:
+            values.sort(key=lambda entry: (-entry['count'], str(entry['label'])))
+        facets.append({'name': facet, 'title': FACET_TITLES[facet], 'values': values})
+    return facets
+
+
+@receiver(post_save, sender=CollectibleItem)
+@receiver(post_delete, sender=CollectibleItem)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalog_changed(sender, **kwargs):
+    """Сброс кэша фасетов при изменении предметов или категорий"""
+    invalidate_facets()
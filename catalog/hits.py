@@ -0,0 +1,182 @@
+"""
+Отложенный учет просмотров предметов (django-hitcount).
+
+В запросе просмотр только дописывается строкой JSON в локальный файл
+очереди; файлы разбиты на сегменты по HIT_QUEUE_SEGMENT_SECONDS секунд,
+и каждый процесс пишет в свой файл. Команда process_hits забирает
+завершенные сегменты, отбрасывает просмотры из черных списков и повторы
+(один просмотр на пользователя или сессию в течение HITCOUNT_KEEP_HIT_ACTIVE)
+и записывает остальные пачкой: bulk_create для Hit и один UPDATE на HitCount.
+
+При HIT_QUEUE_ENABLED = False (по умолчанию) просмотр учитывается сразу
+средствами hitcount. Очередь включают, только если process_hits --loop
+запущен рядом с веб-процессами и видит тот же HIT_QUEUE_DIR.
+"""
+import json
+import os
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from hitcount.models import BlacklistIP, BlacklistUserAgent, Hit, HitCount
+from hitcount.utils import get_ip
+from hitcount.views import HitCountMixin
+
+
+def _queue_dir():
+    return Path(getattr(settings, 'HIT_QUEUE_DIR', Path(settings.BASE_DIR) / 'var' / 'hits'))
+
+
+def _segment_seconds():
+    return getattr(settings, 'HIT_QUEUE_SEGMENT_SECONDS', 10)
+
+
+def record_hit(request, hitcount_pk):
+    """Ставит просмотр в очередь; к базе данных не обращается"""
+    user = request.user
+    entry = {
+        'hitcount': hitcount_pk,
+        'user': user.pk if user.is_authenticated else None,
+        'session': request.session.session_key or '',
+        'ip': get_ip(request),
+        'user_agent': request.headers.get('User-Agent', '')[:255],
+        'ts': time.time(),
+    }
+    line = (json.dumps(entry, separators=(',', ':')) + '\n').encode()
+
+    directory = _queue_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    segment = int(entry['ts'] // _segment_seconds())
+    path = directory / f'hits-{segment}-{os.getpid()}.jsonl'
+    # Запись одной строки в режиме O_APPEND атомарна
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def count_hit(request, hitcount_pk):
+    """Учитывает просмотр страницы предмета: через очередь или сразу"""
+    if getattr(settings, 'HIT_QUEUE_ENABLED', False):
+        record_hit(request, hitcount_pk)
+        return
+    hitcount = HitCount.objects.filter(pk=hitcount_pk).first()
+    if hitcount is not None:
+        HitCountMixin.hit_count(request, hitcount)
+
+
+def ready_segments(now=None):
+    """Файлы очереди, в которые уже никто не пишет"""
+    now = time.time() if now is None else now
+    current = int(now // _segment_seconds())
+    ready = []
+    for path in sorted(_queue_dir().glob('hits-*.jsonl')):
+        segment = int(path.name.split('-')[1])
+        if segment < current:
+            ready.append(path)
+    return ready
+
+
+def read_entries(paths):
+    entries = []
+    for path in paths:
+        with open(path, encoding='utf-8') as segment:
+            for line in segment:
+                line = line.strip()
+                if line:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # Оборванная строка при аварийной остановке процесса
+                        continue
+    return entries
+
+
+def _visitor_key(entry):
+    if entry['user']:
+        return ('user', entry['user'])
+    if entry['session']:
+        return ('session', entry['session'])
+    return ('ip', entry['ip'], entry['user_agent'])
+
+
+def apply_hits(entries):
+    """
+    Записывает просмотры из очереди в базу; возвращает количество учтенных.
+    """
+    if not entries:
+        return 0
+
+    blacklisted_ips = set(BlacklistIP.objects.values_list('ip', flat=True))
+    blacklisted_agents = set(BlacklistUserAgent.objects.values_list('user_agent', flat=True))
+    entries = [
+        entry for entry in sorted(entries, key=lambda entry: entry['ts'])
+        if entry['ip'] not in blacklisted_ips and entry['user_agent'] not in blacklisted_agents
+    ]
+
+    hitcount_pks = {entry['hitcount'] for entry in entries}
+    existing = set(HitCount.objects.filter(pk__in=hitcount_pks).values_list('pk', flat=True))
+
+    # Активные просмотры из базы, которые делают новые повторами: только
+    # тех же предметов и тех же посетителей (пользователь, сессия или IP) из пачки
+    visitors = Q()
+    for kind, lookup in (('user', 'user_id__in'), ('session', 'session__in'), ('ip', 'ip__in')):
+        values = {_visitor_key(entry)[1] for entry in entries if _visitor_key(entry)[0] == kind}
+        if values:
+            visitors |= Q(**{lookup: values})
+    seen = set()
+    active = Hit.objects.filter_active().filter(visitors, hitcount_id__in=existing)
+    for hitcount_id, user_id, session, ip, user_agent in active.values_list(
+        'hitcount_id', 'user_id', 'session', 'ip', 'user_agent'
+    ).iterator():
+        visitor = _visitor_key({'user': user_id, 'session': session, 'ip': ip, 'user_agent': user_agent})
+        seen.add((hitcount_id, visitor))
+
+    hits_per_ip_limit = getattr(settings, 'HITCOUNT_HITS_PER_IP_LIMIT', 0)
+    hits_per_ip = Counter()
+    if hits_per_ip_limit:
+        ips = {entry['ip'] for entry in entries}
+        hits_per_ip.update(
+            Hit.objects.filter_active().filter(ip__in=ips).values_list('ip', flat=True)
+        )
+
+    new_hits = []
+    increments = Counter()
+    for entry in entries:
+        if entry['hitcount'] not in existing:
+            continue
+        key = (entry['hitcount'], _visitor_key(entry))
+        if key in seen:
+            continue
+        if hits_per_ip_limit and hits_per_ip[entry['ip']] >= hits_per_ip_limit:
+            continue
+        seen.add(key)
+        hits_per_ip[entry['ip']] += 1
+        increments[entry['hitcount']] += 1
+        new_hits.append(Hit(
+            hitcount_id=entry['hitcount'],
+            user_id=entry['user'],
+            session=entry['session'],
+            ip=entry['ip'],
+            user_agent=entry['user_agent'],
+        ))
+
+    with transaction.atomic():
+        Hit.objects.bulk_create(new_hits, batch_size=1000)
+        for hitcount_pk, amount in increments.items():
+            HitCount.objects.filter(pk=hitcount_pk).update(hits=F('hits') + amount)
+    return len(new_hits)
+
+
+def process_queue(now=None):
+    """Обрабатывает завершенные сегменты очереди и удаляет их; возвращает (прочитано, учтено)"""
+    paths = ready_segments(now)
+    entries = read_entries(paths)
+    counted = apply_hits(entries)
+    for path in paths:
+        path.unlink()
+    return len(entries), counted
@@ -0,0 +1,74 @@
+"""
+HyperLogLog — приблизительный подсчет уникальных значений в памяти фиксированного размера.
+
+Набросок из 2 ** precision однобайтовых регистров; при precision = 12
+(4 КБ) стандартная ошибка оценки около 1,6 %. Наброски объединяются
+поэлементным максимумом регистров, поэтому слияние можно повторять
+и выполнять в любом порядке.
+"""
+import hashlib
+import math
+
+from django.conf import settings
+
+DEFAULT_PRECISION = 12
+
+
+def hash64(value, key=b''):
+    """64-битный хэш строки; key делает хэш невосстановимым без секрета"""
+    digest = hashlib.blake2b(value.encode(), digest_size=8, key=key[:64]).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class HyperLogLog:
+    def __init__(self, registers=None, precision=None):
+        self.precision = precision or getattr(settings, 'VISIT_SKETCH_PRECISION', DEFAULT_PRECISION)
+        size = 1 << self.precision
+        if not registers:
+            registers = bytes(size)
+        if len(registers) != size:
+            raise ValueError(f'Набросок должен занимать {size} байт, а не {len(registers)}')
+        self.registers = bytearray(registers)
+
+    def _position(self, value):
+        """(номер регистра, ранг) для 64-битного хэша"""
+        bits = 64 - self.precision
+        rest = value & ((1 << bits) - 1)
+        return value >> bits, bits - rest.bit_length() + 1
+
+    def contains(self, value):
+        """True, если добавление хэша не изменит набросок"""
+        index, rank = self._position(value)
+        return self.registers[index] >= rank
+
+    def add(self, value):
+        """Добавляет 64-битный хэш; возвращает True, если набросок изменился"""
+        index, rank = self._position(value)
+        if self.registers[index] >= rank:
+            return False
+        self.registers[index] = rank
+        return True
+
+    def merge(self, other):
+        """Объединяет с другим наброском; возвращает True, если этот изменился"""
+        if other.precision != self.precision:
+            raise ValueError('Наброски разной точности')
+        changed = False
+        for index, rank in enumerate(other.registers):
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+                changed = True
+        return changed
+
+    def estimate(self):
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        raw = alpha * size * size / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * size and zeros:
+            # Линейный подсчет точнее на малых количествах
+            return round(size * math.log(size / zeros))
+        return round(raw)
+
+    def to_bytes(self):
+        return bytes(self.registers)
@@ -0,0 +1,141 @@
+"""
+Производные изображений предметов: уменьшенные копии в WebP и в исходном формате.
+
+Производные сохраняются рядом с оригиналом под именами вида
+items/<имя>.<хэш>.<ширина>w.<расширение>, где хэш берется от содержимого
+оригинала, поэтому уже созданные файлы повторно не генерируются. Сведения
+о созданных вариантах хранятся в CollectibleItem.image_variants и
+используются шаблонным тегом item_picture для srcset.
+
+Генерация выполняется вне запроса: в фоновом потоке после сохранения
+предмета и командой generate_image_derivatives.
+"""
+import hashlib
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from PIL import Image
+
+from .models import CollectibleItem
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _widths():
+    return getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (320, 640, 1280))
+
+
+def source_hash(name, storage=default_storage):
+    """Хэш содержимого исходного изображения"""
+    digest = hashlib.sha1()
+    with storage.open(name, 'rb') as source:
+        for chunk in iter(lambda: source.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def derivative_name(name, digest, width, extension):
+    """Имя производного файла рядом с оригиналом"""
+    stem = posixpath.splitext(name)[0]
+    return f'{stem}.{digest}.{width}w.{extension}'
+
+
+def fallback_extension(name):
+    """Формат для браузеров без WebP: PNG для PNG-оригиналов, иначе JPEG"""
+    return 'png' if name.lower().endswith('.png') else 'jpg'
+
+
+def _encode(image, extension):
+    buffer = BytesIO()
+    if extension == 'webp':
+        image.save(buffer, 'WEBP', quality=80, method=4)
+    elif extension == 'png':
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        if image.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.convert('RGBA').split()[-1])
+            image = background
+        image.save(buffer, 'JPEG', quality=82, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def generate_derivatives(name, storage=default_storage):
+    """
+    Создает производные для изображения name и возвращает описание вариантов
+    {'hash': ..., 'widths': [...], 'fallback': 'jpg'|'png'}.
+    """
+    digest = source_hash(name, storage)
+    fallback = fallback_extension(name)
+
+    with storage.open(name, 'rb') as source:
+        original = Image.open(source)
+        original.load()
+    if original.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        original = original.convert('RGBA')
+
+    # Увеличение не выполняется: ширины больше оригинала пропускаются
+    widths = [width for width in _widths() if width < original.width] or [original.width]
+    for width in widths:
+        resized = None
+        for extension in ('webp', fallback):
+            target = derivative_name(name, digest, width, extension)
+            if storage.exists(target):
+                continue
+            if resized is None:
+                height = max(1, round(original.height * width / original.width))
+                resized = original.resize((width, height), Image.LANCZOS)
+            storage.save(target, ContentFile(_encode(resized, extension)))
+
+    return {'hash': digest, 'widths': widths, 'fallback': fallback}
+
+
+def process_item(pk):
+    """Создает производные для изображения предмета и сохраняет сведения о них"""
+    item = CollectibleItem.objects.filter(pk=pk).only('image', 'image_variants').first()
+    if item is None or not item.image:
+        return None
+    name = item.image.name
+    variants = dict(generate_derivatives(name), source=name)
+    if variants != item.image_variants:
+        # Обновляем, только если изображение не сменилось за время обработки
+        CollectibleItem.objects.filter(pk=pk, image=name).update(image_variants=variants)
+    return variants
+
+
+def _process_in_background(pk):
+    try:
+        process_item(pk)
+    except Exception:
+        logger.exception('Не удалось создать производные изображения предмета %s', pk)
+    finally:
+        close_old_connections()
+
+
+def schedule_item(pk):
+    """Ставит обработку изображения предмета в фоновую очередь процесса"""
+    global _executor
+    if not getattr(settings, 'IMAGE_DERIVATIVES_ASYNC', True):
+        process_item(pk)
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-derivatives')
+    _executor.submit(_process_in_background, pk)
+
+
+@receiver(post_save, sender=CollectibleItem)
+def item_image_saved(sender, instance, **kwargs):
+    """Запуск генерации производных, если у предмета новое изображение"""
+    if instance.image and instance.image_variants.get('source') != instance.image.name:
+        pk = instance.pk
+        transaction.on_commit(lambda: schedule_item(pk))
@@ -0,0 +1,73 @@
+import statistics
+import time
+from wsgiref.util import setup_testing_defaults
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import override_settings
+
+from catalog.db_pool import pool_stats, reset_pool_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает время ответа страницы с закрытием соединения после каждого '
+        'запроса (CONN_MAX_AGE = 0) и с постоянными соединениями'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/', help='Адрес страницы')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+
+    def handle(self, *args, **options):
+        connection = connections['default']
+        configured = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            persistent = configured or 600
+            for max_age in (0, persistent):
+                timings, stats = self.measure(connection, max_age, options)
+                self.report(f'CONN_MAX_AGE={max_age}', timings, stats)
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = configured
+
+    def measure(self, connection, max_age, options):
+        # close_at вычисляется при открытии соединения, поэтому закрываем текущее
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        timings = []
+        # Страница должна строиться, а не отдаваться из кэша
+        with override_settings(PAGE_CACHE_ENABLED=False, ALLOWED_HOSTS=['*']):
+            handler = WSGIHandler()
+            for _ in range(options['warmup']):
+                self.request(handler, options['path'])
+            reset_pool_stats()
+            for _ in range(options['requests']):
+                started = time.perf_counter()
+                self.request(handler, options['path'])
+                timings.append((time.perf_counter() - started) * 1000)
+        return timings, pool_stats()
+
+    def request(self, handler, path):
+        """Запрос так, как его выполняет WSGI-сервер, включая request_finished"""
+        environ = {'PATH_INFO': path, 'HTTP_HOST': 'localhost'}
+        setup_testing_defaults(environ)
+        status = []
+        response = handler(environ, lambda code, headers: status.append(code))
+        try:
+            b''.join(response)
+        finally:
+            response.close()
+        if not status[0].startswith('200'):
+            self.stderr.write(f'Код ответа {status[0]}')
+
+    def report(self, label, timings, stats):
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f'{label}: среднее {statistics.mean(timings):.2f} мс, медиана {statistics.median(timings):.2f} мс, '
+            f'p95 {p95:.2f} мс; открыто соединений {stats["opened"]}, '
+            f'запросов с готовым соединением {stats["reused"]} из {stats["checkouts"]}'
+        )
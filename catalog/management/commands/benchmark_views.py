@@ -0,0 +1,145 @@
+import json
+import random
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from hitcount.models import Hit
+
+from catalog import metrics
+from catalog.models import Category, CollectibleItem, Comment, UserCollection, Vote
+
+from .seed_benchmark_data import PREFIX
+
+# имя URL: (AJAX, нужен вход); только представления без записи в базу
+VIEWS = {
+    'index': (False, False),
+    'search': (False, False),
+    'category_list': (False, False),
+    'category_detail': (False, False),
+    'item_detail': (False, True),
+    'item_comments': (True, False),
+    'user_collection': (False, True),
+    'profile': (False, True),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет время ответа представлений через тестовый клиент на данных '
+        'seed_benchmark_data и записывает p50/p95 и число SQL-запросов в JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на представление')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--view', action='append', choices=sorted(VIEWS), dest='views',
+                            help='Замерить только эти представления')
+        parser.add_argument('--output', help='Файл для результатов; по умолчанию stdout')
+        parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 2:
+            raise CommandError('Для перцентилей нужно хотя бы два запроса')
+        user = User.objects.filter(username=f'{PREFIX}0').first()
+        if user is None:
+            raise CommandError('Нет данных для замеров, запустите seed_benchmark_data')
+
+        self.random = random.Random(options['seed'])
+        self.slugs = list(
+            CollectibleItem.objects.filter(slug__startswith=f'{PREFIX}-item-').values_list('slug', flat=True)
+        )
+        self.categories = list(
+            Category.objects.filter(slug__startswith=f'{PREFIX}-category-').values_list('slug', flat=True)
+        )
+
+        results = {}
+        # Страницы должны строиться, а не отдаваться из кэша; просмотры уходят
+        # во временную очередь, чтобы не менять данные между запусками
+        with tempfile.TemporaryDirectory() as queue_dir, override_settings(
+            PAGE_CACHE_ENABLED=False, HIT_QUEUE_ENABLED=True, HIT_QUEUE_DIR=queue_dir, ALLOWED_HOSTS=['*'],
+        ):
+            for name in options['views'] or VIEWS:
+                results[name] = self.measure(name, user, options)
+                self.stderr.write(
+                    f'{name}: p50 {results[name]["p50_ms"]} мс, p95 {results[name]["p95_ms"]} мс, '
+                    f'SQL {results[name]["queries"]}'
+                )
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'cache': settings.CACHES['default']['BACKEND'],
+            'requests': options['requests'],
+            'dataset': self.dataset(),
+            'views': results,
+        }
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                stream.write(data + '\n')
+        else:
+            self.stdout.write(data)
+
+    def url(self, name):
+        if name == 'category_detail':
+            return reverse(name, kwargs={'slug': self.random.choice(self.categories)})
+        if name in ('item_detail', 'item_comments'):
+            return reverse(name, kwargs={'slug': self.random.choice(self.slugs)})
+        if name == 'search':
+            return reverse(name) + '?q=' + str(self.random.randrange(len(self.slugs)))
+        return reverse(name)
+
+    def measure(self, name, user, options):
+        ajax, login = VIEWS[name]
+        client = Client()
+        if login:
+            client.force_login(user)
+        headers = {'X-Requested-With': 'XMLHttpRequest'} if ajax else {}
+
+        for _ in range(options['warmup']):
+            self.request(client, name, headers)
+        metrics.reset_metrics()
+        timings = []
+        for _ in range(options['requests']):
+            url = self.url(name)
+            # Кэш фасетов и прочих фрагментов остается теплым, как на рабочем сервере
+            started = time.perf_counter()
+            self.request(client, name, headers, url)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        stats = metrics.view_stats().get(name, {})
+        percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+        return {
+            'count': len(timings),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'p50_ms': round(percentiles[49], 3),
+            'p95_ms': round(percentiles[94], 3),
+            'max_ms': round(max(timings), 3),
+            'queries': round(stats['sql_count'] / stats['count'], 2) if stats.get('count') else None,
+        }
+
+    def request(self, client, name, headers, url=None):
+        response = client.get(url or self.url(name), headers=headers)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code != 200:
+            raise CommandError(f'{name}: код ответа {response.status_code}')
+
+    def dataset(self):
+        return {
+            'items': CollectibleItem.objects.count(),
+            'categories': Category.objects.count(),
+            'users': User.objects.count(),
+            'votes': Vote.objects.count(),
+            'hits': Hit.objects.count(),
+            'comments': Comment.objects.count(),
+            'collection': UserCollection.objects.count(),
+        }
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.recommendations import rebuild_recommendations, refresh_recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает рекомендации по совместной встречаемости предметов в коллекциях: '
+        'только затронутые изменениями коллекций или, с --full, все'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Пересчитать все рекомендации')
+        parser.add_argument('--loop', action='store_true',
+                            help='Работать постоянно, проверяя изменения каждые --interval секунд')
+        parser.add_argument('--interval', type=float, default=60,
+                            help='Пауза между проверками в режиме --loop')
+
+    def handle(self, *args, **options):
+        if options['full']:
+            items, written = rebuild_recommendations()
+            self.stdout.write(self.style.SUCCESS(f'Предметов: {items}, рекомендаций: {written}'))
+            return
+        while True:
+            items, written = refresh_recommendations()
+            if items or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Пересчитано предметов: {items}, рекомендаций: {written}'
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
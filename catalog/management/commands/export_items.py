@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.exports import FORMATS, catalog_rows, collection_rows, encode_rows
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка каталога или коллекции пользователя в CSV или JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=tuple(FORMATS), default='csv')
+        parser.add_argument('--user', help='Выгрузить коллекцию пользователя с этим логином')
+        parser.add_argument('--output', help='Файл для записи; по умолчанию стандартный вывод')
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f'Пользователь {options["user"]} не найден')
+            columns, rows = collection_rows(user)
+        else:
+            columns, rows = catalog_rows()
+
+        chunks = encode_rows(columns, rows, options['format'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as target:
+                target.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
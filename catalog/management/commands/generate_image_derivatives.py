@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from catalog.images import process_item
+from catalog.models import CollectibleItem
+
+
+class Command(BaseCommand):
+    help = 'Создает уменьшенные копии и WebP-варианты изображений предметов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Проверить все предметы, а не только без актуальных производных')
+
+    def handle(self, *args, **options):
+        items = CollectibleItem.objects.exclude(image='').exclude(image__isnull=True)
+        processed = 0
+        for pk, image, variants in items.values_list('pk', 'image', 'image_variants').iterator():
+            if not options['all'] and (variants or {}).get('source') == image:
+                continue
+            try:
+                process_item(pk)
+            except Exception as error:
+                self.stderr.write(f'{image}: {error}')
+                continue
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(f'Обработано изображений: {processed}'))
@@ -0,0 +1,170 @@
+import csv
+import datetime
+import json
+import os
+from collections import Counter
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from catalog.facets import invalidate_facets
+from catalog.models import Category, CollectibleItem, shift_category_counts
+from catalog.page_cache import CATEGORIES_TAG, ITEMS_TAG, invalidate_tags
+from catalog.search import index_items
+from catalog.slugs import allocate_slugs
+
+CONDITIONS = dict(CollectibleItem.CONDITION_CHOICES)
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоковый импорт предметов из JSON Lines или CSV. Поля: name, description, '
+        'country, condition, category (слаг категории), issue_date (ГГГГ-ММ-ДД), '
+        'необязательные slug и image'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .jsonl или .csv')
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            help='Формат файла; по умолчанию определяется по расширению')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--resume', action='store_true',
+                            help='Продолжить с места, сохраненного в <файл>.progress')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        checkpoint = path + '.progress'
+
+        start = 0
+        if options['resume'] and os.path.exists(checkpoint):
+            start = self.load_checkpoint(checkpoint)
+            self.stdout.write(f'Продолжение с записи {start + 1}')
+
+        self.categories = dict(Category.objects.values_list('slug', 'pk'))
+        self.taken_slugs = set()
+        imported = skipped = errors = 0
+        position = start
+
+        with open(path, encoding='utf-8-sig', newline='') as source:
+            records = islice(self.read_records(source, fmt), start, None)
+            while True:
+                batch = list(islice(records, options['batch_size']))
+                if not batch:
+                    break
+                items, batch_skipped, batch_errors = self.build_items(batch, position)
+                with transaction.atomic():
+                    CollectibleItem.objects.bulk_create(items)
+                    shift_category_counts(Counter(item.category_id for item in items))
+                    # bulk_create не вызывает сигналы: индексируем только новые строки
+                    index_items(items)
+                    self.save_checkpoint(checkpoint, position, position + len(batch), items)
+                position += len(batch)
+                imported += len(items)
+                skipped += batch_skipped
+                errors += batch_errors
+                self.stdout.write(f'Обработано записей: {position}, импортировано: {imported}')
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        if imported:
+            invalidate_facets()
+            invalidate_tags(ITEMS_TAG, CATEGORIES_TAG)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано: {imported}, пропущено существующих: {skipped}, ошибок: {errors}'
+        ))
+
+    def save_checkpoint(self, checkpoint, start, end, items):
+        """
+        Позиция записывается до фиксации пачки вместе со слагом ее последнего
+        предмета: при продолжении по нему видно, зафиксирована ли пачка
+        (см. load_checkpoint), и сбой между фиксацией и записью файла
+        не приводит к повторной вставке предметов с выделенными слагами.
+        """
+        state = {'start': start, 'end': end, 'slug': items[-1].slug if items else None}
+        with open(checkpoint + '.tmp', 'w') as progress:
+            json.dump(state, progress)
+        os.replace(checkpoint + '.tmp', checkpoint)
+
+    def load_checkpoint(self, checkpoint):
+        """Номер записи, с которой продолжается импорт"""
+        with open(checkpoint) as progress:
+            state = json.loads(progress.read().strip() or '0')
+        if isinstance(state, int):
+            return state
+        if state['slug'] is None or CollectibleItem.objects.filter(slug=state['slug']).exists():
+            return state['end']
+        return state['start']
+
+    def read_records(self, source, fmt):
+        if fmt == 'csv':
+            yield from csv.DictReader(source)
+            return
+        for line in source:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+    def build_items(self, batch, position):
+        """Предметы пачки без сохранения; возвращает (предметы, пропущено, ошибок)"""
+        items, errors = [], 0
+        for number, record in enumerate(batch, start=position + 1):
+            try:
+                items.append(self.build_item(record))
+            except (CommandError, KeyError, TypeError, ValueError) as error:
+                self.stderr.write(f'Запись {number}: {error}')
+                errors += 1
+
+        # Явно заданный слаг, который уже есть в базе, означает уже импортированную запись
+        explicit = [item.slug for item in items if item.slug]
+        existing = set(
+            CollectibleItem.objects.filter(slug__in=explicit).values_list('slug', flat=True)
+        )
+        fresh = [item for item in items if item.slug not in existing]
+        skipped = len(items) - len(fresh)
+        for item in fresh:
+            if item.slug and item.slug in self.taken_slugs:
+                # Повтор слага внутри файла: выделяем новый
+                item.slug = ''
+            if item.slug:
+                self.taken_slugs.add(item.slug)
+
+        unnamed = [item for item in fresh if not item.slug]
+        slugs = allocate_slugs(
+            CollectibleItem, [item.name for item in unnamed], self.taken_slugs,
+            max_length=CollectibleItem._meta.get_field('slug').max_length,
+        )
+        for item, slug in zip(unnamed, slugs):
+            item.slug = slug
+        return fresh, skipped, errors
+
+    def build_item(self, record):
+        if not isinstance(record, dict):
+            raise CommandError('некорректная строка')
+        name = (record.get('name') or '').strip()
+        if not name:
+            raise CommandError('не указано название')
+        category = self.categories.get((record.get('category') or '').strip())
+        if category is None:
+            raise CommandError(f'неизвестная категория «{record.get("category")}»')
+        condition = (record.get('condition') or '').strip()
+        if condition not in CONDITIONS:
+            raise CommandError(f'неизвестное состояние «{condition}»')
+        issue_date = (record.get('issue_date') or '').strip()
+        return CollectibleItem(
+            name=name[:200],
+            slug=(record.get('slug') or '').strip(),
+            description=record.get('description') or '',
+            country=(record.get('country') or '').strip()[:100],
+            condition=condition,
+            category_id=category,
+            issue_date=datetime.date.fromisoformat(issue_date) if issue_date else None,
+            image=(record.get('image') or '').strip() or None,
+        )
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.hits import process_queue
+
+
+class Command(BaseCommand):
+    help = 'Учитывает просмотры предметов из очереди catalog.hits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Работать постоянно, проверяя очередь каждые --interval секунд')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Пауза между проверками очереди в режиме --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            read, counted = process_queue()
+            if read or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Прочитано просмотров: {read}, учтено: {counted}'
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
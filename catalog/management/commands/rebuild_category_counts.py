@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from catalog.models import Category, CollectibleItem
+from catalog.page_cache import CATEGORIES_TAG, invalidate_tags
+
+
+def item_count():
+    """Подзапрос с фактическим количеством предметов категории"""
+    counts = CollectibleItem.objects.filter(category=OuterRef('pk')).order_by().values('category')
+    return Coalesce(
+        Subquery(counts.annotate(c=Count('pk')).values('c'), output_field=IntegerField()), 0
+    )
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики предметов категорий'
+
+    def handle(self, *args, **options):
+        drifted = Category.objects.annotate(actual=item_count()).filter(~Q(item_count=F('actual')))
+        # Пересчет одним UPDATE с подзапросом, чтобы не затереть изменения, поступившие параллельно
+        fixed = Category.objects.filter(pk__in=drifted.values('pk')).update(item_count=item_count())
+        if fixed:
+            invalidate_tags(CATEGORIES_TAG)
+        self.stdout.write(self.style.SUCCESS(f'Исправлено категорий: {fixed}'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from catalog.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс предметов (FTS5 на SQLite)'
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс перестроен'))
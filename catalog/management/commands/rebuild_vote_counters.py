@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from catalog.models import CollectibleItem, Comment, Vote
+from catalog.page_cache import ITEMS_TAG, category_tag, invalidate_tags, item_tag
+
+
+def _count(queryset):
+    counts = queryset.filter(item=OuterRef('pk')).order_by().values('item')
+    return Coalesce(
+        Subquery(counts.annotate(c=Count('pk')).values('c'), output_field=IntegerField()), 0
+    )
+
+
+def vote_count(value):
+    """Подзапрос с фактическим количеством голосов value за предмет"""
+    return _count(Vote.objects.filter(value=value))
+
+
+def comment_count():
+    """Подзапрос с фактическим количеством комментариев к предмету"""
+    return _count(Comment.objects.all())
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики лайков, дизлайков и комментариев предметов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        drifted = CollectibleItem.objects.annotate(
+            actual_likes=vote_count(True),
+            actual_dislikes=vote_count(False),
+            actual_comments=comment_count(),
+        ).filter(
+            ~Q(likes_count=F('actual_likes'))
+            | ~Q(dislikes_count=F('actual_dislikes'))
+            | ~Q(comments_count=F('actual_comments'))
+        ).values_list('pk', flat=True)
+
+        fixed = 0
+        batch = []
+        for pk in drifted.iterator(chunk_size=batch_size):
+            batch.append(pk)
+            if len(batch) >= batch_size:
+                fixed += self._rebuild(batch)
+                batch = []
+        if batch:
+            fixed += self._rebuild(batch)
+        if fixed:
+            # Карточки списков показывают счетчики, которые могли быть неверными
+            invalidate_tags(ITEMS_TAG)
+
+        self.stdout.write(self.style.SUCCESS(f'Исправлено предметов: {fixed}'))
+
+    def _rebuild(self, pks):
+        items = CollectibleItem.objects.filter(pk__in=pks)
+        # Пересчет одним UPDATE с подзапросами, чтобы не затереть голоса, поступившие параллельно
+        fixed = items.update(
+            likes_count=vote_count(True),
+            dislikes_count=vote_count(False),
+            comments_count=comment_count(),
+        )
+        categories = items.order_by().values_list('category_id', flat=True).distinct()
+        invalidate_tags(*map(item_tag, pks), *map(category_tag, categories))
+        return fixed
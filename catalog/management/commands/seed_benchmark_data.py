@@ -0,0 +1,189 @@
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from hitcount.models import Hit, HitCount
+
+from catalog.facets import invalidate_facets
+from catalog.models import Category, CollectibleItem, Comment, UserCollection, Vote
+from catalog.page_cache import CATEGORIES_TAG, ITEMS_TAG, invalidate_tags
+from catalog.recommendations import rebuild_recommendations
+from catalog.search import rebuild_index
+from users.models import Profile
+
+PREFIX = 'bench'
+COUNTRIES = ('Россия', 'СССР', 'Германия', 'Франция', 'США', 'Япония', 'Китай', 'Индия')
+WORDS = ('монета', 'марка', 'значок', 'банкнота', 'открытка', 'медаль', 'жетон', 'конверт')
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу большим набором данных для benchmark_views: предметы, '
+        'пользователи, голоса, просмотры и комментарии. Счетчики предметов, '
+        'поисковый индекс, фасеты и рекомендации пересчитываются в конце'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100_000)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--users', type=int, default=2_000)
+        parser.add_argument('--votes', type=int, default=1_000_000)
+        parser.add_argument('--hits', type=int, default=1_000_000)
+        parser.add_argument('--comments', type=int, default=100_000)
+        parser.add_argument('--collection', type=int, default=500,
+                            help='Размер коллекции первого пользователя (bench0)')
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError('Данные для замеров уже созданы')
+        if min(options['items'], options['categories'], options['users']) < 1:
+            raise CommandError('Нужен хотя бы один предмет, категория и пользователь')
+        if options['votes'] > options['items'] * options['users']:
+            raise CommandError('Голосов больше, чем пар пользователь-предмет')
+
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        categories = self.create_categories(options['categories'])
+        item_pks = self.create_items(categories, options['items'])
+        user_pks = self.create_users(options['users'])
+        self.create_votes(item_pks, user_pks, options['votes'])
+        self.create_comments(item_pks, user_pks, options['comments'])
+        self.create_hits(item_pks, user_pks, options['hits'])
+        self.create_collection(item_pks, user_pks[0], options['collection'])
+
+        self.stdout.write('Пересчет счетчиков, поискового индекса, фасетов и рекомендаций')
+        call_command('rebuild_vote_counters', batch_size=self.batch_size, stdout=self.stdout)
+        call_command('rebuild_category_counts', stdout=self.stdout)
+        rebuild_index()
+        invalidate_facets()
+        invalidate_tags(ITEMS_TAG, CATEGORIES_TAG)
+        rebuild_recommendations()
+        self.stdout.write(self.style.SUCCESS('Готово'))
+
+    def bulk(self, model, rows, total):
+        """Записывает объекты пачками по batch_size, каждую в своей транзакции"""
+        created = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                created += self.flush(model, batch, total)
+                batch = []
+        if batch:
+            created += self.flush(model, batch, total)
+        return created
+
+    def flush(self, model, batch, total):
+        with transaction.atomic():
+            model.objects.bulk_create(batch, batch_size=self.batch_size)
+        self.stdout.write(f'{model._meta.verbose_name_plural}: +{len(batch)} (из {total})')
+        return len(batch)
+
+    def create_categories(self, count):
+        categories = [
+            Category(name=f'Замеры {n}', slug=f'{PREFIX}-category-{n}', description='Категория для замеров')
+            for n in range(count)
+        ]
+        Category.objects.bulk_create(categories)
+        return list(Category.objects.filter(slug__startswith=f'{PREFIX}-category-'))
+
+    def create_items(self, categories, count):
+        conditions = [value for value, _ in CollectibleItem.CONDITION_CHOICES]
+        start = datetime.date(1900, 1, 1)
+
+        def rows():
+            for n in range(count):
+                word = self.random.choice(WORDS)
+                yield CollectibleItem(
+                    name=f'{word.capitalize()} {n}',
+                    slug=f'{PREFIX}-item-{n}',
+                    description=f'Описание: {word} номер {n} для замеров производительности.',
+                    issue_date=start + datetime.timedelta(days=self.random.randrange(45_000)),
+                    country=self.random.choice(COUNTRIES),
+                    condition=self.random.choice(conditions),
+                    category=self.random.choice(categories),
+                )
+
+        self.bulk(CollectibleItem, rows(), count)
+        return list(
+            CollectibleItem.objects.filter(slug__startswith=f'{PREFIX}-item-').order_by('pk').values_list('pk', flat=True)
+        )
+
+    def create_users(self, count):
+        # Хэш пароля один на всех: его вычисление дороже самой вставки
+        password = make_password(PREFIX)
+        self.bulk(User, (User(username=f'{PREFIX}{n}', password=password) for n in range(count)), count)
+        user_pks = list(User.objects.filter(username__startswith=PREFIX).order_by('pk').values_list('pk', flat=True))
+        # bulk_create не отправляет post_save, профили создаем сами
+        self.bulk(Profile, (Profile(user_id=pk) for pk in user_pks), count)
+        return user_pks
+
+    def create_votes(self, item_pks, user_pks, count):
+        # Каждый пользователь голосует за подряд идущие предметы со своим сдвигом,
+        # поэтому пары (предмет, пользователь) не повторяются
+        per_user, extra = divmod(count, len(user_pks))
+
+        def rows():
+            for index, user_pk in enumerate(user_pks):
+                offset = self.random.randrange(len(item_pks))
+                for k in range(per_user + (1 if index < extra else 0)):
+                    yield Vote(
+                        item_id=item_pks[(offset + k) % len(item_pks)], user_id=user_pk,
+                        value=self.random.random() < 0.8,
+                    )
+
+        self.bulk(Vote, rows(), count)
+
+    def create_comments(self, item_pks, user_pks, count):
+        rows = (
+            Comment(
+                item_id=self.random.choice(item_pks), user_id=self.random.choice(user_pks),
+                text=f'Комментарий {n} для замеров',
+            )
+            for n in range(count)
+        )
+        self.bulk(Comment, rows, count)
+
+    def create_hits(self, item_pks, user_pks, count):
+        content_type = ContentType.objects.get_for_model(CollectibleItem)
+        totals = [0] * len(item_pks)
+        for _ in range(count):
+            totals[self.random.randrange(len(item_pks))] += 1
+        hitcounts = (
+            HitCount(content_type=content_type, object_pk=pk, hits=hits)
+            for pk, hits in zip(item_pks, totals)
+        )
+        self.bulk(HitCount, hitcounts, len(item_pks))
+        hitcount_pks = dict(
+            HitCount.objects.filter(content_type=content_type, object_pk__gte=item_pks[0])
+            .values_list('object_pk', 'pk').iterator(chunk_size=self.batch_size)
+        )
+
+        def rows():
+            for pk, hits in zip(item_pks, totals):
+                for _ in range(hits):
+                    user_pk = self.random.choice(user_pks) if self.random.random() < 0.3 else None
+                    yield Hit(
+                        hitcount_id=hitcount_pks[pk], user_id=user_pk,
+                        ip=f'10.{self.random.randrange(256)}.{self.random.randrange(256)}.{self.random.randrange(256)}',
+                        session=f'{PREFIX}{self.random.getrandbits(64):x}', user_agent=PREFIX,
+                    )
+
+        self.bulk(Hit, rows(), count)
+        # created заполняется при вставке (auto_now_add). Просмотры делаем давними,
+        # чтобы они не мешали учету новых в пределах HITCOUNT_KEEP_HIT_ACTIVE
+        Hit.objects.filter(user_agent=PREFIX).update(created=timezone.now() - datetime.timedelta(days=30))
+
+    def create_collection(self, item_pks, user_pk, count):
+        picked = self.random.sample(item_pks, min(count, len(item_pks)))
+        rows = (UserCollection(user_id=user_pk, item_id=pk, notes='Для замеров') for pk in picked)
+        self.bulk(UserCollection, rows, len(picked))
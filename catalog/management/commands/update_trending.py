@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.trending import update_trending
+
+
+class Command(BaseCommand):
+    help = 'Учитывает новые просмотры, лайки, комментарии и добавления в коллекции в популярности предметов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Работать постоянно, запускаясь каждые --interval секунд')
+        parser.add_argument('--interval', type=float, default=60,
+                            help='Пауза между запусками в режиме --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            processed, pruned = update_trending()
+            if any(processed.values()) or pruned or not options['loop']:
+                events = ', '.join(f'{name}: {count}' for name, count in processed.items())
+                self.stdout.write(self.style.SUCCESS(f'Учтено событий ({events}), удалено строк: {pruned}'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
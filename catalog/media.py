@@ -0,0 +1,193 @@
+"""
+Отдача загруженных файлов из MEDIA_ROOT без сессий, авторизации и URLconf.
+
+MediaFilesMiddleware стоит сразу после статики и отвечает на GET и HEAD под
+MEDIA_URL. Производные изображений (см. catalog.images) содержат хэш в имени
+и под тем же именем не меняются: ETag берется из имени, а Cache-Control —
+immutable на год. Для остальных файлов ETag строится из размера и времени
+изменения, Cache-Control — MEDIA_CACHE_MAX_AGE секунд с проверкой по ETag.
+Содержимое для ETag не читается.
+
+Поддерживаются If-None-Match (304), Range с одним диапазоном (206, 416)
+и If-Range. Под WSGI файл отдается через FileResponse, и сервер может
+передать его через wsgi.file_wrapper (sendfile). Под ASGI stat и open
+выполняются вне цикла событий, а тело читается асинхронным итератором
+по CHUNK_SIZE байт, поэтому файл не собирается в памяти целиком.
+"""
+import mimetypes
+import os
+import re
+import stat
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import parse_etags
+
+# items/<имя>.<хэш>.<ширина>w.<расширение>
+HASHED_NAME = re.compile(r'\.([0-9a-f]{12})\.(\d+)w\.([a-z0-9]+)$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(path, info):
+    """ETag: хэш из имени производной или размер и время изменения файла"""
+    match = HASHED_NAME.search(path)
+    if match:
+        digest, width, extension = match.groups()
+        return f'"{digest}-{width}-{extension}"'
+    return f'"{info.st_size:x}-{info.st_mtime_ns:x}"'
+
+
+def media_path(path_info):
+    """Путь к файлу в MEDIA_ROOT для URL или None, если это не медиафайл"""
+    prefix = settings.MEDIA_URL
+    if not prefix.startswith('/') or not path_info.startswith(prefix):
+        return None
+    name = path_info[len(prefix):]
+    if not name or name.endswith('/'):
+        return None
+    try:
+        return safe_join(settings.MEDIA_ROOT, name)
+    except (SuspiciousFileOperation, ValueError):
+        return None
+
+
+def parse_range(header, size):
+    """
+    (начало, конец) включительно для заголовка Range; None, если заголовок
+    нужно игнорировать (нет, несколько диапазонов, неверный синтаксис),
+    и False, если диапазон не пересекается с файлом.
+    """
+    match = RANGE.match(header.replace(' ', ''))
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        # Последние end байт
+        length = int(end)
+        if not length:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        return False
+    return start, min(int(end), size - 1) if end else size - 1
+
+
+class MediaFileResponse(FileResponse):
+    block_size = CHUNK_SIZE
+
+
+class _RangeFile:
+    """Файл, из которого читается не больше length байт"""
+
+    def __init__(self, source, length):
+        self.source = source
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.source.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.source.close()
+
+
+async def aiter_file(source, length=None):
+    """
+    Асинхронное чтение length байт файла (без length — до конца);
+    чтение выполняется в потоках
+    """
+    read = sync_to_async(source.read, thread_sensitive=False)
+    try:
+        while length is None or length > 0:
+            data = await read(CHUNK_SIZE if length is None else min(CHUNK_SIZE, length))
+            if not data:
+                break
+            if length is not None:
+                length -= len(data)
+            yield data
+    finally:
+        source.close()
+
+
+def _not_modified(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    # Для If-None-Match используется слабое сравнение
+    tags = [tag.removeprefix('W/') for tag in parse_etags(header)]
+    return '*' in tags or etag in tags
+
+
+def serve_media(request, path, asynchronous=False):
+    """
+    Ответ с файлом path или None, если такого файла нет; с asynchronous
+    тело ответа — асинхронный итератор (для ASGI).
+    """
+    try:
+        info = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if not stat.S_ISREG(info.st_mode):
+        return None
+
+    size = info.st_size
+    etag = file_etag(path, info)
+    if HASHED_NAME.search(path):
+        cache_control = IMMUTABLE
+    else:
+        cache_control = f'public, max-age={getattr(settings, "MEDIA_CACHE_MAX_AGE", 3600)}'
+    headers = {'ETag': etag, 'Cache-Control': cache_control, 'Accept-Ranges': 'bytes'}
+
+    if _not_modified(request, etag):
+        return HttpResponse(status=304, headers=headers)
+
+    content_type, encoding = mimetypes.guess_type(path)
+    if encoding:
+        # Сжатый файл отдается как есть, а не распаковывается браузером
+        content_type = 'application/octet-stream'
+    headers['Content-Type'] = content_type or 'application/octet-stream'
+
+    byte_range = None
+    if size and 'Range' in request.headers:
+        # If-Range с другим ETag (или датой) — отдаем файл целиком
+        if request.headers.get('If-Range', etag) == etag:
+            byte_range = parse_range(request.headers['Range'], size)
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{size}'
+        return HttpResponse(status=416, headers=headers)
+
+    status = 200
+    start, end = 0, size - 1
+    if byte_range:
+        start, end = byte_range
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+
+    if request.method == 'HEAD':
+        return HttpResponse(status=status, headers=headers)
+    source = open(path, 'rb')
+    if asynchronous:
+        source.seek(start)
+        return StreamingHttpResponse(aiter_file(source, end - start + 1), status=status, headers=headers)
+    if status == 206:
+        source.seek(start)
+        source = _RangeFile(source, end - start + 1)
+    response = MediaFileResponse(source, status=status)
+    # FileResponse подставляет свои заголовки по файлу, наши точнее
+    for name, value in headers.items():
+        response[name] = value
+    return response
@@ -0,0 +1,162 @@
+"""
+Метрики запросов: SQL, шаблоны, кэш и общее время.
+
+RequestMetricsMiddleware создает для запроса RequestMetrics и кладет его
+в current_metrics; SQL-запросы учитываются обертками соединений, время
+шаблонов и обращения к кэшу — бэкендами из catalog.backends. По завершении
+запроса метрики уходят в заголовок Server-Timing и в гистограммы по имени
+URL, которые отдаются в формате Prometheus на /metrics.
+
+Гистограммы хранятся в памяти процесса: каждый воркер gunicorn отдает
+свои значения, как при отдельной цели сбора на процесс.
+"""
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .db_pool import pool_stats
+
+logger = logging.getLogger('catalog.slow_queries')
+
+# Границы корзин гистограммы времени ответа, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+_lock = threading.Lock()
+_views = {}
+
+
+class RequestMetrics:
+    """Метрики одного запроса"""
+    __slots__ = ('view', 'sql_count', 'sql_time', 'template_time', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.view = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def server_timing(self, total):
+        return ', '.join((
+            f'sql;dur={self.sql_time * 1000:.1f};desc="{self.sql_count} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f'total;dur={total * 1000:.1f}',
+        ))
+
+
+def record_template(duration):
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.template_time += duration
+
+
+def record_cache(hits, misses):
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+
+
+def observe(view, duration, metrics):
+    """Добавляет завершенный запрос в гистограмму представления"""
+    with _lock:
+        stats = _views.get(view)
+        if stats is None:
+            stats = _views[view] = {
+                'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0,
+                'sql_count': 0, 'sql_time': 0.0, 'template_time': 0.0,
+                'cache_hits': 0, 'cache_misses': 0,
+            }
+        for index, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                stats['buckets'][index] += 1
+        stats['count'] += 1
+        stats['sum'] += duration
+        stats['sql_count'] += metrics.sql_count
+        stats['sql_time'] += metrics.sql_time
+        stats['template_time'] += metrics.template_time
+        stats['cache_hits'] += metrics.cache_hits
+        stats['cache_misses'] += metrics.cache_misses
+
+
+def reset_metrics():
+    with _lock:
+        _views.clear()
+
+
+def view_stats():
+    """Снимок накопленных метрик по представлениям"""
+    with _lock:
+        return {view: dict(stats, buckets=list(stats['buckets'])) for view, stats in _views.items()}
+
+
+def render_prometheus():
+    """Текстовый формат экспозиции Prometheus"""
+    views = view_stats()
+
+    lines = [
+        '# HELP catalog_request_duration_seconds Время обработки запроса',
+        '# TYPE catalog_request_duration_seconds histogram',
+    ]
+    for view, stats in sorted(views.items()):
+        for bound, count in zip(BUCKETS, stats['buckets']):
+            lines.append(f'catalog_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {count}')
+        lines.append(f'catalog_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'catalog_request_duration_seconds_sum{{view="{view}"}} {stats["sum"]:.6f}')
+        lines.append(f'catalog_request_duration_seconds_count{{view="{view}"}} {stats["count"]}')
+
+    counters = (
+        ('catalog_sql_queries_total', 'sql_count', 'SQL-запросы'),
+        ('catalog_sql_seconds_total', 'sql_time', 'Время SQL-запросов'),
+        ('catalog_template_seconds_total', 'template_time', 'Время отрисовки шаблонов'),
+        ('catalog_cache_hits_total', 'cache_hits', 'Попадания в кэш'),
+        ('catalog_cache_misses_total', 'cache_misses', 'Промахи кэша'),
+    )
+    for name, field, title in counters:
+        lines.append(f'# HELP {name} {title}')
+        lines.append(f'# TYPE {name} counter')
+        for view, stats in sorted(views.items()):
+            value = stats[field]
+            value = f'{value:.6f}' if isinstance(value, float) else value
+            lines.append(f'{name}{{view="{view}"}} {value}')
+
+    pool = pool_stats()
+    for name, value in sorted(pool.items()):
+        metric = f'catalog_db_pool_{name}'
+        lines.append(f'# TYPE {metric} {"gauge" if name in ("open", "size", "avg_lifetime_seconds") else "counter"}')
+        lines.append(f'{metric} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.sql_count += 1
+            metrics.sql_time += duration
+        if duration * 1000 >= getattr(settings, 'SLOW_QUERY_MS', 200):
+            logger.warning(
+                'Медленный запрос %.1f мс в %s: %s', duration * 1000,
+                (metrics.view if metrics is not None else None) or '-',
+                sql[:getattr(settings, 'SLOW_QUERY_SQL_SAMPLE', 500)],
+            )
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """Учет SQL-запросов всех соединений, в том числе из потоков sync_to_async"""
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _sql_wrapper)
@@ -1,14 +1,123 @@
 import datetime
-from .models import VisitCount
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import Resolver404, resolve
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .counters import is_new_visitor, record_visitor, visit_buffer, visitor_hash
+from .hits import count_hit
+from .media import aiter_file, media_path, serve_media
+from .metrics import RequestMetrics, current_metrics, observe
+from .page_cache import load_page, store_page
+from .routers import choose_replica, current_replica, is_replica_view
+
+
+class RequestMetricsMiddleware:
+    """
+    Middleware для сбора метрик запроса
+
+    Добавляет заголовок Server-Timing (SQL, шаблоны, кэш, общее время)
+    и учитывает запрос в гистограммах catalog.metrics по имени URL.
+    Стоит перед VisitCounterMiddleware, чтобы в общее время входили
+    учет посещений и отдача страниц из кэша.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Имя представления нужно журналу медленных запросов
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.view = self.view_name(request)
+
+    def finish(self, request, response, metrics, duration):
+        metrics.view = metrics.view or self.view_name(request)
+        response['Server-Timing'] = metrics.server_timing(duration)
+        observe(metrics.view, duration, metrics)
+        return response
+
+    def view_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            # Страница из кэша: представление не вызывалось
+            try:
+                match = resolve(request.path_info)
+            except Resolver404:
+                return 'unmatched'
+        return match.view_name or match._func_path
+
 
 class VisitCounterMiddleware:
     """
     Middleware для подсчета посещений сайта
+
+    Уникальные посетители дня учитываются в наброске HyperLogLog
+    (см. catalog.counters) без обращения к сессии. При
+    VISIT_COUNTER_BUFFERED = True новые посетители копятся в памяти процесса
+    и сливаются с сохраненным наброском пачками (VisitBuffer), иначе
+    набросок в базе обновляется сразу.
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        should_flush = self.count_visit(request)
+        response = self.get_response(request)
+
+        # Сбрасываем буфер уже после формирования ответа страницы
+        if should_flush:
+            visit_buffer.flush()
+        return response
+
+    async def __acall__(self, request):
+        should_flush = await sync_to_async(self.count_visit)(request)
+        response = await self.get_response(request)
+        if should_flush:
+            await sync_to_async(visit_buffer.flush)()
+        return response
+
+    def count_visit(self, request):
+        """Учитывает посещение; возвращает True, если пора сбросить буфер"""
         # Получаем текущую дату
         today = datetime.date.today()
 
@@ -18,27 +127,242 @@ class VisitCounterMiddleware:
         is_ajax_request = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
         # ---- END OF CHANGE ----
 
+        should_flush = False
+
         # Проверяем, является ли запрос обычным просмотром страницы (не AJAX, не статические файлы и т.д.)
         # Exclude admin, static, media paths, AJAX requests, and non-GET requests
         if not request.path.startswith(('/admin/', '/static/', '/media/')) \
            and not is_ajax_request \
            and request.method == 'GET':
 
-            # Получаем или создаем запись для текущей даты
-            visit_count, created = VisitCount.objects.get_or_create(date=today)
+            # Посетитель, который не меняет набросок дня, уже учтен
+            visitor = visitor_hash(request)
+            if is_new_visitor(today, visitor):
+                if getattr(settings, 'VISIT_COUNTER_BUFFERED', False):
+                    # Запись в базу откладывается до сброса буфера
+                    should_flush = visit_buffer.add(today, visitor)
+                else:
+                    record_visitor(today, visitor)
+
+        return should_flush
 
-            # Если запись создана или это новая сессия (для этого дня), увеличиваем счетчик
-            # To count one visit per session per day, we make the session key date-specific
-            session_key_for_today_visit = f'visited_day_{today.isoformat()}'
 
-            if session_key_for_today_visit not in request.session:
-                visit_count.count += 1
-                visit_count.save()
+class AnonymousPageCacheMiddleware:
+    """
+    Middleware для кэширования страниц анонимных посетителей
+
+    Кэшируются только страницы, которые представление пометило тегами
+    (см. catalog.page_cache.tag_page). Должен стоять после
+    VisitCounterMiddleware, чтобы посещения учитывались и при отдаче из кэша.
+    """
+    sync_capable = True
+    async_capable = True
 
-                # Отмечаем, что пользователь посетил сайт в этой сессии для этого дня
-                request.session[session_key_for_today_visit] = True
-                # Optionally, set an expiry for this session key if sessions are very long
-                # request.session.set_expiry(some_value_in_seconds_or_datetime)
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        cacheable, response = self.lookup(request)
+        if response is not None:
+            return response
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        if cacheable:
+            self.store(request, response)
+        return response
+
+    async def __acall__(self, request):
+        cacheable, response = await sync_to_async(self.lookup)(request)
+        if response is not None:
+            return response
+        response = await self.get_response(request)
+        if cacheable:
+            await sync_to_async(self.store)(request, response)
+        return response
+
+    def lookup(self, request):
+        """Возвращает (можно ли кэшировать запрос, ответ из кэша или None)"""
+        if not self.is_cacheable_request(request):
+            return False, None
+
+        entry = load_page(request)
+        if entry is None:
+            return True, None
+        # Просмотр предмета учитывается так же, как при обычной отдаче страницы
+        if entry['hitcount']:
+            count_hit(request, entry['hitcount'])
+        response = HttpResponse(entry['content'], status=entry['status'])
+        for name, value in entry['headers']:
+            response[name] = value
+        response['X-Page-Cache'] = 'HIT'
+        return True, response
+
+    def store(self, request, response):
+        if request.method == 'GET' and self.is_cacheable_response(request, response):
+            store_page(request, response)
+            response['X-Page-Cache'] = 'MISS'
+
+    def is_cacheable_request(self, request):
+        return (
+            getattr(settings, 'PAGE_CACHE_ENABLED', False)
+            and request.method in ('GET', 'HEAD')
+            and not request.path.startswith(('/admin/', '/static/', '/media/'))
+            and not request.user.is_authenticated
+            # Страницу с сообщениями для посетителя нельзя отдавать другим
+            and not len(get_messages(request))
+        )
+
+    def is_cacheable_response(self, request, response):
+        cache_control = response.get('Cache-Control', '')
+        return (
+            hasattr(request, 'page_cache_tags')
+            and response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            # В страницу попал CSRF-токен конкретного посетителя
+            and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+            and 'private' not in cache_control
+            and 'no-store' not in cache_control
+        )
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Middleware для чтения каталога с реплик базы данных
+
+    Для представлений с read_from_replica = True включает чтение с реплик
+    (см. catalog.routers.ReplicaRouter). После запроса с записью (любой метод,
+    кроме GET/HEAD/OPTIONS) ставит cookie, и в течение REPLICA_STICKY_SECONDS
+    запросы этого посетителя читают с основной базы: так он сразу видит свой
+    комментарий или голос, даже если реплика отстает.
+    """
+    cookie_name = 'db_primary'
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = current_replica.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        return self.pin_writer(request, response)
+
+    async def __acall__(self, request):
+        token = current_replica.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        return self.pin_writer(request, response)
+
+    def pin_writer(self, request, response):
+        if getattr(settings, 'REPLICA_DATABASES', []) and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(
+                self.cookie_name, '1', max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 10),
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if is_replica_view(view_func) and self.cookie_name not in request.COOKIES:
+            current_replica.set(choose_replica())
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, совместимый с ASGI
+
+    Исходный WhiteNoiseMiddleware только синхронный, и под ASGI из-за него
+    каждый запрос переключался бы в поток. Здесь в цикле событий остается
+    только поиск файла в словаре WhiteNoise; поиск на диске (autorefresh)
+    и open выполняются в потоке, а файл отдается асинхронным итератором.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve_async, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
+
+    @staticmethod
+    def serve_async(static_file, request):
+        """Как serve, но тело ответа — асинхронный итератор по файлу"""
+        response = static_file.get_response(request.method, request.META)
+        if response.file is None:
+            http_response = HttpResponse(status=int(response.status))
+        else:
+            http_response = StreamingHttpResponse(aiter_file(response.file), status=int(response.status))
+        del http_response['Content-Type']
+        for key, value in response.headers:
+            http_response[key] = value
+        return http_response
+
+
+class MediaFilesMiddleware:
+    """
+    Отдача загруженных файлов (catalog.media) до сессий и остальных middleware
+
+    Под ASGI stat и open выполняются в потоке, а не в цикле событий, и файл
+    отдается асинхронным итератором. Отсутствующие файлы проходят дальше
+    и получают обычную 404.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        path = self.media_path(request)
+        if path is not None:
+            response = serve_media(request, path)
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        path = self.media_path(request)
+        if path is not None:
+            response = await sync_to_async(serve_media, thread_sensitive=False)(request, path, asynchronous=True)
+            if response is not None:
+                return response
+        return await self.get_response(request)
+
+    def media_path(self, request):
+        if request.method not in ('GET', 'HEAD') or not getattr(settings, 'MEDIA_SERVE_ENABLED', True):
+            return None
+        return media_path(request.path_info)
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:25
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='visitcount',
+            name='date',
+            field=models.DateField(default=datetime.date.today, unique=True, verbose_name='Дата'),
+        ),
+    ]
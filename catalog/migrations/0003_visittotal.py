@@ -0,0 +1,33 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:25
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_visit_total(apps, schema_editor):
+    VisitCount = apps.get_model('catalog', 'VisitCount')
+    VisitTotal = apps.get_model('catalog', 'VisitTotal')
+    total = VisitCount.objects.aggregate(total=Sum('count'))['total'] or 0
+    VisitTotal.objects.update_or_create(pk=1, defaults={'count': total})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0002_visitcount_date_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveBigIntegerField(default=0, verbose_name='Всего посещений')),
+            ],
+            options={
+                'verbose_name': 'Общее количество посещений',
+                'verbose_name_plural': 'Общее количество посещений',
+            },
+        ),
+        migrations.RunPython(fill_visit_total, migrations.RunPython.noop),
+    ]
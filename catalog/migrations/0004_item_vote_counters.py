@@ -0,0 +1,39 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:26
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_vote_counters(apps, schema_editor):
+    CollectibleItem = apps.get_model('catalog', 'CollectibleItem')
+    Vote = apps.get_model('catalog', 'Vote')
+
+    def votes(value):
+        counts = Vote.objects.filter(item=OuterRef('pk'), value=value).order_by().values('item')
+        return Coalesce(
+            Subquery(counts.annotate(c=Count('pk')).values('c'), output_field=IntegerField()), 0
+        )
+
+    CollectibleItem.objects.update(likes_count=votes(True), dislikes_count=votes(False))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0003_visittotal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collectibleitem',
+            name='dislikes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Дизлайки'),
+        ),
+        migrations.AddField(
+            model_name='collectibleitem',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Лайки'),
+        ),
+        migrations.RunPython(fill_vote_counters, migrations.RunPython.noop),
+    ]
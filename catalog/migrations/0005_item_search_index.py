@@ -0,0 +1,53 @@
+from django.db import migrations
+
+FTS_TABLE = 'catalog_collectibleitem_fts'
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "ALTER TABLE catalog_collectibleitem ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('russian', coalesce(country, '')), 'B') || "
+            "setweight(to_tsvector('russian', coalesce(description, '')), 'C')"
+            ") STORED"
+        )
+        schema_editor.execute(
+            "CREATE INDEX catalog_item_search_vector_idx ON catalog_collectibleitem "
+            "USING GIN (search_vector)"
+        )
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA compile_options")
+            if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+                return
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "name, description, country, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description, country) "
+            "SELECT id, name, description, country FROM catalog_collectibleitem"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS catalog_item_search_vector_idx")
+        schema_editor.execute("ALTER TABLE catalog_collectibleitem DROP COLUMN IF EXISTS search_vector")
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_item_vote_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_item_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collectibleitem',
+            index=models.Index(fields=['-created_at', '-id'], name='item_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='collectibleitem',
+            index=models.Index(fields=['category', '-created_at', '-id'], name='item_category_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:34
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_comment_counters(apps, schema_editor):
+    CollectibleItem = apps.get_model('catalog', 'CollectibleItem')
+    Comment = apps.get_model('catalog', 'Comment')
+    counts = Comment.objects.filter(item=OuterRef('pk')).order_by().values('item')
+    CollectibleItem.objects.update(comments_count=Coalesce(
+        Subquery(counts.annotate(c=Count('pk')).values('c'), output_field=IntegerField()), 0
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0006_item_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collectibleitem',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Комментарии'),
+        ),
+        migrations.RunPython(fill_comment_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['item', '-created_at', '-id'], name='comment_item_created_id_idx'),
+        ),
+    ]
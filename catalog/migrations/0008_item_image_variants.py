@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_comment_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collectibleitem',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Варианты изображения'),
+        ),
+    ]
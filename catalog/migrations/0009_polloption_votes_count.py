@@ -0,0 +1,30 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:36
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_poll_tallies(apps, schema_editor):
+    PollOption = apps.get_model('catalog', 'PollOption')
+    PollVote = apps.get_model('catalog', 'PollVote')
+    counts = PollVote.objects.filter(option=OuterRef('pk')).order_by().values('option')
+    PollOption.objects.update(votes_count=Coalesce(
+        Subquery(counts.annotate(c=Count('pk')).values('c'), output_field=IntegerField()), 0
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_item_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='polloption',
+            name='votes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Голосов'),
+        ),
+        migrations.RunPython(fill_poll_tallies, migrations.RunPython.noop),
+    ]
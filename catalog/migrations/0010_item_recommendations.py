@@ -0,0 +1,42 @@
+# Generated by Django 5.0.3 on 2026-10-18 13:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_polloption_votes_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_pk', models.BigIntegerField(verbose_name='Пользователь')),
+                ('item_pk', models.BigIntegerField(verbose_name='Предмет')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Изменение коллекции',
+                'verbose_name_plural': 'Изменения коллекций',
+            },
+        ),
+        migrations.CreateModel(
+            name='ItemRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Сходство')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='catalog.collectibleitem', verbose_name='Предмет')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_for', to='catalog.collectibleitem', verbose_name='Рекомендуемый предмет')),
+            ],
+            options={
+                'verbose_name': 'Рекомендация',
+                'verbose_name_plural': 'Рекомендации',
+                'indexes': [models.Index(fields=['item', '-score'], name='recommendation_item_score_idx')],
+                'unique_together': {('item', 'recommended')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.3 on 2026-10-18 13:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_item_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingWatermark',
+            fields=[
+                ('source', models.CharField(max_length=20, primary_key=True, serialize=False, verbose_name='Источник')),
+                ('last_pk', models.BigIntegerField(default=0, verbose_name='Последний учтенный идентификатор')),
+            ],
+            options={
+                'verbose_name': 'Отметка учета популярности',
+                'verbose_name_plural': 'Отметки учета популярности',
+            },
+        ),
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='catalog.collectibleitem', verbose_name='Предмет')),
+                ('log_score', models.FloatField(verbose_name='Логарифм популярности')),
+            ],
+            options={
+                'verbose_name': 'Популярность предмета',
+                'verbose_name_plural': 'Популярность предметов',
+                'indexes': [models.Index(fields=['-log_score', '-item'], name='trending_score_idx')],
+            },
+        ),
+    ]
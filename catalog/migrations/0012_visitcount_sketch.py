@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_trending_scores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visitcount',
+            name='sketch',
+            field=models.BinaryField(default=b'', verbose_name='Набросок посетителей'),
+        ),
+    ]
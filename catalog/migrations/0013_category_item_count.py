@@ -0,0 +1,34 @@
+# Generated by Django 5.0.3 on 2026-10-18 13:17
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_item_counts(apps, schema_editor):
+    Category = apps.get_model('catalog', 'Category')
+    CollectibleItem = apps.get_model('catalog', 'CollectibleItem')
+    counts = CollectibleItem.objects.filter(category=OuterRef('pk')).order_by().values('category')
+    Category.objects.update(item_count=Coalesce(
+        Subquery(counts.annotate(c=Count('pk')).values('c'), output_field=IntegerField()), 0
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0012_visitcount_sketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Предметов'),
+        ),
+        migrations.RunPython(fill_item_counts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['-item_count', 'name'], name='category_item_count_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.3 on 2026-10-18 13:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0013_category_item_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usercollection',
+            index=models.Index(fields=['user', '-added_at', '-id'], name='collection_added_idx'),
+        ),
+    ]
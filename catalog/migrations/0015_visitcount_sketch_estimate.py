@@ -0,0 +1,26 @@
+# Generated by Django 5.0.3 on 2026-10-18 13:38
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_sketch_estimates(apps, schema_editor):
+    # До этой миграции count строки с наброском равнялся его оценке
+    VisitCount = apps.get_model('catalog', 'VisitCount')
+    VisitCount.objects.exclude(sketch=b'').update(sketch_estimate=F('count'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0014_collection_added_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visitcount',
+            name='sketch_estimate',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценка наброска'),
+        ),
+        migrations.RunPython(fill_sketch_estimates, migrations.RunPython.noop),
+    ]
@@ -1,32 +1,70 @@
-from django.db import models
+import datetime
+
+from django.db import models, transaction
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Left
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.urls import reverse
-from django.utils.text import slugify
 from hitcount.models import HitCountMixin, HitCount
 
+from .slugs import slugify_name
+
 class Category(models.Model):
     """Модель для категорий предметов коллекции"""
     name = models.CharField(max_length=100, verbose_name="Название")
     slug = models.SlugField(max_length=100, unique=True, verbose_name="URL")
     description = models.TextField(blank=True, null=True, verbose_name="Описание")
+    # Обновляется вместе с предметами (см. CollectibleItem.save и item_deleted)
+    item_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Предметов")
     
     class Meta:
         verbose_name = "Категория"
         verbose_name_plural = "Категории"
         ordering = ['name']
+        indexes = [
+            # Популярные категории на главной
+            models.Index(fields=['-item_count', 'name'], name='category_item_count_idx'),
+        ]
     
     def __str__(self):
         return self.name
     
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.name)
+            self.slug = slugify_name(self.name)
         super().save(*args, **kwargs)
     
     def get_absolute_url(self):
         return reverse('category_detail', kwargs={'slug': self.slug})
 
 
+class CollectibleItemQuerySet(models.QuerySet):
+    """QuerySet предметов коллекции"""
+
+    # Поля, которые выводятся в карточках списков
+    CARD_FIELDS = (
+        'name', 'slug', 'country', 'condition', 'image', 'image_variants', 'created_at',
+        'likes_count', 'dislikes_count', 'comments_count', 'category__name', 'category__slug',
+    )
+
+    def cards(self):
+        """
+        Данные для карточек в списках одним запросом: категория через JOIN,
+        просмотры подзапросом, начало описания вместо полного текста.
+        """
+        hits = HitCount.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.model),
+            object_pk=OuterRef('pk'),
+        ).values('hits')[:1]
+        return self.select_related('category').only(*self.CARD_FIELDS).annotate(
+            hits=Coalesce(Subquery(hits, output_field=IntegerField()), 0),
+            short_description=Left('description', 101),
+        )
+
+
 class CollectibleItem(models.Model, HitCountMixin):
     """Модель для предметов коллекции (монет/марок)"""
     CONDITION_CHOICES = [
@@ -47,26 +85,62 @@ class CollectibleItem(models.Model, HitCountMixin):
     condition = models.CharField(max_length=3, choices=CONDITION_CHOICES, verbose_name="Состояние")
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='items', verbose_name="Категория")
     image = models.ImageField(upload_to='items/', blank=True, null=True, verbose_name="Изображение")
+    # Сведения о производных изображения (см. catalog.images)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="Варианты изображения")
+    likes_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Лайки")
+    dislikes_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Дизлайки")
+    comments_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Комментарии")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата добавления")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    objects = CollectibleItemQuerySet.as_manager()
     
     class Meta:
         verbose_name = "Предмет коллекции"
         verbose_name_plural = "Предметы коллекции"
         ordering = ['-created_at']
+        indexes = [
+            # Курсорная пагинация по (created_at, id) по всему каталогу и внутри категории
+            models.Index(fields=['-created_at', '-id'], name='item_created_id_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='item_category_created_id_idx'),
+        ]
     
     def __str__(self):
         return self.name
     
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+            self.slug = slugify_name(self.name)
+        # Счетчики предметов категорий обновляются в той же транзакции, что и предмет
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = CollectibleItem.objects.select_for_update().filter(
+                    pk=self.pk
+                ).values_list('category_id', flat=True).first()
+            # Прежнюю категорию читает и сброс кэша страниц (catalog.page_cache)
+            self._previous_category_id = previous
+            super().save(*args, **kwargs)
+            if previous != self.category_id:
+                shift_category_counts({previous: -1, self.category_id: 1})
     
     def get_absolute_url(self):
         return reverse('item_detail', kwargs={'slug': self.slug})
 
 
+def shift_category_counts(changes):
+    """Прибавляет к счетчикам предметов категорий {id категории: изменение}; None пропускается"""
+    for category_id, amount in changes.items():
+        if category_id is not None and amount:
+            Category.objects.filter(pk=category_id).update(item_count=F('item_count') + amount)
+
+
+@receiver(post_delete, sender=CollectibleItem)
+def item_deleted(sender, instance, **kwargs):
+    """Уменьшение счетчика предметов категории при удалении предмета"""
+    shift_category_counts({instance.category_id: -1})
+
+
 class Comment(models.Model):
     """Модель для комментариев к предметам коллекции"""
     item = models.ForeignKey(CollectibleItem, on_delete=models.CASCADE, related_name='comments', verbose_name="Предмет")
@@ -78,11 +152,28 @@ class Comment(models.Model):
         verbose_name = "Комментарий"
         verbose_name_plural = "Комментарии"
         ordering = ['-created_at']
+        indexes = [
+            # Курсорная пагинация комментариев предмета
+            models.Index(fields=['item', '-created_at', '-id'], name='comment_item_created_id_idx'),
+        ]
     
     def __str__(self):
         return f'{self.user.username} - {self.item.name}'
 
 
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    """Увеличение счетчика комментариев предмета"""
+    if created:
+        CollectibleItem.objects.filter(pk=instance.item_id).update(comments_count=F('comments_count') + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    """Уменьшение счетчика комментариев предмета"""
+    CollectibleItem.objects.filter(pk=instance.item_id).update(comments_count=F('comments_count') - 1)
+
+
 class Vote(models.Model):
     """Модель для голосования пользователей"""
     item = models.ForeignKey(CollectibleItem, on_delete=models.CASCADE, related_name='votes', verbose_name="Предмет")
@@ -99,6 +190,37 @@ class Vote(models.Model):
         vote_type = "Лайк" if self.value else "Дизлайк"
         return f'{self.user.username} - {vote_type} - {self.item.name}'
 
+    def save(self, *args, **kwargs):
+        # Счетчики лайков/дизлайков предмета обновляются в той же транзакции, что и голос
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = Vote.objects.select_for_update().filter(
+                    pk=self.pk
+                ).values_list('value', flat=True).first()
+            super().save(*args, **kwargs)
+            update_vote_counters(self.item_id, previous, self.value)
+
+
+def update_vote_counters(item_id, old_value, new_value):
+    """Сдвигает счетчики лайков/дизлайков предмета при изменении голоса (None - голоса нет)"""
+    if old_value == new_value:
+        return
+    changes = {}
+    if old_value is not None:
+        field = 'likes_count' if old_value else 'dislikes_count'
+        changes[field] = F(field) - 1
+    if new_value is not None:
+        field = 'likes_count' if new_value else 'dislikes_count'
+        changes[field] = F(field) + 1
+    CollectibleItem.objects.filter(pk=item_id).update(**changes)
+
+
+@receiver(post_delete, sender=Vote)
+def vote_deleted(sender, instance, **kwargs):
+    """Уменьшение счетчика предмета при удалении голоса"""
+    update_vote_counters(instance.item_id, instance.value, None)
+
 
 class UserCollection(models.Model):
     """Модель для хранения предметов в личной коллекции пользователя"""
@@ -111,15 +233,85 @@ class UserCollection(models.Model):
         verbose_name = "Предмет в коллекции пользователя"
         verbose_name_plural = "Предметы в коллекциях пользователей"
         unique_together = ['user', 'item']
+        indexes = [
+            # Страница коллекции: от недавно добавленных (курсорная пагинация)
+            models.Index(fields=['user', '-added_at', '-id'], name='collection_added_idx'),
+        ]
     
     def __str__(self):
         return f'{self.user.username} - {self.item.name}'
 
 
+class ItemRecommendation(models.Model):
+    """Предмет, который часто встречается в коллекциях вместе с данным (см. catalog.recommendations)"""
+    item = models.ForeignKey(CollectibleItem, on_delete=models.CASCADE, related_name='recommendations', verbose_name="Предмет")
+    recommended = models.ForeignKey(CollectibleItem, on_delete=models.CASCADE, related_name='recommended_for', verbose_name="Рекомендуемый предмет")
+    score = models.FloatField(verbose_name="Сходство")
+
+    class Meta:
+        verbose_name = "Рекомендация"
+        verbose_name_plural = "Рекомендации"
+        unique_together = ['item', 'recommended']
+        indexes = [
+            models.Index(fields=['item', '-score'], name='recommendation_item_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.item_id} -> {self.recommended_id} ({self.score:.3f})'
+
+
+class CollectionChange(models.Model):
+    """
+    Изменение коллекции, еще не учтенное в рекомендациях.
+
+    Хранит идентификаторы без внешних ключей: запись должна пережить
+    удаление пользователя или предмета, чтобы их пары убрались из рекомендаций.
+    """
+    user_pk = models.BigIntegerField(verbose_name="Пользователь")
+    item_pk = models.BigIntegerField(verbose_name="Предмет")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата изменения")
+
+    class Meta:
+        verbose_name = "Изменение коллекции"
+        verbose_name_plural = "Изменения коллекций"
+
+
+class TrendingScore(models.Model):
+    """
+    Популярность предмета с затуханием по времени (см. catalog.trending).
+
+    log_score — натуральный логарифм суммы весов событий, приведенных к общей
+    точке отсчета; порядок по нему совпадает с порядком по текущей популярности.
+    """
+    item = models.OneToOneField(CollectibleItem, on_delete=models.CASCADE, primary_key=True, related_name='trending', verbose_name="Предмет")
+    log_score = models.FloatField(verbose_name="Логарифм популярности")
+
+    class Meta:
+        verbose_name = "Популярность предмета"
+        verbose_name_plural = "Популярность предметов"
+        indexes = [
+            models.Index(fields=['-log_score', '-item'], name='trending_score_idx'),
+        ]
+
+
+class TrendingWatermark(models.Model):
+    """Последнее событие источника, учтенное в популярности"""
+    source = models.CharField(max_length=20, primary_key=True, verbose_name="Источник")
+    last_pk = models.BigIntegerField(default=0, verbose_name="Последний учтенный идентификатор")
+
+    class Meta:
+        verbose_name = "Отметка учета популярности"
+        verbose_name_plural = "Отметки учета популярности"
+
+
 class VisitCount(models.Model):
     """Модель для счетчика посещений"""
-    date = models.DateField(auto_now_add=True, unique=True, verbose_name="Дата")
+    date = models.DateField(default=datetime.date.today, unique=True, verbose_name="Дата")
     count = models.PositiveIntegerField(default=0, verbose_name="Количество посещений")
+    # Набросок HyperLogLog уникальных посетителей дня (см. catalog.counters) и его последняя
+    # оценка; к count прибавляется только прирост оценки, поэтому прежние посещения сохраняются
+    sketch = models.BinaryField(default=b'', editable=False, verbose_name="Набросок посетителей")
+    sketch_estimate = models.PositiveIntegerField(default=0, editable=False, verbose_name="Оценка наброска")
     
     class Meta:
         verbose_name = "Статистика посещений"
@@ -130,6 +322,18 @@ class VisitCount(models.Model):
         return f'{self.date} - {self.count} посещений'
 
 
+class VisitTotal(models.Model):
+    """Модель для общего количества посещений (единственная запись, обновляется вместе с VisitCount)"""
+    count = models.PositiveBigIntegerField(default=0, verbose_name="Всего посещений")
+
+    class Meta:
+        verbose_name = "Общее количество посещений"
+        verbose_name_plural = "Общее количество посещений"
+
+    def __str__(self):
+        return f'Всего {self.count} посещений'
+
+
 class Poll(models.Model):
     """Модель для опросов на сайте"""
     question = models.CharField(max_length=200, verbose_name="Вопрос")
@@ -149,6 +353,7 @@ class PollOption(models.Model):
     """Модель для вариантов ответа в опросе"""
     poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='options', verbose_name="Опрос")
     text = models.CharField(max_length=200, verbose_name="Текст варианта")
+    votes_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Голосов")
     
     class Meta:
         verbose_name = "Вариант ответа"
@@ -171,4 +376,24 @@ class PollVote(models.Model):
         unique_together = ['poll', 'user']
     
     def __str__(self):
-        return f'{self.user.username} - {self.option.text}'
\ No newline at end of file
+        return f'{self.user.username} - {self.option.text}'
+
+    def save(self, *args, **kwargs):
+        # Счетчики вариантов ответа обновляются в той же транзакции, что и голос
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = PollVote.objects.select_for_update().filter(
+                    pk=self.pk
+                ).values_list('option_id', flat=True).first()
+            super().save(*args, **kwargs)
+            if previous != self.option_id:
+                if previous is not None:
+                    PollOption.objects.filter(pk=previous).update(votes_count=F('votes_count') - 1)
+                PollOption.objects.filter(pk=self.option_id).update(votes_count=F('votes_count') + 1)
+
+
+@receiver(post_delete, sender=PollVote)
+def poll_vote_deleted(sender, instance, **kwargs):
+    """Уменьшение счетчика варианта ответа при удалении голоса"""
+    PollOption.objects.filter(pk=instance.option_id).update(votes_count=F('votes_count') - 1)
\ No newline at end of file
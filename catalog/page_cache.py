@@ -0,0 +1,135 @@
+"""
+Кэш готовых HTML-страниц для анонимных посетителей.
+
+Представление помечает страницу тегами, от которых она зависит
+(например, item:<id> или category:<id>); вместе с HTML сохраняются версии
+этих тегов. Сигналы моделей меняют версии затронутых тегов, и страница
+с устаревшей версией считается промахом. Счетчики лайков и комментариев
+в карточках списков обновляются по истечении PAGE_CACHE_TIMEOUT: голоса
+и комментарии сбрасывают только страницу самого предмета.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Category, CollectibleItem, Comment, Poll, PollOption, Vote
+
+ITEMS_TAG = 'items'
+CATEGORIES_TAG = 'categories'
+POLLS_TAG = 'polls'
+RECOMMENDATIONS_TAG = 'recommendations'
+TRENDING_TAG = 'trending'
+
+
+def item_tag(pk):
+    return f'item:{pk}'
+
+
+def category_tag(pk):
+    return f'category:{pk}'
+
+
+def _tag_key(tag):
+    return f'pagecache:tag:{tag}'
+
+
+def page_cache_key(request):
+    path = f'{request.get_host()}{request.get_full_path()}'
+    return 'pagecache:page:' + hashlib.md5(path.encode()).hexdigest()
+
+
+def tag_page(request, *tags, hitcount_pk=None):
+    """
+    Разрешает кэширование страницы и задает теги, при изменении которых она сбрасывается.
+
+    hitcount_pk — счетчик просмотров, который нужно учитывать и при отдаче из кэша.
+    """
+    request.page_cache_tags = tags
+    request.page_cache_hitcount = hitcount_pk
+
+
+def invalidate_tags(*tags):
+    """Сбрасывает страницы с указанными тегами после фиксации транзакции"""
+    def bump():
+        version = time.time_ns()
+        cache.set_many({_tag_key(tag): version for tag in tags}, None)
+    transaction.on_commit(bump)
+
+
+def _tag_versions(tags):
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        version = time.time_ns()
+        for key in missing:
+            cache.add(key, version, None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+def store_page(request, response):
+    tags = request.page_cache_tags
+    headers = [
+        (name, value) for name, value in response.items()
+        if name.lower() not in ('set-cookie', 'vary')
+    ]
+    entry = {
+        'content': response.content,
+        'status': response.status_code,
+        'headers': headers,
+        'tags': tags,
+        'versions': _tag_versions(tags),
+        'hitcount': request.page_cache_hitcount,
+    }
+    cache.set(page_cache_key(request), entry, getattr(settings, 'PAGE_CACHE_TIMEOUT', 300))
+
+
+def load_page(request):
+    """Возвращает сохраненную страницу или None, если ее нет или она устарела"""
+    entry = cache.get(page_cache_key(request))
+    if entry is None:
+        return None
+    versions = cache.get_many([_tag_key(tag) for tag in entry['tags']])
+    if [versions.get(_tag_key(tag)) for tag in entry['tags']] != entry['versions']:
+        return None
+    return entry
+
+
+@receiver(post_save, sender=CollectibleItem)
+@receiver(post_delete, sender=CollectibleItem)
+def item_changed(sender, instance, **kwargs):
+    tags = {ITEMS_TAG, CATEGORIES_TAG, item_tag(instance.pk), category_tag(instance.category_id)}
+    # Прежнюю категорию запоминает CollectibleItem.save: при переносе предмета
+    # сбрасывается и ее страница
+    old_category = getattr(instance, '_previous_category_id', None)
+    if old_category:
+        tags.add(category_tag(old_category))
+    invalidate_tags(*tags)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    invalidate_tags(ITEMS_TAG, CATEGORIES_TAG, category_tag(instance.pk))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def item_activity_changed(sender, instance, **kwargs):
+    invalidate_tags(item_tag(instance.item_id))
+
+
+@receiver(post_save, sender=Poll)
+@receiver(post_delete, sender=Poll)
+@receiver(post_save, sender=PollOption)
+@receiver(post_delete, sender=PollOption)
+def poll_changed(sender, instance, **kwargs):
+    invalidate_tags(POLLS_TAG)
@@ -0,0 +1,158 @@
+"""
+Курсорная (keyset) пагинация по (ключ, id) в порядке убывания; по умолчанию
+ключ — created_at, то есть от новых к старым.
+
+Вместо OFFSET каждая страница выбирается условием «строго после ключа
+последнего элемента», поэтому глубокие страницы не медленнее первой и не
+нужен COUNT(*). Курсоры — подписанные непрозрачные токены.
+"""
+import datetime
+import json
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.db.models import Q
+
+CURSOR_SALT = 'catalog.pagination.cursor'
+
+
+def encode_cursor(obj, direction, key='created_at'):
+    value = getattr(obj, key)
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    return signing.dumps([value, obj.pk, direction], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token, parse=datetime.datetime.fromisoformat):
+    """Возвращает (ключ, id, направление) или None для пустого/поддельного токена"""
+    if not token:
+        return None
+    try:
+        value, pk, direction = signing.loads(token, salt=CURSOR_SALT)
+        return parse(value), int(pk), direction
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+
+
+def estimate_count(queryset):
+    """
+    Приблизительное количество строк по оценке планировщика PostgreSQL.
+
+    Для других баз возвращает None: точный COUNT(*) здесь не выполняется.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPage:
+    """Страница курсорной пагинации"""
+
+    def __init__(self, paginator, object_list, has_next, has_previous):
+        self.paginator = paginator
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return encode_cursor(self.object_list[-1], 'next', self.paginator.key)
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return encode_cursor(self.object_list[0], 'prev', self.paginator.key)
+        return None
+
+
+class KeysetPaginator:
+    """
+    Пагинатор по (key, id) в порядке убывания.
+
+    key — поле или аннотация queryset; parse восстанавливает значение ключа из курсора;
+    count — точное количество строк, если оно уже известно (тогда оценка не запрашивается).
+    """
+
+    def __init__(self, queryset, per_page, key='created_at', parse=datetime.datetime.fromisoformat, count=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.key = key
+        self.parse = parse
+        if count is not None:
+            self._estimated_count = count
+
+    @property
+    def estimated_count(self):
+        if not hasattr(self, '_estimated_count'):
+            if not getattr(settings, 'PAGINATION_ESTIMATE_COUNT', True):
+                return None
+            self._estimated_count = estimate_count(self.queryset)
+        return self._estimated_count
+
+    def page(self, token=None):
+        key = self.key
+        cursor = decode_cursor(token, self.parse)
+        if cursor is None:
+            rows = list(self.queryset.order_by(f'-{key}', '-id')[:self.per_page + 1])
+            return KeysetPage(self, rows[:self.per_page], len(rows) > self.per_page, False)
+
+        value, pk, direction = cursor
+        if direction == 'prev':
+            rows = list(
+                self.queryset.filter(
+                    Q(**{f'{key}__gt': value}) | Q(**{key: value, 'id__gt': pk})
+                ).order_by(key, 'id')[:self.per_page + 1]
+            )
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(self, rows, True, has_previous)
+
+        rows = list(
+            self.queryset.filter(
+                Q(**{f'{key}__lt': value}) | Q(**{key: value, 'id__lt': pk})
+            ).order_by(f'-{key}', '-id')[:self.per_page + 1]
+        )
+        return KeysetPage(self, rows[:self.per_page], len(rows) > self.per_page, True)
+
+
+class KeysetPaginationMixin:
+    """
+    Подменяет OFFSET-пагинацию ListView курсорной.
+
+    Курсор передается в GET-параметре cursor; в контексте остаются
+    page_obj, paginator и is_paginated.
+    """
+    cursor_kwarg = 'cursor'
+
+    def get_keyset_paginator(self, queryset, page_size):
+        return KeysetPaginator(queryset, page_size)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_keyset_paginator(queryset, page_size)
+        page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,53 @@
+"""
+Результаты опросов из счетчиков PollOption.votes_count.
+
+Снимок результатов (варианты, голоса, проценты) кэшируется и сбрасывается
+после фиксации транзакции, в которой изменились голоса или варианты.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Poll, PollOption, PollVote
+
+
+def results_cache_key(poll_id):
+    return f'poll:results:{poll_id}'
+
+
+def poll_results(poll):
+    """
+    Возвращает (варианты, всего голосов); варианты — словари с полями
+    id, text, vote_count и percentage, отсортированные по числу голосов.
+    """
+    key = results_cache_key(poll.pk)
+    results = cache.get(key)
+    if results is None:
+        options = list(poll.options.order_by('-votes_count', 'pk').values('id', 'text', 'votes_count'))
+        total_votes = sum(option['votes_count'] for option in options)
+        for option in options:
+            option['vote_count'] = option.pop('votes_count')
+            option['percentage'] = round(option['vote_count'] / total_votes * 100) if total_votes > 0 else 0
+        results = (options, total_votes)
+        cache.set(key, results, getattr(settings, 'POLL_RESULTS_CACHE_TIMEOUT', 3600))
+    return results
+
+
+def invalidate_poll_results(poll_id):
+    transaction.on_commit(lambda: cache.delete(results_cache_key(poll_id)))
+
+
+@receiver(post_save, sender=PollVote)
+@receiver(post_delete, sender=PollVote)
+@receiver(post_save, sender=PollOption)
+@receiver(post_delete, sender=PollOption)
+def poll_changed(sender, instance, **kwargs):
+    """Сброс снимка результатов опроса при изменении голосов или вариантов"""
+    invalidate_poll_results(instance.poll_id)
+
+
+@receiver(post_delete, sender=Poll)
+def poll_deleted(sender, instance, **kwargs):
+    invalidate_poll_results(instance.pk)
@@ -0,0 +1,178 @@
+"""
+Рекомендации «у коллекционеров этого предмета также есть».
+
+Пары пользователь–предмет из UserCollection складываются в разреженную
+матрицу вхождений (строки CSR по пользователям и по предметам в массивах
+NumPy). Строка матрицы совместной встречаемости для предмета i получается
+из коллекций его владельцев, сходство нормируется на популярность:
+
+    score(i, j) = common(i, j) / sqrt(owners(i) * owners(j))
+
+(косинусная мера), поэтому предметы, которые есть почти у всех, не попадают
+в рекомендации каждого. Для каждого предмета хранятся RECOMMENDATIONS_TOP_K
+лучших соседей в таблице ItemRecommendation, и страница предмета читает их
+одним запросом.
+
+Сигналы коллекций пишут CollectionChange; команда build_recommendations
+пересчитывает только затронутые строки, а с --full — всю таблицу.
+"""
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CollectionChange, ItemRecommendation, UserCollection
+from .page_cache import RECOMMENDATIONS_TAG, invalidate_tags, item_tag
+
+
+def _csr(rows, values, size):
+    """Индексы строк (ptr) и значения CSR-представления пар (rows[k], values[k])"""
+    order = np.argsort(rows, kind='stable')
+    ptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=ptr[1:])
+    return ptr, values[order]
+
+
+def _gather(ptr, values, rows):
+    """Значения нескольких строк CSR одним массивом"""
+    starts = ptr[rows]
+    lengths = ptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=values.dtype)
+    ends = np.cumsum(lengths)
+    return values[np.repeat(starts - ends + lengths, lengths) + np.arange(total)]
+
+
+class CoOccurrence:
+    """Матрица вхождений предметов в коллекции и строки совместной встречаемости"""
+
+    def __init__(self, pairs):
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        self.users, user_index = np.unique(pairs[:, 0], return_inverse=True)
+        self.items, item_index = np.unique(pairs[:, 1], return_inverse=True)
+        self.user_ptr, self.user_items = _csr(user_index, item_index, len(self.users))
+        self.item_ptr, self.item_users = _csr(item_index, user_index, len(self.items))
+        self.owners = np.diff(self.item_ptr)
+
+    @classmethod
+    def from_collections(cls):
+        pairs = UserCollection.objects.values_list('user_id', 'item_id').order_by()
+        return cls(list(pairs.iterator(chunk_size=10000)))
+
+    def index_of(self, item_pks):
+        """Номера строк для идентификаторов предметов, которых нет в коллекциях, пропускаются"""
+        item_pks = np.asarray(sorted(item_pks), dtype=np.int64)
+        positions = np.searchsorted(self.items, item_pks)
+        positions = positions[positions < len(self.items)]
+        return positions[np.isin(self.items[positions], item_pks)]
+
+    def items_of_users(self, user_pks):
+        positions = np.searchsorted(self.users, np.asarray(sorted(user_pks), dtype=np.int64))
+        positions = positions[positions < len(self.users)]
+        positions = positions[np.isin(self.users[positions], list(user_pks))]
+        return np.unique(_gather(self.user_ptr, self.user_items, positions))
+
+    def neighbours_of(self, rows):
+        """Все предметы, которые хотя бы раз встречаются вместе с rows"""
+        users = np.unique(_gather(self.item_ptr, self.item_users, np.asarray(rows, dtype=np.int64)))
+        return np.unique(_gather(self.user_ptr, self.user_items, users))
+
+    def top_k(self, row, k, min_common=1):
+        """[(номер строки соседа, сходство)] по убыванию сходства"""
+        users = self.item_users[self.item_ptr[row]:self.item_ptr[row + 1]]
+        others, common = np.unique(_gather(self.user_ptr, self.user_items, users), return_counts=True)
+        keep = (others != row) & (common >= min_common)
+        others, common = others[keep], common[keep]
+        if not len(others):
+            return []
+        scores = common / np.sqrt(self.owners[row] * self.owners[others])
+        if len(others) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            others, scores = others[best], scores[best]
+        # При равном сходстве выше предмет с меньшим идентификатором
+        order = np.lexsort((self.items[others], -scores))
+        return list(zip(others[order], scores[order]))
+
+
+def _write(matrix, rows, item_pks):
+    """Заменяет рекомендации item_pks строками rows матрицы"""
+    k = getattr(settings, 'RECOMMENDATIONS_TOP_K', 6)
+    min_common = getattr(settings, 'RECOMMENDATIONS_MIN_COMMON', 2)
+    batch_size = getattr(settings, 'RECOMMENDATIONS_BATCH_SIZE', 1000)
+
+    if item_pks is None:
+        ItemRecommendation.objects.all().delete()
+    else:
+        item_pks = list(item_pks)
+        for start in range(0, len(item_pks), batch_size):
+            ItemRecommendation.objects.filter(item_id__in=item_pks[start:start + batch_size]).delete()
+
+    batch = []
+    written = 0
+    for row in rows:
+        item_pk = int(matrix.items[row])
+        for other, score in matrix.top_k(row, k, min_common):
+            batch.append(ItemRecommendation(
+                item_id=item_pk, recommended_id=int(matrix.items[other]), score=float(score),
+            ))
+        if len(batch) >= batch_size:
+            ItemRecommendation.objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+    ItemRecommendation.objects.bulk_create(batch)
+    return written + len(batch)
+
+
+def rebuild_recommendations():
+    """Полный пересчет; возвращает (предметов, рекомендаций)"""
+    with transaction.atomic():
+        last_change = CollectionChange.objects.aggregate(last=Max('pk'))['last']
+        matrix = CoOccurrence.from_collections()
+        written = _write(matrix, range(len(matrix.items)), None)
+        if last_change is not None:
+            CollectionChange.objects.filter(pk__lte=last_change).delete()
+        invalidate_tags(RECOMMENDATIONS_TAG)
+    return len(matrix.items), written
+
+
+def refresh_recommendations():
+    """
+    Пересчитывает рекомендации, затронутые изменениями коллекций;
+    возвращает (предметов, рекомендаций).
+
+    У добавленного или удаленного предмета меняются число владельцев и пересечения
+    со всеми предметами, с которыми он встречается, а у предметов того же
+    пользователя — пересечение с ним. Их строки и пересчитываются.
+    """
+    with transaction.atomic():
+        last_change = CollectionChange.objects.aggregate(last=Max('pk'))['last']
+        if last_change is None:
+            return 0, 0
+        changes = list(CollectionChange.objects.filter(pk__lte=last_change).values_list('user_pk', 'item_pk'))
+        changed_users = {user_pk for user_pk, _ in changes}
+        changed_items = {item_pk for _, item_pk in changes}
+
+        matrix = CoOccurrence.from_collections()
+        rows = np.union1d(
+            matrix.neighbours_of(matrix.index_of(changed_items)),
+            matrix.items_of_users(changed_users),
+        )
+        item_pks = changed_items | {int(pk) for pk in matrix.items[rows]}
+        written = _write(matrix, rows, item_pks)
+        CollectionChange.objects.filter(pk__lte=last_change).delete()
+        invalidate_tags(*(item_tag(pk) for pk in item_pks))
+    return len(item_pks), written
+
+
+@receiver(post_save, sender=UserCollection)
+def collection_item_added(sender, instance, created, **kwargs):
+    if created:
+        CollectionChange.objects.create(user_pk=instance.user_id, item_pk=instance.item_id)
+
+
+@receiver(post_delete, sender=UserCollection)
+def collection_item_removed(sender, instance, **kwargs):
+    CollectionChange.objects.create(user_pk=instance.user_id, item_pk=instance.item_id)
@@ -0,0 +1,43 @@
+"""
+Маршрутизация чтения на реплики базы данных.
+
+Чтение моделей каталога идет с реплики только внутри запроса к представлению
+с атрибутом read_from_replica = True (его включает ReplicaRoutingMiddleware)
+и только если пользователь недавно ничего не записывал. Остальные запросы,
+все записи и модели auth/sessions всегда работают с основной базой.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+REPLICA_APPS = {'catalog', 'hitcount'}
+
+# Реплика, выбранная для текущего запроса (одна на запрос, чтобы данные
+# на странице были согласованы), или None
+current_replica = ContextVar('current_replica', default=None)
+
+
+def choose_replica():
+    replicas = getattr(settings, 'REPLICA_DATABASES', [])
+    return random.choice(replicas) if replicas else None
+
+
+def is_replica_view(view_func):
+    view = getattr(view_func, 'view_class', view_func)
+    return getattr(view, 'read_from_replica', False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = current_replica.get()
+        if replica and model._meta.app_label in REPLICA_APPS:
+            return replica
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
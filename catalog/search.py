@@ -0,0 +1,202 @@
+"""
+Полнотекстовый поиск по предметам коллекции.
+
+На PostgreSQL используется сохраняемая колонка search_vector (tsvector
+с русской морфологией, веса: название A, страна B, описание C) с GIN-индексом;
+колонка вычисляется самой базой, поэтому всегда соответствует строке.
+На SQLite используется виртуальная таблица FTS5, которая обновляется
+сигналами при сохранении и удалении предмета. Для остальных баз
+поиск сводится к icontains.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import CollectibleItem
+
+FTS_TABLE = 'catalog_collectibleitem_fts'
+
+# Маркеры подсветки, которые не встречаются в тексте; заменяются на <mark> после экранирования
+_START, _STOP = '\x02', '\x03'
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Наличие таблицы FTS5 для каждой базы SQLite (проверяется один раз)
+_fts_tables = {}
+
+
+def _backend():
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite' and _sqlite_fts_exists():
+        return 'sqlite'
+    return None
+
+
+def _sqlite_fts_exists():
+    name = connection.settings_dict['NAME']
+    if name not in _fts_tables:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE]
+            )
+            _fts_tables[name] = cursor.fetchone() is not None
+    return _fts_tables[name]
+
+
+def _fts5_query(query):
+    """Запрос FTS5: каждое слово ищется как префикс, слова объединяются через AND"""
+    words = _WORD_RE.findall(query)
+    return ' '.join('"%s"*' % word for word in words)
+
+
+def _render_highlight(text):
+    return mark_safe(
+        escape(text).replace(_START, '<mark>').replace(_STOP, '</mark>')
+    )
+
+
+def search_item_ids(query, limit=None):
+    """
+    Возвращает id предметов, подходящих под запрос, в порядке релевантности.
+
+    Количество результатов ограничено SEARCH_MAX_RESULTS, чтобы время ответа
+    не зависело от размера каталога.
+    """
+    if limit is None:
+        limit = getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+    backend = _backend()
+    table = CollectibleItem._meta.db_table
+
+    if backend == 'postgresql':
+        sql = (
+            "SELECT id FROM {table}, websearch_to_tsquery('russian', %s) query "
+            "WHERE search_vector @@ query "
+            "ORDER BY ts_rank_cd(search_vector, query) DESC, id DESC LIMIT %s"
+        ).format(table=table)
+        params = [query, limit]
+    elif backend == 'sqlite':
+        fts_query = _fts5_query(query)
+        if not fts_query:
+            return []
+        # bm25 возвращает меньшие значения для более релевантных строк
+        sql = (
+            "SELECT rowid FROM {fts} WHERE {fts} MATCH %s "
+            "ORDER BY bm25({fts}, 10.0, 1.0, 5.0), rowid DESC LIMIT %s"
+        ).format(fts=FTS_TABLE)
+        params = [fts_query, limit]
+    else:
+        words = _WORD_RE.findall(query)
+        if not words:
+            return []
+        items = CollectibleItem.objects.all()
+        for word in words:
+            items = items.filter(
+                Q(name__icontains=word)
+                | Q(description__icontains=word)
+                | Q(country__icontains=word)
+            )
+        return list(items.order_by('-created_at').values_list('pk', flat=True)[:limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_highlights(query, ids):
+    """Фрагменты описания с подсвеченными совпадениями для предметов ids: {id: html}"""
+    ids = list(ids)
+    if not ids:
+        return {}
+    backend = _backend()
+    placeholders = ', '.join(['%s'] * len(ids))
+
+    if backend == 'postgresql':
+        sql = (
+            "SELECT id, ts_headline('russian', description, websearch_to_tsquery('russian', %s), %s) "
+            "FROM {table} WHERE id IN ({placeholders})"
+        ).format(table=CollectibleItem._meta.db_table, placeholders=placeholders)
+        options = f'StartSel={_START}, StopSel={_STOP}, MaxWords=35, MinWords=15'
+        params = [query, options, *ids]
+    elif backend == 'sqlite':
+        sql = (
+            "SELECT rowid, snippet({fts}, 1, %s, %s, '…', 24) FROM {fts} "
+            "WHERE {fts} MATCH %s AND rowid IN ({placeholders})"
+        ).format(fts=FTS_TABLE, placeholders=placeholders)
+        params = [_START, _STOP, _fts5_query(query), *ids]
+    else:
+        return {}
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {pk: _render_highlight(text) for pk, text in cursor.fetchall()}
+
+
+def index_item(item):
+    """Обновляет запись предмета в индексе FTS5 (на PostgreSQL индекс обновляет сама база)"""
+    if _backend() != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {fts} WHERE rowid = %s".format(fts=FTS_TABLE), [item.pk])
+        cursor.execute(
+            "INSERT INTO {fts} (rowid, name, description, country) VALUES (%s, %s, %s, %s)".format(
+                fts=FTS_TABLE
+            ),
+            [item.pk, item.name, item.description, item.country],
+        )
+
+
+def unindex_item(pk):
+    """Удаляет предмет из индекса FTS5"""
+    if _backend() != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {fts} WHERE rowid = %s".format(fts=FTS_TABLE), [pk])
+
+
+def index_items(items):
+    """Добавляет в индекс FTS5 новые предметы (например, после bulk_create)"""
+    if _backend() != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO {fts} (rowid, name, description, country) VALUES (%s, %s, %s, %s)".format(
+                fts=FTS_TABLE
+            ),
+            [(item.pk, item.name, item.description, item.country) for item in items],
+        )
+
+
+def rebuild_index():
+    """Перестраивает индекс FTS5 целиком (например, после восстановления базы)"""
+    if _backend() != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {fts}".format(fts=FTS_TABLE))
+        cursor.execute(
+            "INSERT INTO {fts} (rowid, name, description, country) "
+            "SELECT id, name, description, country FROM {table}".format(
+                fts=FTS_TABLE, table=CollectibleItem._meta.db_table
+            )
+        )
+
+
+@receiver(post_save, sender=CollectibleItem)
+def item_saved(sender, instance, **kwargs):
+    """Синхронизация поискового индекса при сохранении предмета"""
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not {'name', 'description', 'country'} & set(update_fields):
+        return
+    index_item(instance)
+
+
+@receiver(post_delete, sender=CollectibleItem)
+def item_deleted(sender, instance, **kwargs):
+    """Удаление предмета из поискового индекса"""
+    unindex_item(instance.pk)
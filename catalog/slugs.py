@@ -0,0 +1,62 @@
+"""
+Слаги для кириллических названий.
+
+django.utils.text.slugify отбрасывает кириллицу, поэтому название сначала
+транслитерируется (так же, как в слагах из data.json: «Юбилейные монеты» →
+yubileynye-monety).
+"""
+from django.db.models import Q
+from django.utils.text import slugify
+
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+
+
+def slugify_name(value, max_length=None):
+    """Слаг из названия с транслитерацией кириллицы"""
+    text = ''.join(TRANSLIT.get(char, char) for char in str(value).lower())
+    slug = slugify(text)
+    if max_length:
+        slug = slug[:max_length].strip('-')
+    return slug
+
+
+def allocate_slugs(model, names, taken=None, max_length=200, default='item'):
+    """
+    Уникальные слаги для списка названий: занятые слаги выбираются из базы
+    двумя запросами на весь список, при совпадении добавляется суффикс -2, -3...
+
+    taken — множество слагов, уже выделенных ранее (например, в предыдущих
+    пачках импорта); оно пополняется выделенными слагами.
+    """
+    taken = set() if taken is None else taken
+    # Запас под суффикс
+    bases = [slugify_name(name, max_length - 8) or default for name in names]
+
+    existing = set(model.objects.filter(slug__in=set(bases)).values_list('slug', flat=True))
+    seen = set()
+    collided = set()
+    for base in bases:
+        if base in existing or base in taken or base in seen:
+            collided.add(base)
+        seen.add(base)
+    if collided:
+        condition = Q()
+        for base in collided:
+            condition |= Q(slug__startswith=f'{base}-')
+        existing.update(model.objects.filter(condition).values_list('slug', flat=True))
+
+    slugs = []
+    for base in bases:
+        slug, number = base, 2
+        while slug in existing or slug in taken:
+            slug = f'{base}-{number}'
+            number += 1
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
@@ -0,0 +1,44 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+from catalog.images import derivative_name
+
+register = template.Library()
+
+# Ширина карточки в сетке списков: 4 колонки на lg, 3 на md, 1 на мобильных
+CARD_SIZES = '(min-width: 992px) 25vw, (min-width: 768px) 33vw, 100vw'
+
+
+def _srcset(name, variants, extension):
+    return ', '.join(
+        f"{default_storage.url(derivative_name(name, variants['hash'], width, extension))} {width}w"
+        for width in variants['widths']
+    )
+
+
+@register.simple_tag
+def item_picture(item, css_class='', sizes=CARD_SIZES):
+    """
+    Изображение предмета с srcset из производных (WebP и запасной формат).
+
+    Пока производные не созданы, выводится оригинал.
+    """
+    if not item.image:
+        return ''
+    name = item.image.name
+    variants = item.image_variants or {}
+    if variants.get('source') != name:
+        return format_html('<img src="{}" class="{}" alt="{}" loading="lazy">',
+                           item.image.url, css_class, item.name)
+
+    fallback = variants['fallback']
+    smallest = derivative_name(name, variants['hash'], variants['widths'][0], fallback)
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" class="{}" alt="{}" loading="lazy">'
+        '</picture>',
+        _srcset(name, variants, 'webp'), sizes,
+        default_storage.url(smallest), _srcset(name, variants, fallback), sizes, css_class, item.name,
+    )
@@ -1,17 +1,58 @@
 import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import skipUnless
 from unittest.mock import patch
 
-from django.test import TestCase, Client
+from asgiref.sync import iscoroutinefunction
+
+from django.test import TestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
-from django.db import IntegrityError
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, connection, connections
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
 from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.core.management import call_command
+from django.conf import settings
+from django.http import HttpResponse
+from hitcount.models import BlacklistIP, Hit, HitCount
 
 from .models import (
     Category, CollectibleItem, Comment, Vote, UserCollection,
-    Poll, PollOption, PollVote, VisitCount
+    Poll, PollOption, PollVote, VisitCount, VisitTotal, CollectionChange, ItemRecommendation, TrendingScore
 )
 from .forms import CommentForm, PollVoteForm, VoteForm  # VoteForm wasn't used in views but exists
+from .counters import VisitBuffer, apply_visits, get_visit_totals, record_visitor, visit_buffer
+from .hll import HyperLogLog, hash64
+from . import db_pool, metrics
+from .collection_stats import collection_stats
+from .facets import facet_counts
+from .hits import apply_hits, process_queue, ready_segments
+from .images import derivative_name
+from .recommendations import CoOccurrence, rebuild_recommendations, refresh_recommendations
+from .trending import current_score, update_trending
+from .middleware import (
+    AnonymousPageCacheMiddleware, MediaFilesMiddleware, ReplicaRoutingMiddleware, StaticFilesMiddleware,
+    VisitCounterMiddleware,
+)
+from .pagination import KeysetPaginator
+from .polls import poll_results
+from .routers import ReplicaRouter, current_replica
+from .search import search_highlights, search_item_ids
+from .slugs import allocate_slugs, slugify_name
+from .views import IndexView, user_collection, vote_item
 
 
 # Helper functions to create objects
@@ -146,8 +187,10 @@ class FormTests(TestCase):
         self.assertIn('option', form.errors)
 
 
+@override_settings(HIT_QUEUE_ENABLED=False)
 class ViewTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.user = create_user(username="viewtestuser")
         self.category = create_category(name="View Category", slug="view-category")
@@ -259,6 +302,7 @@ class ViewTests(TestCase):
 
 class MiddlewareTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = Client()
         VisitCount.objects.all().delete()  # Clean slate
 
@@ -267,15 +311,24 @@ class MiddlewareTests(TestCase):
         test_date = datetime.date(2023, 10, 26)
         mock_datetime.date.today.return_value = test_date
 
-        response = self.client.get(reverse('index'))  # Non-AJAX GET
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse('index'))  # Non-AJAX GET
         self.assertEqual(response.status_code, 200)
         self.assertTrue(VisitCount.objects.filter(date=test_date, count=1).exists())
-        self.assertTrue(self.client.session.get(f'visited_day_{test_date.isoformat()}'))
+        # Учет посещений не создает сессию анонимного посетителя
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
 
-        # Second request same session, same day - count should not increase
-        self.client.get(reverse('category_list'))
+        # Second request same visitor, same day - count should not increase
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('category_list'))
+        self.assertFalse([query for query in queries if 'catalog_visitcount' in query['sql']])
         visit_count = VisitCount.objects.get(date=test_date)
         self.assertEqual(visit_count.count, 1)
+        self.assertEqual(len(visit_count.sketch), 2 ** settings.VISIT_SKETCH_PRECISION)
+
+        # Другой браузер с того же адреса — другой посетитель
+        self.client.get(reverse('category_list'), HTTP_USER_AGENT='Other browser')
+        self.assertEqual(VisitCount.objects.get(date=test_date).count, 2)
 
     @patch('catalog.middleware.datetime')
     def test_visit_counter_ajax_request_not_counted(self, mock_datetime):
@@ -307,4 +360,1421 @@ class MiddlewareTests(TestCase):
         self.client.get('/admin/')
         self.client.get('/static/some.css')
         self.client.get('/media/some.png')
-        self.assertFalse(VisitCount.objects.filter(date=test_date).exists())
\ No newline at end of file
+        self.assertFalse(VisitCount.objects.filter(date=test_date).exists())
+
+
+class VisitBufferTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        visit_buffer.flush()
+        VisitCount.objects.all().delete()
+
+    def tearDown(self):
+        visit_buffer.flush()
+
+    def test_apply_visits_creates_and_increments(self):
+        day = datetime.date(2023, 11, 1)
+        apply_visits(day, 3)
+        apply_visits(day, 2)
+        self.assertEqual(VisitCount.objects.get(date=day).count, 5)
+
+    def test_buffer_flushes_batched_counts(self):
+        buffer = VisitBuffer(flush_interval=3600, flush_threshold=10)
+        day = datetime.date(2023, 11, 2)
+        for visitor in ('a', 'b', 'c', 'd', 'a'):
+            self.assertFalse(buffer.add(day, hash64(visitor)))
+        self.assertEqual(buffer.pending(day), 4)
+        self.assertFalse(VisitCount.objects.filter(date=day).exists())
+
+        buffer.flush()
+        self.assertEqual(buffer.pending(day), 0)
+        self.assertEqual(VisitCount.objects.get(date=day).count, 4)
+
+        # Повторное слияние тех же посетителей ничего не меняет
+        buffer.add(day, hash64('a'))
+        buffer.flush()
+        self.assertEqual(VisitCount.objects.get(date=day).count, 4)
+
+    def test_buffer_threshold_trigger(self):
+        buffer = VisitBuffer(flush_interval=3600, flush_threshold=2)
+        day = datetime.date(2023, 11, 3)
+        self.assertFalse(buffer.add(day, hash64('a')))
+        self.assertFalse(buffer.add(day, hash64('a')))
+        self.assertTrue(buffer.add(day, hash64('b')))
+
+    @override_settings(VISIT_COUNTER_BUFFERED=True, VISIT_COUNTER_FLUSH_INTERVAL=3600,
+                       VISIT_COUNTER_FLUSH_THRESHOLD=1000)
+    @patch('catalog.middleware.datetime')
+    def test_middleware_buffered_mode_skips_database(self, mock_datetime):
+        test_date = datetime.date(2023, 11, 4)
+        mock_datetime.date.today.return_value = test_date
+
+        self.client.get(reverse('index'))
+        self.assertFalse(VisitCount.objects.filter(date=test_date).exists())
+        self.assertEqual(visit_buffer.pending(test_date), 1)
+
+        visit_buffer.flush()
+        self.assertEqual(VisitCount.objects.get(date=test_date).count, 1)
+
+
+class VisitTotalsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        VisitCount.objects.all().delete()
+        VisitTotal.objects.all().delete()
+
+    def test_hyperloglog_estimate(self):
+        sketch = HyperLogLog()
+        for n in range(20000):
+            sketch.add(hash64(str(n)))
+        self.assertAlmostEqual(sketch.estimate(), 20000, delta=20000 * 0.05)
+        self.assertEqual(len(sketch.to_bytes()), 4096)
+        with self.assertRaises(ValueError):
+            HyperLogLog(b'short')
+
+    def test_record_visitor_updates_total_by_estimate(self):
+        day = datetime.date(2023, 12, 5)
+        apply_visits(datetime.date(2023, 12, 1), 3)
+        for visitor in ('a', 'b', 'a'):
+            record_visitor(day, hash64(visitor))
+        self.assertEqual(VisitCount.objects.get(date=day).count, 2)
+        self.assertEqual(VisitTotal.objects.get(pk=1).count, 5)
+
+    def test_legacy_count_survives_first_merge(self):
+        # Строка дня, учтенная до наброска: count есть, sketch пуст
+        day = datetime.date(2023, 12, 6)
+        VisitCount.objects.create(date=day, count=500)
+        VisitTotal.objects.create(pk=1, count=1000)
+        record_visitor(day, hash64('a'))
+        record_visitor(day, hash64('b'))
+        self.assertEqual(VisitCount.objects.get(date=day).count, 502)
+        self.assertEqual(VisitTotal.objects.get(pk=1).count, 1002)
+        # Поправка apply_visits не затирается следующим слиянием
+        apply_visits(day, 10)
+        record_visitor(day, hash64('c'))
+        self.assertEqual(VisitCount.objects.get(date=day).count, 513)
+        self.assertEqual(VisitTotal.objects.get(pk=1).count, 1013)
+
+    def test_apply_visits_maintains_total(self):
+        apply_visits(datetime.date(2023, 12, 1), 3)
+        apply_visits(datetime.date(2023, 12, 2), 4)
+        self.assertEqual(VisitTotal.objects.get(pk=1).count, 7)
+
+    def test_totals_served_from_cache(self):
+        day = datetime.date(2023, 12, 3)
+        apply_visits(day, 2)
+        self.assertEqual(get_visit_totals(day), (2, 2))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_visit_totals(day), (2, 2))
+
+    def test_cached_totals_updated_on_commit(self):
+        day = datetime.date(2023, 12, 4)
+        apply_visits(day, 1)
+        get_visit_totals(day)
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_visits(day, 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_visit_totals(day), (6, 6))
+
+
+class VoteCounterTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.user2 = create_user(username='voter2')
+        self.category = create_category(name='Counter Category')
+        self.item = create_item(self.category, name='Counter Item')
+
+    def assertCounters(self, likes, dislikes):
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.likes_count, self.item.dislikes_count), (likes, dislikes))
+
+    def test_counters_follow_vote_changes(self):
+        vote = Vote.objects.create(item=self.item, user=self.user, value=True)
+        Vote.objects.create(item=self.item, user=self.user2, value=False)
+        self.assertCounters(1, 1)
+
+        vote.value = False
+        vote.save()
+        self.assertCounters(0, 2)
+
+        vote.delete()
+        self.assertCounters(0, 1)
+
+        Vote.objects.filter(item=self.item).delete()
+        self.assertCounters(0, 0)
+
+    def test_vote_item_view_reads_counters(self):
+        self.client.login(username=self.user.username, password='password123')
+        url = reverse('vote_item', kwargs={'slug': self.item.slug})
+        self.client.post(url, {'value': 'true'})
+        data = self.client.post(url, {'value': 'false'}).json()
+        self.assertEqual((data['likes'], data['dislikes']), (0, 1))
+        self.assertCounters(0, 1)
+
+    def test_rebuild_vote_counters_command(self):
+        Vote.objects.create(item=self.item, user=self.user, value=True)
+        CollectibleItem.objects.filter(pk=self.item.pk).update(likes_count=5, dislikes_count=3)
+        call_command('rebuild_vote_counters', stdout=StringIO())
+        self.assertCounters(1, 0)
+
+
+class CategoryCountTests(TestCase):
+    def setUp(self):
+        self.coins = create_category(name='Coins')
+        self.stamps = create_category(name='Stamps')
+
+    def assertCounts(self, coins, stamps):
+        self.coins.refresh_from_db()
+        self.stamps.refresh_from_db()
+        self.assertEqual((self.coins.item_count, self.stamps.item_count), (coins, stamps))
+
+    def test_counts_follow_item_changes(self):
+        item = create_item(self.coins, name='Ruble')
+        create_item(self.coins, name='Kopek')
+        self.assertCounts(2, 0)
+
+        item.category = self.stamps
+        item.save()
+        self.assertCounts(1, 1)
+
+        item.name = 'Ruble 1961'
+        item.save()
+        self.assertCounts(1, 1)
+
+        item.delete()
+        self.assertCounts(1, 0)
+
+    def test_index_orders_categories_by_count(self):
+        create_item(self.stamps, name='Stamp')
+        response = self.client.get(reverse('index'))
+        self.assertEqual(list(response.context['categories']), [self.stamps, self.coins])
+
+    def test_rebuild_category_counts_command(self):
+        create_item(self.coins, name='Ruble')
+        Category.objects.update(item_count=7)
+        call_command('rebuild_category_counts', stdout=StringIO())
+        self.assertCounts(1, 0)
+
+
+class CollectionPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.coins = create_category(name='Coins')
+        self.stamps = create_category(name='Stamps')
+        for index in range(4):
+            item = create_item(self.coins, name=f'Coin {index}')
+            if index < 3:
+                UserCollection.objects.create(user=self.user, item=item)
+        stamp = create_item(self.stamps, name='Stamp')
+        stamp.country = 'France'
+        stamp.save()
+        UserCollection.objects.create(user=self.user, item=stamp)
+        self.client.login(username=self.user.username, password='password123')
+
+    def test_stats_in_one_query(self):
+        with self.assertNumQueries(1):
+            stats = collection_stats(self.user.pk)
+        with self.assertNumQueries(0):
+            collection_stats(self.user.pk)
+        self.assertEqual(stats['total'], 4)
+        self.assertEqual(
+            [(entry['value'], entry['count'], entry['percentage']) for entry in stats['categories']],
+            [('coins', 3, 75), ('stamps', 1, 100)],
+        )
+        self.assertEqual({entry['value']: entry['count'] for entry in stats['countries']}, {'Testland': 3, 'France': 1})
+
+    def test_stats_reset_when_collection_changes(self):
+        collection_stats(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            UserCollection.objects.filter(item__category=self.stamps).delete()
+        self.assertEqual(collection_stats(self.user.pk)['total'], 3)
+
+    def test_filters_and_pagination(self):
+        response = self.client.get(reverse('user_collection'), {'country': 'France', 'condition': 'bogus'})
+        self.assertEqual(response.context['filters'], {'country': 'France'})
+        self.assertEqual([uc.item.name for uc in response.context['collection_items']], ['Stamp'])
+        self.assertEqual(response.context['page_obj'].paginator.estimated_count, 1)
+
+        with patch('catalog.views.COLLECTION_PAGE_SIZE', 2):
+            first = self.client.get(reverse('user_collection'), {'category': 'coins'})
+            page = first.context['page_obj']
+            second = self.client.get(reverse('user_collection'), {'category': 'coins', 'cursor': page.next_cursor})
+        names = [uc.item.name for uc in first.context['collection_items']]
+        names += [uc.item.name for uc in second.context['collection_items']]
+        self.assertEqual(names, ['Coin 2', 'Coin 1', 'Coin 0'])
+        self.assertFalse(second.context['page_obj'].has_next())
+
+
+class ListQueryCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.category = create_category(name='Cards')
+        self.client.login(username=self.user.username, password='password123')
+
+    def add_items(self, count):
+        for _ in range(count):
+            index = CollectibleItem.objects.count()
+            item = create_item(self.category, name=f'Card {index}')
+            Comment.objects.create(item=item, user=self.user, text='Comment')
+            UserCollection.objects.create(user=self.user, item=item)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_listing_queries_do_not_grow_with_items(self):
+        urls = [
+            reverse('index'),
+            reverse('category_detail', kwargs={'slug': self.category.slug}),
+            reverse('user_collection'),
+        ]
+        self.add_items(2)
+        # Первые запросы прогревают сессию, кэш типов контента, счетчик посещений,
+        # фасеты и статистику коллекции
+        for url in urls:
+            self.count_queries(url)
+        before = [self.count_queries(url) for url in urls]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_items(6)
+        for url in urls:
+            self.count_queries(url)
+        after = [self.count_queries(url) for url in urls]
+        self.assertEqual(before, after)
+
+    def test_cards_annotations(self):
+        self.add_items(1)
+        item = CollectibleItem.objects.cards().get()
+        self.assertEqual(item.comments_count, 1)
+        self.assertEqual(item.hits, 0)
+        self.assertEqual(item.short_description, 'Test description')
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.category = create_category(name='Search Category')
+        self.ruble = CollectibleItem.objects.create(
+            name='Рубль 1961', slug='rubl-1961', category=self.category,
+            description='Монета СССР номиналом один рубль', country='СССР', condition='XF'
+        )
+        self.stamp = CollectibleItem.objects.create(
+            name='Марка 2024', slug='marka-2024', category=self.category,
+            description='Почтовая марка, посвященная рублю', country='Россия', condition='UNC'
+        )
+
+    def test_name_match_ranked_first(self):
+        self.assertEqual(search_item_ids('рубл'), [self.ruble.pk, self.stamp.pk])
+
+    def test_prefix_and_all_words(self):
+        self.assertEqual(search_item_ids('почтов мар'), [self.stamp.pk])
+        self.assertEqual(search_item_ids('!!!'), [])
+
+    def test_index_follows_save_and_delete(self):
+        self.stamp.name = 'Конверт'
+        self.stamp.description = 'Почтовый конверт'
+        self.stamp.save()
+        self.assertEqual(search_item_ids('марка'), [])
+        self.ruble.delete()
+        self.assertEqual(search_item_ids('СССР'), [])
+
+    def test_highlight_escapes_text(self):
+        self.ruble.description = '<b>Монета</b> СССР'
+        self.ruble.save()
+        highlight = search_highlights('монета', [self.ruble.pk])[self.ruble.pk]
+        self.assertEqual(highlight, '&lt;b&gt;<mark>Монета</mark>&lt;/b&gt; СССР')
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search'), {'q': 'СССР'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/search.html')
+        self.assertEqual(response.context['items'], [self.ruble])
+        self.assertContains(response, '<mark>СССР</mark>')
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.coins = create_category(name='Coins')
+        self.stamps = create_category(name='Stamps')
+        for name, category, country, condition, year in [
+            ('Coin A', self.coins, 'СССР', 'XF', 1961),
+            ('Coin B', self.coins, 'СССР', 'UNC', 1961),
+            ('Coin C', self.coins, 'Россия', 'UNC', 2024),
+            ('Stamp A', self.stamps, 'Россия', 'UNC', 2024),
+        ]:
+            CollectibleItem.objects.create(
+                name=name, category=category, description='d', country=country,
+                condition=condition, issue_date=datetime.date(year, 1, 1)
+            )
+
+    def test_counts_without_filters(self):
+        counts = facet_counts({})
+        self.assertEqual(counts['category'], {'coins': 3, 'stamps': 1})
+        self.assertEqual(counts['country'], {'СССР': 2, 'Россия': 2})
+        self.assertEqual(counts['year'], {1961: 2, 2024: 2})
+
+    def test_counts_exclude_own_filter(self):
+        counts = facet_counts({'country': 'Россия', 'condition': 'UNC'})
+        # Фасет страны считается без фильтра по стране
+        self.assertEqual(counts['country'], {'СССР': 1, 'Россия': 2})
+        self.assertEqual(counts['condition'], {'UNC': 2})
+        self.assertEqual(counts['category'], {'coins': 1, 'stamps': 1})
+
+    def test_counts_cached_and_invalidated(self):
+        facet_counts({'category': 'coins'})
+        with self.assertNumQueries(0):
+            facet_counts({'category': 'coins'})
+        CollectibleItem.objects.create(
+            name='Coin D', category=self.coins, description='d', country='США', condition='F'
+        )
+        self.assertEqual(facet_counts({'category': 'coins'})['country']['США'], 1)
+
+    def test_index_view_filters(self):
+        response = self.client.get(reverse('index'), {'category': 'coins', 'year': '1961'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(item.name for item in response.context['items']), ['Coin A', 'Coin B']
+        )
+        self.assertEqual(response.context['filters'], {'category': 'coins', 'year': 1961})
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = create_category(name='Paged')
+        created_at = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        for index in range(7):
+            item = create_item(self.category, name=f'Paged {index}')
+            # Два предмета с одинаковой датой проверяют разрешение по id
+            CollectibleItem.objects.filter(pk=item.pk).update(
+                created_at=created_at + datetime.timedelta(days=index // 2)
+            )
+        self.expected = list(
+            CollectibleItem.objects.order_by('-created_at', '-id').values_list('pk', flat=True)
+        )
+
+    def ids(self, page):
+        return [item.pk for item in page.object_list]
+
+    def test_forward_and_backward(self):
+        paginator = KeysetPaginator(CollectibleItem.objects.all(), 3)
+        first = paginator.page()
+        self.assertEqual(self.ids(first), self.expected[:3])
+        self.assertFalse(first.has_previous())
+
+        second = paginator.page(first.next_cursor)
+        third = paginator.page(second.next_cursor)
+        self.assertEqual(self.ids(second), self.expected[3:6])
+        self.assertEqual(self.ids(third), self.expected[6:])
+        self.assertFalse(third.has_next())
+
+        back = paginator.page(third.previous_cursor)
+        self.assertEqual(self.ids(back), self.expected[3:6])
+        back = paginator.page(back.previous_cursor)
+        self.assertEqual(self.ids(back), self.expected[:3])
+        self.assertFalse(back.has_previous())
+
+    def test_invalid_cursor_returns_first_page(self):
+        paginator = KeysetPaginator(CollectibleItem.objects.all(), 3)
+        self.assertEqual(self.ids(paginator.page('garbage')), self.expected[:3])
+
+    @patch('catalog.views.CategoryDetailView.paginate_by', 4)
+    def test_category_detail_paginated(self):
+        url = reverse('category_detail', kwargs={'slug': self.category.slug})
+        response = self.client.get(url)
+        self.assertEqual([item.pk for item in response.context['items']], self.expected[:4])
+        response = self.client.get(url, {'cursor': response.context['page_obj'].next_cursor})
+        self.assertEqual([item.pk for item in response.context['items']], self.expected[4:])
+        # На SQLite оценка количества не выполняется
+        self.assertIsNone(response.context['page_obj'].paginator.estimated_count)
+
+    def test_index_cursor(self):
+        response = self.client.get(reverse('index'))
+        page = response.context['page_obj']
+        self.assertFalse(page.has_next())
+        self.assertEqual([item.pk for item in response.context['items']], self.expected)
+
+
+@override_settings(PAGE_CACHE_ENABLED=True, HIT_QUEUE_ENABLED=False)
+class CommentPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.category = create_category(name='Commented')
+        self.item = create_item(self.category, name='Commented Item')
+        for index in range(13):
+            Comment.objects.create(item=self.item, user=self.user, text=f'Comment {index}')
+
+    def test_comments_count_counter(self):
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.comments_count, 13)
+        Comment.objects.filter(item=self.item).first().delete()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.comments_count, 12)
+
+    def test_first_page_inline_and_next_page_endpoint(self):
+        response = self.client.get(reverse('item_detail', kwargs={'slug': self.item.slug}))
+        page = response.context['comments_page']
+        self.assertEqual(len(page.object_list), 10)
+        self.assertTrue(page.has_next())
+        self.assertContains(response, 'Комментарии (13)')
+
+        url = reverse('item_comments', kwargs={'slug': self.item.slug})
+        # Сессия, предмет и страница комментариев
+        with self.assertNumQueries(3):
+            data = self.client.get(url, {'cursor': page.next_cursor},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertIsNone(data['next_cursor'])
+        self.assertEqual(data['html'].count('card-header'), 3)
+        self.assertIn('Comment 0', data['html'])
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, IMAGE_DERIVATIVES_ASYNC=False,
+                                     IMAGE_DERIVATIVE_WIDTHS=(100, 200, 800))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.category = create_category(name='Pictures')
+
+    def make_png(self, size=(400, 300)):
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new('RGBA', size, (200, 150, 50, 255)).save(buffer, 'PNG')
+        return SimpleUploadedFile('coin.png', buffer.getvalue(), content_type='image/png')
+
+    def test_derivatives_generated_after_save(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = CollectibleItem.objects.create(
+                name='Picture Coin', category=self.category, description='d',
+                country='c', condition='F', image=self.make_png()
+            )
+        item.refresh_from_db()
+        variants = item.image_variants
+        self.assertEqual(variants['source'], item.image.name)
+        self.assertEqual(variants['widths'], [100, 200])
+        self.assertEqual(variants['fallback'], 'png')
+        for width in variants['widths']:
+            for extension in ('webp', 'png'):
+                self.assertTrue(default_storage.exists(
+                    derivative_name(item.image.name, variants['hash'], width, extension)
+                ))
+
+        html = Template('{% load catalog_images %}{% item_picture item "card-img-top" %}').render(
+            Context({'item': item})
+        )
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('.100w.webp 100w', html)
+        self.assertIn('.200w.png 200w', html)
+
+    def test_original_used_until_derivatives_exist(self):
+        item = CollectibleItem.objects.create(
+            name='Pending Coin', category=self.category, description='d',
+            country='c', condition='F', image=self.make_png()
+        )
+        html = Template('{% load catalog_images %}{% item_picture item %}').render(Context({'item': item}))
+        self.assertIn(f'src="{item.image.url}"', html)
+        self.assertNotIn('srcset', html)
+
+
+class PollTallyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.poll = create_poll()
+        self.option1 = create_poll_option(self.poll, 'One')
+        self.option2 = create_poll_option(self.poll, 'Two')
+        self.users = [create_user(username=f'poller{index}') for index in range(3)]
+
+    def test_tallies_follow_votes(self):
+        votes = [PollVote.objects.create(poll=self.poll, option=self.option1, user=user) for user in self.users]
+        votes[0].option = self.option2
+        votes[0].save()
+        votes[1].delete()
+        self.option1.refresh_from_db()
+        self.option2.refresh_from_db()
+        self.assertEqual((self.option1.votes_count, self.option2.votes_count), (1, 1))
+
+    def test_results_snapshot_cached_and_invalidated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            PollVote.objects.create(poll=self.poll, option=self.option2, user=self.users[0])
+        options, total = poll_results(self.poll)
+        self.assertEqual(total, 1)
+        self.assertEqual([(o['text'], o['vote_count'], o['percentage']) for o in options],
+                         [('Two', 1, 100), ('One', 0, 0)])
+        with self.assertNumQueries(0):
+            poll_results(self.poll)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PollVote.objects.create(poll=self.poll, option=self.option1, user=self.users[1])
+        options, total = poll_results(self.poll)
+        self.assertEqual(total, 2)
+        self.assertEqual([o['percentage'] for o in options], [50, 50])
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        queue_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, queue_dir, ignore_errors=True)
+        override = override_settings(PAGE_CACHE_ENABLED=True, HIT_QUEUE_ENABLED=True, HIT_QUEUE_DIR=queue_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = create_user()
+        self.category = create_category(name='Cached')
+        self.item = create_item(self.category, name='Cached Item')
+        self.item_url = reverse('item_detail', kwargs={'slug': self.item.slug})
+
+    def test_anonymous_page_served_from_cache(self):
+        first = self.client.get(self.item_url)
+        self.assertEqual(first['X-Page-Cache'], 'MISS')
+        second = self.client.get(self.item_url)
+        self.assertEqual(second['X-Page-Cache'], 'HIT')
+        self.assertEqual(first.content, second.content)
+
+    def test_authenticated_pages_not_cached(self):
+        self.client.login(username=self.user.username, password='password123')
+        self.client.get(self.item_url)
+        self.assertNotIn('X-Page-Cache', self.client.get(self.item_url))
+
+    def test_signals_invalidate_affected_pages(self):
+        index_url = reverse('index')
+        self.client.get(self.item_url)
+        self.client.get(index_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(item=self.item, user=self.user, text='Fresh comment')
+        response = self.client.get(self.item_url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, 'Fresh comment')
+        # Комментарий не затрагивает главную страницу
+        self.assertEqual(self.client.get(index_url)['X-Page-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.name = 'Renamed Item'
+            self.item.save()
+        self.assertContains(self.client.get(index_url), 'Renamed Item')
+
+    def test_moved_item_invalidates_old_category_with_one_lookup(self):
+        other = create_category(name='Other Cached')
+        old_url = reverse('category_detail', kwargs={'slug': self.category.slug})
+        self.client.get(old_url)
+        self.item.category = other
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            self.item.save()
+        lookups = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(self.client.get(old_url)['X-Page-Cache'], 'MISS')
+
+    def test_rebuild_vote_counters_invalidates_pages(self):
+        category_url = reverse('category_detail', kwargs={'slug': self.category.slug})
+        self.client.get(self.item_url)
+        self.client.get(category_url)
+        CollectibleItem.objects.filter(pk=self.item.pk).update(likes_count=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_vote_counters', stdout=StringIO())
+        self.assertEqual(self.client.get(self.item_url)['X-Page-Cache'], 'MISS')
+        self.assertEqual(self.client.get(category_url)['X-Page-Cache'], 'MISS')
+
+    def test_hits_counted_on_cache_hit(self):
+        self.client.get(self.item_url)
+        other = Client(HTTP_USER_AGENT='Other browser')
+        response = other.get(self.item_url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        process_queue(now=time.time() + 60)
+        self.assertEqual(self.item.hit_count.hits, 2)
+
+
+class HitQueueTests(TestCase):
+    def setUp(self):
+        queue_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, queue_dir, ignore_errors=True)
+        override = override_settings(HIT_QUEUE_ENABLED=True, HIT_QUEUE_DIR=queue_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = create_user()
+        self.item = create_item(create_category(name='Viewed'), name='Viewed Item')
+        self.url = reverse('item_detail', kwargs={'slug': self.item.slug})
+
+    def test_view_only_enqueues_hit(self):
+        self.client.get(self.url)
+        self.assertEqual(self.item.hit_count.hits, 0)
+        # Текущий сегмент еще открыт для записи и не обрабатывается
+        self.assertEqual(process_queue(), (0, 0))
+        self.assertEqual(process_queue(now=time.time() + 60), (1, 1))
+        self.assertEqual(self.item.hit_count.hits, 1)
+        self.assertEqual(ready_segments(now=time.time() + 60), [])
+
+    def test_repeated_hits_deduplicated(self):
+        self.client.login(username=self.user.username, password='password123')
+        for _ in range(3):
+            self.client.get(self.url)
+        Client(HTTP_USER_AGENT='Bot').get(self.url)
+        Client(HTTP_USER_AGENT='Bot').get(self.url)
+        self.assertEqual(process_queue(now=time.time() + 60), (5, 2))
+
+        # Повторный просмотр в пределах HITCOUNT_KEEP_HIT_ACTIVE не учитывается
+        self.client.get(self.url)
+        self.assertEqual(process_queue(now=time.time() + 60), (1, 0))
+        self.assertEqual(self.item.hit_count.hits, 2)
+
+    def test_only_batch_visitors_loaded_from_active_hits(self):
+        hitcount = HitCount.objects.get_for_object(self.item)
+        for n in range(3):
+            Hit.objects.create(hitcount=hitcount, ip=f'10.0.0.{n}', session='', user_agent='Other')
+        Hit.objects.create(hitcount=hitcount, ip='10.0.1.1', session='', user_agent='Repeat')
+        entries = [
+            {'hitcount': hitcount.pk, 'user': None, 'session': '', 'ip': ip, 'user_agent': 'Repeat', 'ts': 0}
+            for ip in ('10.0.1.1', '10.0.1.2')
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(apply_hits(entries), 1)
+        active = [query['sql'] for query in queries if 'FROM "hitcount_hit"' in query['sql']]
+        self.assertTrue(active)
+        self.assertTrue(all('"hitcount_hit"."ip" IN' in sql for sql in active))
+
+    def test_blacklisted_ip_skipped(self):
+        BlacklistIP.objects.create(ip='127.0.0.1')
+        self.client.get(self.url)
+        self.assertEqual(process_queue(now=time.time() + 60), (1, 0))
+
+
+class ImportItemsTests(TestCase):
+    def setUp(self):
+        self.category = create_category(name='Монеты СССР', slug='monety-sssr')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write(self, name, content):
+        path = f'{self.directory}/{name}'
+        with open(path, 'w', encoding='utf-8') as target:
+            target.write(content)
+        return path
+
+    def test_slugify_name_transliterates_cyrillic(self):
+        self.assertEqual(slugify_name('Юбилейные монеты'), 'yubileynye-monety')
+        self.assertEqual(slugify_name('1 рубль 1961 года'), '1-rubl-1961-goda')
+        self.assertEqual(Category.objects.create(name='Марки России').slug, 'marki-rossii')
+
+    def test_allocate_slugs_avoids_existing_and_duplicates(self):
+        create_item(self.category, name='Рубль', slug='rubl')
+        create_item(self.category, name='Рубль 2', slug='rubl-2')
+        self.assertEqual(
+            allocate_slugs(CollectibleItem, ['Рубль', 'Рубль', 'Копейка']),
+            ['rubl-3', 'rubl-4', 'kopeyka'],
+        )
+
+    def test_import_jsonl(self):
+        rows = [
+            {'name': '1 рубль 1961 года', 'description': 'd', 'country': 'СССР',
+             'condition': 'UNC', 'category': 'monety-sssr', 'issue_date': '1961-01-01'},
+            {'name': '1 рубль 1961 года', 'country': 'СССР', 'condition': 'XF',
+             'category': 'monety-sssr'},
+            {'name': 'Марка', 'country': 'Россия', 'condition': 'UNC', 'category': 'missing'},
+        ]
+        path = self.write('items.jsonl', '\n'.join(json.dumps(row, ensure_ascii=False) for row in rows))
+        out, err = StringIO(), StringIO()
+        call_command('import_items', path, batch_size=2, stdout=out, stderr=err)
+
+        slugs = set(CollectibleItem.objects.values_list('slug', flat=True))
+        self.assertEqual(slugs, {'1-rubl-1961-goda', '1-rubl-1961-goda-2'})
+        self.assertIn('неизвестная категория', err.getvalue())
+        self.assertIn('Импортировано: 2', out.getvalue())
+        # bulk_create не вызывает сигналы, новые предметы индексирует команда
+        self.assertEqual(len(search_item_ids('рубл')), 2)
+        self.assertEqual(Category.objects.get(slug='monety-sssr').item_count, 2)
+
+    def test_import_csv_resume(self):
+        path = self.write(
+            'items.csv',
+            'name,country,condition,category,slug\n'
+            'Первая,СССР,F,monety-sssr,first\n'
+            'Вторая,СССР,F,monety-sssr,second\n'
+            'Третья,СССР,F,monety-sssr,third\n',
+        )
+        # Первая пачка уже импортирована прерванным запуском
+        create_item(self.category, name='Первая', slug='first')
+        with open(path + '.progress', 'w') as progress:
+            progress.write('1')
+        call_command('import_items', path, resume=True, batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            sorted(CollectibleItem.objects.values_list('slug', flat=True)), ['first', 'second', 'third']
+        )
+        self.assertFalse(os.path.exists(path + '.progress'))
+
+        # Повторный запуск без --resume пропускает записи с существующими слагами
+        out = StringIO()
+        call_command('import_items', path, stdout=out)
+        self.assertIn('пропущено существующих: 3', out.getvalue())
+
+    def test_resume_checks_whether_checkpointed_batch_committed(self):
+        path = self.write(
+            'items.csv',
+            'name,country,condition,category\n'
+            'Первая,СССР,F,monety-sssr\n'
+            'Вторая,СССР,F,monety-sssr\n',
+        )
+        # Позиция записана, но пачка не зафиксирована: она импортируется заново
+        with open(path + '.progress', 'w') as progress:
+            json.dump({'start': 0, 'end': 1, 'slug': 'pervaya'}, progress)
+        call_command('import_items', path, resume=True, batch_size=1, stdout=StringIO())
+        self.assertEqual(sorted(CollectibleItem.objects.values_list('slug', flat=True)), ['pervaya', 'vtoraya'])
+
+        # Пачка зафиксирована: продолжение без повторной вставки под новым слагом
+        CollectibleItem.objects.filter(slug='vtoraya').delete()
+        with open(path + '.progress', 'w') as progress:
+            json.dump({'start': 0, 'end': 1, 'slug': 'pervaya'}, progress)
+        call_command('import_items', path, resume=True, batch_size=1, stdout=StringIO())
+        self.assertEqual(sorted(CollectibleItem.objects.values_list('slug', flat=True)), ['pervaya', 'vtoraya'])
+        self.assertEqual(len(search_item_ids('Вторая')), 1)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.category = create_category(name='Монеты', slug='monety')
+        self.items = [
+            create_item(self.category, name=f'Монета {n}', slug=f'moneta-{n}') for n in range(3)
+        ]
+        UserCollection.objects.create(user=self.user, item=self.items[0], notes='Из наследства')
+
+    def test_catalog_export_requires_staff(self):
+        self.client.login(username=self.user.username, password='password123')
+        response = self.client.get(reverse('export_catalog'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_catalog_export_streams_csv(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.login(username=self.user.username, password='password123')
+        response = self.client.get(reverse('export_catalog'))
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['slug', 'name', 'description'])
+        self.assertEqual(len(lines), 4)
+        self.assertIn('monety', lines[1])
+
+    def test_collection_export_jsonl(self):
+        self.client.login(username=self.user.username, password='password123')
+        response = self.client.get(reverse('export_collection') + '?format=jsonl')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['item'], 'moneta-0')
+        self.assertEqual(records[0]['notes'], 'Из наследства')
+        self.assertEqual(self.client.get(reverse('export_collection') + '?format=xml').status_code, 404)
+
+    async def test_export_streams_asynchronously_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('export_collection') + '?format=jsonl')
+        # Синхронный итератор Django под ASGI собрал бы целиком через sync_to_async(list)
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([record['item'] for record in records], ['moneta-0'])
+
+    def test_export_command_roundtrips_with_import(self):
+        out = StringIO()
+        call_command('export_items', format='jsonl', stdout=out)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = f'{directory}/catalog.jsonl'
+        with open(path, 'w', encoding='utf-8') as target:
+            target.write(out.getvalue())
+        result = StringIO()
+        call_command('import_items', path, stdout=result)
+        self.assertIn('пропущено существующих: 3', result.getvalue())
+
+
+@override_settings(REPLICA_DATABASES=['replica1'])
+class ReplicaRouterTests(TestCase):
+    def run_middleware(self, request, view_func):
+        seen = {}
+
+        def get_response(request):
+            # Django вызывает process_view внутри цепочки middleware
+            middleware.process_view(request, view_func, (), {})
+            seen['replica'] = current_replica.get()
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        response = middleware(request)
+        return seen['replica'], response
+
+    def test_router_reads_catalog_from_current_replica(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(CollectibleItem), 'default')
+        token = current_replica.set('replica1')
+        try:
+            self.assertEqual(router.db_for_read(CollectibleItem), 'replica1')
+            # Пользователи и сессии всегда читаются с основной базы
+            self.assertEqual(router.db_for_read(User), 'default')
+            self.assertEqual(router.db_for_write(CollectibleItem), 'default')
+        finally:
+            current_replica.reset(token)
+
+    def test_only_marked_views_use_replica(self):
+        factory = RequestFactory()
+        replica, _ = self.run_middleware(factory.get('/'), IndexView.as_view())
+        self.assertEqual(replica, 'replica1')
+        replica, _ = self.run_middleware(factory.get('/'), user_collection)
+        self.assertIsNone(replica)
+        self.assertIsNone(current_replica.get())
+
+    def test_write_pins_visitor_to_primary(self):
+        factory = RequestFactory()
+        _, response = self.run_middleware(factory.post('/'), vote_item)
+        self.assertIn(ReplicaRoutingMiddleware.cookie_name, response.cookies)
+
+        request = factory.get('/')
+        request.COOKIES[ReplicaRoutingMiddleware.cookie_name] = '1'
+        replica, _ = self.run_middleware(request, IndexView.as_view())
+        self.assertIsNone(replica)
+
+
+@skipUnless('replica1' in settings.DATABASES, 'реплика не настроена (DATABASE_REPLICA_URLS)')
+@override_settings(PAGE_CACHE_ENABLED=False, HIT_QUEUE_ENABLED=False)
+class ReplicaDatabaseTests(TestCase):
+    """
+    Проверка на двух SQLite-базах:
+    DATABASE_REPLICA_URLS=sqlite:////tmp/replica.sqlite3 python manage.py test catalog.tests.ReplicaDatabaseTests
+    """
+    databases = set(settings.DATABASES)
+
+    @override_settings(REPLICA_DATABASES=['replica1'])
+    def test_read_views_use_replica_until_write(self):
+        category = create_category(name='Primary only', slug='primary-only')
+        create_item(category, name='Primary Item', slug='primary-item')
+        replica_category = Category.objects.using('replica1').create(name='Replica', slug='replica')
+        CollectibleItem.objects.using('replica1').create(
+            name='Replica Item', slug='replica-item', category=replica_category,
+            description='d', country='c', condition='F',
+        )
+
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Replica Item')
+        self.assertNotContains(response, 'Primary Item')
+
+        self.client.cookies[ReplicaRoutingMiddleware.cookie_name] = '1'
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Primary Item')
+
+
+class DatabasePoolTests(TestCase):
+    def setUp(self):
+        db_pool.reset_pool_stats()
+
+    def test_requests_counted_as_checkouts(self):
+        self.client.get(reverse('category_list'))
+        stats = db_pool.pool_stats()
+        self.assertEqual(stats['checkouts'], 1)
+        # В тестах соединение открыто заранее и переиспользуется
+        self.assertEqual(stats['reused'], 1)
+
+    @override_settings(DB_POOL_SIZE=1, DB_POOL_TIMEOUT=0.01)
+    def test_pool_size_bounds_concurrent_checkouts(self):
+        with patch.object(db_pool, '_semaphore', None):
+            db_pool.checkout(sender=None)
+            worker = threading.Thread(target=db_pool.checkout, kwargs={'sender': None})
+            worker.start()
+            worker.join()
+            db_pool.checkin(sender=None)
+            stats = db_pool.pool_stats()
+            self.assertEqual((stats['checkouts'], stats['waits'], stats['timeouts']), (1, 1, 1))
+            # После возврата место снова свободно
+            self.assertTrue(db_pool._semaphore.acquire(blocking=False))
+            db_pool._semaphore.release()
+
+    @override_settings(DB_POOL_SIZE=1, DB_POOL_TIMEOUT=0.01)
+    def test_asgi_requests_do_not_wait_for_pool(self):
+        with patch.object(db_pool, '_semaphore', None):
+            db_pool.checkout(sender=None)
+            worker = threading.Thread(target=db_pool.checkout, kwargs={'sender': None, 'scope': {'type': 'http'}})
+            worker.start()
+            worker.join()
+            db_pool.checkin(sender=None)
+            stats = db_pool.pool_stats()
+            self.assertEqual((stats['checkouts'], stats['waits'], stats['timeouts']), (2, 0, 0))
+
+    def test_configure_asgi_disables_persistent_connections(self):
+        with patch.dict(connections.settings['default'], CONN_MAX_AGE=600):
+            db_pool.configure_asgi()
+            self.assertEqual(connections.settings['default']['CONN_MAX_AGE'], 0)
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.item = create_item(create_category(name='Async'), name='Async Item')
+        self.ajax = {'X-Requested-With': 'XMLHttpRequest'}
+
+    async def test_vote_item_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse('vote_item', kwargs={'slug': self.item.slug})
+        response = await self.async_client.post(url, {'value': 'true'})
+        self.assertEqual(response.json(), {'success': True, 'likes': 1, 'dislikes': 0})
+        response = await self.async_client.post(url, {'value': 'false'})
+        self.assertEqual(response.json(), {'success': True, 'likes': 0, 'dislikes': 1})
+
+    async def test_toggle_collection_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse('toggle_collection', kwargs={'slug': self.item.slug})
+        response = await self.async_client.post(url, headers=self.ajax)
+        self.assertEqual(response.json(), {'success': True, 'in_collection': True})
+        response = await self.async_client.post(url, headers=self.ajax)
+        self.assertEqual(response.json(), {'success': True, 'in_collection': False})
+        # Без AJAX-заголовка — перенаправление на страницу предмета
+        response = await self.async_client.post(url)
+        self.assertRedirects(response, self.item.get_absolute_url(), fetch_redirect_response=False)
+
+    async def test_anonymous_redirected_to_login(self):
+        url = reverse('vote_item', kwargs={'slug': self.item.slug})
+        response = await self.async_client.post(url, {'value': 'true'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('login'), response.url)
+
+    def test_catalog_middleware_is_async_capable(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        for middleware in (VisitCounterMiddleware, AnonymousPageCacheMiddleware,
+                           ReplicaRoutingMiddleware, StaticFilesMiddleware, MediaFilesMiddleware):
+            self.assertTrue(iscoroutinefunction(middleware(get_response)), middleware.__name__)
+
+
+class MediaFilesTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media_root, 'items'))
+        self.content = bytes(range(256)) * 4
+        for name in ('items/coin.jpg', 'items/coin.0123456789ab.320w.webp'):
+            with open(os.path.join(self.media_root, name), 'wb') as target:
+                target.write(self.content)
+
+    def test_serves_file_before_session_middleware(self):
+        response = self.client.get('/media/items/coin.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        self.assertRegex(response['ETag'], r'^"400-[0-9a-f]+"$')
+        # Сессии и CSRF не участвуют
+        self.assertNotIn('Vary', response)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_hashed_names_are_immutable(self):
+        response = self.client.get('/media/items/coin.0123456789ab.320w.webp')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['ETag'], '"0123456789ab-320-webp"')
+
+    async def test_async_range_under_asgi(self):
+        response = await self.async_client.get('/media/items/coin.jpg', headers={'Range': 'bytes=100-'})
+        self.assertEqual(response.status_code, 206)
+        # Под ASGI тело — асинхронный итератор, а не файл, собираемый целиком
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(content, self.content[100:])
+
+    async def test_static_files_streamed_under_asgi(self):
+        static_root = os.path.join(self.media_root, 'static')
+        os.makedirs(os.path.join(static_root, 'css'))
+        with open(os.path.join(static_root, 'css', 'site.css'), 'wb') as target:
+            target.write(self.content)
+
+        async def get_response(request):
+            return HttpResponse('view')
+
+        with override_settings(STATIC_ROOT=static_root, WHITENOISE_AUTOREFRESH=False):
+            middleware = StaticFilesMiddleware(get_response)
+        factory = RequestFactory()
+        response = await middleware(factory.get('/static/css/site.css'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(content, self.content)
+
+        response = await middleware(factory.get('/static/css/site.css', HTTP_RANGE='bytes=10-19'))
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.content[10:20])
+
+        response = await middleware(factory.get('/static/css/missing.css'))
+        self.assertEqual(response.content, b'view')
+
+    def test_if_none_match(self):
+        etag = self.client.head('/media/items/coin.jpg')['ETag']
+        response = self.client.get('/media/items/coin.jpg', headers={'If-None-Match': f'W/{etag}'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_range_requests(self):
+        url = '/media/items/coin.jpg'
+        response = self.client.get(url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+
+        response = self.client.get(url, headers={'Range': 'bytes=-4'})
+        self.assertEqual(b''.join(response.streaming_content), self.content[-4:])
+
+        response = self.client.get(url, headers={'Range': 'bytes=2000-'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+        # Устаревший If-Range — файл целиком
+        response = self.client.get(url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_and_outside_files_fall_through(self):
+        self.assertEqual(self.client.get('/media/items/missing.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+        with self.settings(MEDIA_SERVE_ENABLED=False):
+            self.assertEqual(self.client.get('/media/items/coin.jpg').status_code, 404)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset_metrics()
+        create_item(create_category(name='Measured'), name='Measured Item')
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('category_list'))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'sql;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        self.assertIn('total;dur=', timing)
+
+    @override_settings(PAGE_CACHE_ENABLED=True)
+    def test_cache_hits_reported(self):
+        self.client.get(reverse('category_list'))
+        response = self.client.get(reverse('category_list'))
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertRegex(response['Server-Timing'], r'cache;desc="[1-9]\d* hits')
+
+    def test_metrics_endpoint_exposes_histograms(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        staff = Client()
+        staff.force_login(User.objects.create_user('metrics-staff', is_staff=True))
+        body = staff.get(reverse('metrics')).content.decode()
+        self.assertIn('catalog_request_duration_seconds_count{view="index"} 2', body)
+        self.assertIn('catalog_request_duration_seconds_bucket{view="index",le="+Inf"} 2', body)
+        self.assertIn('catalog_sql_queries_total{view="index"}', body)
+        self.assertIn('catalog_db_pool_checkouts', body)
+
+    def test_metrics_hidden_without_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_queries_logged_with_view(self):
+        with self.assertLogs('catalog.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('category_list'))
+        self.assertTrue(any('category_list' in line and 'SELECT' in line for line in logs.output))
+
+
+@override_settings(PAGE_CACHE_ENABLED=False, HIT_QUEUE_ENABLED=True)
+class QueryBudgetTests(TestCase):
+    """
+    Бюджеты SQL-запросов для всех представлений catalog.urls и users.urls.
+
+    Данных достаточно, чтобы запрос на каждую строку (N+1) вышел за бюджет.
+    Кэш очищается перед каждым запросом, поэтому бюджеты — для холодного кэша.
+    Бюджет — точное число запросов без SAVEPOINT/RELEASE: точки сохранения
+    вложенных atomic не скрывают добавленный запрос.
+    """
+    # имя URL: (метод, AJAX, нужен вход, бюджет)
+    BUDGETS = {
+        'index': ('get', False, False, 9),
+        'search': ('get', False, False, 6),
+        'category_list': ('get', False, False, 4),
+        'category_detail': ('get', False, False, 5),
+        'item_detail': ('get', False, True, 11),
+        'add_comment': ('post', False, True, 5),
+        'item_comments': ('get', True, False, 4),
+        'vote_item': ('post', True, True, 7),
+        'toggle_collection': ('post', True, True, 6),
+        'user_collection': ('get', False, True, 7),
+        'export_collection': ('get', False, True, 4),
+        'export_catalog': ('get', False, True, 4),
+        'metrics': ('get', False, True, 3),
+        'vote_poll': ('post', False, True, 7),
+        'signup': ('get', False, False, 3),
+        'login': ('get', False, False, 3),
+        'logout': ('post', False, True, 4),
+        'profile': ('get', False, True, 8),
+        'password_change': ('get', False, True, 5),
+        'password_change_done': ('get', False, True, 5),
+    }
+
+    def setUp(self):
+        queue_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, queue_dir, ignore_errors=True)
+        override = override_settings(HIT_QUEUE_DIR=queue_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        cls.user.is_staff = True
+        cls.user.save()
+        others = [create_user(username=f'reader{n}') for n in range(5)]
+        # Несколько категорий, чтобы запрос на категорию в списке вышел за бюджет
+        categories = [create_category(name=f'Budget {n}') for n in range(4)]
+        cls.category = categories[0]
+        cls.items = [
+            create_item(categories[n % len(categories)], name=f'Budget Item {n}') for n in range(8)
+        ]
+        for item in cls.items:
+            # У просматриваемых предметов счетчик уже есть
+            HitCount.objects.get_for_object(item)
+            for other in others:
+                Comment.objects.create(item=item, user=other, text='Budget comment')
+                Vote.objects.create(item=item, user=other, value=True)
+            UserCollection.objects.create(user=cls.user, item=item, notes='Budget note')
+        cls.poll = create_poll()
+        cls.option = create_poll_option(cls.poll)
+        create_poll_option(cls.poll, text='Other option')
+
+    def url_for(self, name):
+        item = self.items[0]
+        if name == 'category_detail':
+            return reverse(name, kwargs={'slug': self.category.slug})
+        if name in ('item_detail', 'add_comment', 'item_comments', 'vote_item', 'toggle_collection'):
+            return reverse(name, kwargs={'slug': item.slug})
+        if name == 'vote_poll':
+            return reverse(name, kwargs={'poll_id': self.poll.pk})
+        if name == 'search':
+            return reverse(name) + '?q=Budget'
+        return reverse(name)
+
+    def post_data(self, name):
+        return {
+            'add_comment': {'text': 'New comment'},
+            'vote_item': {'value': 'false'},
+            'vote_poll': {'option': self.option.pk},
+        }.get(name, {})
+
+    def test_budgets_cover_all_views(self):
+        from catalog.urls import urlpatterns as catalog_urls
+        from users.urls import urlpatterns as users_urls
+        names = {pattern.name for pattern in catalog_urls + users_urls}
+        self.assertEqual(names, set(self.BUDGETS))
+
+    def test_view_query_budgets(self):
+        for name, (method, ajax, login, budget) in self.BUDGETS.items():
+            with self.subTest(view=name):
+                client = Client()
+                if login:
+                    client.force_login(self.user)
+                # Посетитель за день уже учтен; кэш холодный
+                client.get(reverse('login'))
+                cache.clear()
+                # Кэш ContentType общий для процесса: бюджеты без его промахов
+                ContentType.objects.get_for_model(CollectibleItem)
+                headers = {'X-Requested-With': 'XMLHttpRequest'} if ajax else {}
+                with CaptureQueriesContext(connection) as captured:
+                    if method == 'post':
+                        response = client.post(self.url_for(name), self.post_data(name), headers=headers)
+                    else:
+                        response = client.get(self.url_for(name), headers=headers)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                queries = [
+                    query['sql'] for query in captured
+                    if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))
+                ]
+                self.assertEqual(len(queries), budget, '\n'.join(queries))
+                self.assertLess(response.status_code, 400)
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_seed_and_benchmark_report(self):
+        call_command(
+            'seed_benchmark_data', items=30, categories=3, users=4, votes=60, hits=90,
+            comments=20, collection=5, batch_size=25, stdout=StringIO(),
+        )
+        self.assertEqual(Vote.objects.count(), 60)
+        self.assertEqual(sum(CollectibleItem.objects.values_list('likes_count', flat=True))
+                         + sum(CollectibleItem.objects.values_list('dislikes_count', flat=True)), 60)
+        self.assertEqual(HitCount.objects.aggregate(total=Sum('hits'))['total'], 90)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        output = f'{directory}/report.json'
+        call_command('benchmark_views', requests=3, warmup=1, output=output, stderr=StringIO())
+        with open(output, encoding='utf-8') as source:
+            report = json.load(source)
+        self.assertEqual(report['dataset']['items'], 30)
+        self.assertEqual(report['dataset']['hits'], 90)
+        self.assertEqual(set(report['views']), {
+            'index', 'search', 'category_list', 'category_detail', 'item_detail',
+            'item_comments', 'user_collection', 'profile',
+        })
+        for result in report['views'].values():
+            self.assertEqual(result['count'], 3)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+            self.assertGreater(result['queries'], 0)
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.category = create_category(name='Recommendations')
+        self.a, self.b, self.c, self.d = (
+            create_item(self.category, name=f'Item {letter}') for letter in 'abcd'
+        )
+        self.users = [create_user(username=f'owner{n}') for n in range(3)]
+        owned = {0: 'abc', 1: 'abc', 2: 'acd'}
+        for index, letters in owned.items():
+            for letter in letters:
+                UserCollection.objects.create(user=self.users[index], item=getattr(self, letter))
+
+    def recommendations(self):
+        return {
+            (item, recommended): round(score, 6)
+            for item, recommended, score in ItemRecommendation.objects.values_list('item', 'recommended', 'score')
+        }
+
+    def test_top_k_normalises_for_popularity(self):
+        # p есть у всех, n только у двух владельцев x: n похож на x сильнее, чем p
+        pairs = [(user, 'p') for user in range(6)] + [(0, 'x'), (1, 'x'), (0, 'n'), (1, 'n')]
+        ids = {'p': 1, 'x': 2, 'n': 3}
+        matrix = CoOccurrence([(user, ids[item]) for user, item in pairs])
+        row = matrix.index_of([ids['x']])[0]
+        neighbours = [(int(matrix.items[other]), round(float(score), 3)) for other, score in matrix.top_k(row, 5)]
+        self.assertEqual(neighbours, [(3, 1.0), (1, 0.577)])
+        self.assertEqual(len(matrix.top_k(row, 1)), 1)
+
+    def test_rebuild_and_item_page(self):
+        rebuild_recommendations()
+        self.assertFalse(CollectionChange.objects.exists())
+        # d есть только у одного владельца a, меньше RECOMMENDATIONS_MIN_COMMON
+        self.assertEqual(
+            list(self.a.recommendations.order_by('-score').values_list('recommended__name', flat=True)),
+            ['Item c', 'Item b'],
+        )
+        self.assertAlmostEqual(ItemRecommendation.objects.get(item=self.a, recommended=self.b).score, 2 / 6 ** 0.5)
+
+        response = self.client.get(reverse('item_detail', kwargs={'slug': self.a.slug}))
+        self.assertEqual([item.name for item in response.context['recommendations']], ['Item c', 'Item b'])
+        self.assertContains(response, 'У коллекционеров этого предмета также есть')
+
+    def test_refresh_matches_full_rebuild(self):
+        rebuild_recommendations()
+        UserCollection.objects.filter(user=self.users[0], item=self.c).delete()
+        UserCollection.objects.create(user=self.users[2], item=self.b)
+        UserCollection.objects.create(user=self.users[1], item=self.d)
+        self.assertEqual(CollectionChange.objects.count(), 3)
+
+        refresh_recommendations()
+        self.assertFalse(CollectionChange.objects.exists())
+        refreshed = self.recommendations()
+        rebuild_recommendations()
+        self.assertEqual(refreshed, self.recommendations())
+        self.assertEqual(refresh_recommendations(), (0, 0))
+
+    def test_refresh_removes_items_without_owners(self):
+        rebuild_recommendations()
+        UserCollection.objects.filter(item=self.b).delete()
+        call_command('build_recommendations', stdout=StringIO())
+        self.assertFalse(ItemRecommendation.objects.filter(item=self.b).exists())
+        self.assertFalse(ItemRecommendation.objects.filter(recommended=self.b).exists())
+
+
+@override_settings(TRENDING_HALF_LIFE_HOURS=24, TRENDING_LAG_SECONDS=30, TRENDING_MIN_SCORE=0.05,
+                   TRENDING_WEIGHTS={'hit': 1.0, 'like': 3.0, 'comment': 5.0, 'collection': 8.0})
+class TrendingTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.user = create_user()
+        self.category = create_category(name='Trending')
+        self.a, self.b, self.c = (create_item(self.category, name=f'Trending {letter}') for letter in 'abc')
+
+    def ago(self, hours):
+        return self.now - datetime.timedelta(hours=hours)
+
+    def score(self, item):
+        return current_score(TrendingScore.objects.get(item=item).log_score, self.now)
+
+    def test_events_decay_with_weights(self):
+        comment = Comment.objects.create(item=self.a, user=self.user, text='Old')
+        Comment.objects.filter(pk=comment.pk).update(created_at=self.ago(48))
+        vote = Vote.objects.create(item=self.b, user=self.user, value=True)
+        Vote.objects.filter(pk=vote.pk).update(created_at=self.ago(24))
+        Vote.objects.create(item=self.c, user=self.user, value=False)  # дизлайки не учитываются
+        hitcount = HitCount.objects.create(content_object=self.c)
+        Hit.objects.create(hitcount=hitcount, ip='1.1.1.1', session='s', user_agent='ua')
+        Hit.objects.filter(hitcount=hitcount).update(created=self.ago(1))
+
+        processed, _ = update_trending(self.now)
+        self.assertEqual(processed, {'hit': 1, 'like': 1, 'comment': 1, 'collection': 0})
+        self.assertAlmostEqual(self.score(self.a), 5 / 4)
+        self.assertAlmostEqual(self.score(self.b), 3 / 2)
+        self.assertAlmostEqual(self.score(self.c), 2 ** (-1 / 24))
+
+    def test_watermark_processes_only_new_events(self):
+        UserCollection.objects.create(user=self.user, item=self.a)
+        UserCollection.objects.update(added_at=self.ago(1))
+        update_trending(self.now)
+        first = self.score(self.a)
+
+        other = create_user(username='other')
+        entry = UserCollection.objects.create(user=other, item=self.a)
+        # Слишком свежее событие ждет следующего запуска
+        UserCollection.objects.filter(pk=entry.pk).update(added_at=self.now)
+        processed, _ = update_trending(self.now)
+        self.assertEqual(processed['collection'], 0)
+        self.assertAlmostEqual(self.score(self.a), first)
+
+        self.now += datetime.timedelta(minutes=1)
+        processed, _ = update_trending(self.now)
+        self.assertEqual(processed['collection'], 1)
+        self.assertAlmostEqual(self.score(self.a), 8 * 2 ** (-61 / 60 / 24) + 8 * 2 ** (-1 / 60 / 24))
+
+    def test_prune_drops_faded_items(self):
+        Comment.objects.create(item=self.a, user=self.user, text='Ancient')
+        Comment.objects.update(created_at=self.ago(24 * 10))
+        Comment.objects.create(item=self.b, user=self.user, text='Recent')
+        Comment.objects.filter(item=self.b).update(created_at=self.ago(2))
+        _, pruned = update_trending(self.now)
+        self.assertEqual(pruned, 1)
+        self.assertEqual(list(TrendingScore.objects.values_list('item', flat=True)), [self.b.pk])
+
+    @override_settings(PAGE_CACHE_ENABLED=False, HIT_QUEUE_ENABLED=False)
+    @patch('catalog.views.IndexView.paginate_by', 1)
+    def test_index_trending_section_and_sort(self):
+        for item, hours in ((self.a, 30), (self.b, 2), (self.c, 10)):
+            comment = Comment.objects.create(item=item, user=self.user, text='Hi')
+            Comment.objects.filter(pk=comment.pk).update(created_at=self.ago(hours))
+        update_trending(self.now)
+        expected = [self.b.pk, self.c.pk, self.a.pk]
+
+        response = self.client.get(reverse('index'))
+        self.assertEqual([item.pk for item in response.context['trending']], expected)
+        self.assertContains(response, 'Сейчас популярно')
+
+        seen = []
+        params = {'sort': 'trending'}
+        while True:
+            response = self.client.get(reverse('index'), params)
+            seen += [item.pk for item in response.context['items']]
+            page = response.context['page_obj']
+            if not page.has_next():
+                break
+            params['cursor'] = page.next_cursor
+        self.assertEqual(seen, expected)
+        self.assertEqual(response.context['filter_query'], 'sort=trending')
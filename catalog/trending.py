@@ -0,0 +1,149 @@
+"""
+Популярность предметов («Сейчас популярно») с экспоненциальным затуханием.
+
+Событие с весом w в момент t к моменту now дает w * 2 ** (-(now - t) / T),
+где T — TRENDING_HALF_LIFE_HOURS. В TrendingScore хранится
+log_score = ln(sum w * exp(rate * (t - EPOCH))), rate = ln 2 / T, и текущая
+популярность равна exp(log_score - rate * (now - EPOCH)). Множитель затухания
+общий для всех предметов, поэтому порядок по log_score не меняется со временем:
+новые события только добавляются к строкам (logaddexp), а старые строки
+не пересчитываются.
+
+Задание update_trending читает события каждого источника после сохраненной
+отметки (TrendingWatermark) и сдвигает ее в той же транзакции, что и счет.
+Строки, популярность которых упала ниже TRENDING_MIN_SCORE, удаляются,
+поэтому в таблице остаются только предметы с недавней активностью.
+"""
+import datetime
+import math
+
+import numpy as np
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from hitcount.models import Hit
+
+from .models import CollectibleItem, Comment, TrendingScore, TrendingWatermark, UserCollection, Vote
+from .page_cache import TRENDING_TAG, invalidate_tags
+
+EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+DEFAULT_WEIGHTS = {'hit': 1.0, 'like': 3.0, 'comment': 5.0, 'collection': 8.0}
+
+
+def decay_rate():
+    return math.log(2) / (getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24) * 3600)
+
+
+def sources():
+    """Источник: (события, поле предмета, поле времени)"""
+    content_type = ContentType.objects.get_for_model(CollectibleItem)
+    return {
+        'hit': (Hit.objects.filter(hitcount__content_type=content_type), 'hitcount__object_pk', 'created'),
+        'like': (Vote.objects.filter(value=True), 'item_id', 'created_at'),
+        'comment': (Comment.objects.all(), 'item_id', 'created_at'),
+        'collection': (UserCollection.objects.all(), 'item_id', 'added_at'),
+    }
+
+
+def trending_items(queryset=None):
+    """Предметы с популярностью, аннотированные trending_score (log_score)"""
+    if queryset is None:
+        queryset = CollectibleItem.objects.cards()
+    return queryset.filter(trending__isnull=False).annotate(trending_score=F('trending__log_score'))
+
+
+def top_trending(count=None):
+    """Самые популярные предметы одним запросом по индексу log_score"""
+    if count is None:
+        count = getattr(settings, 'TRENDING_TOP_N', 8)
+    return trending_items().order_by('-trending_score', '-id')[:count]
+
+
+def _add_events(item_pks, exponents):
+    """Прибавляет события (предмет, ln вклада) к популярности предметов"""
+    item_pks = np.asarray(item_pks, dtype=np.int64)
+    exponents = np.asarray(exponents, dtype=np.float64)
+    order = np.argsort(item_pks, kind='stable')
+    items, starts = np.unique(item_pks[order], return_index=True)
+    sums = np.logaddexp.reduceat(exponents[order], starts)
+
+    pks = [int(pk) for pk in items]
+    # Просмотры могут относиться к уже удаленным предметам
+    alive = set(CollectibleItem.objects.filter(pk__in=pks).values_list('pk', flat=True))
+    existing = TrendingScore.objects.in_bulk([pk for pk in pks if pk in alive])
+    created, updated = [], []
+    for pk, value in zip(pks, sums):
+        if pk not in alive:
+            continue
+        score = existing.get(pk)
+        if score is None:
+            created.append(TrendingScore(item_id=pk, log_score=float(value)))
+        else:
+            score.log_score = float(np.logaddexp(score.log_score, value))
+            updated.append(score)
+    TrendingScore.objects.bulk_create(created, batch_size=1000)
+    TrendingScore.objects.bulk_update(updated, ['log_score'], batch_size=1000)
+
+
+def _process_source(name, queryset, item_field, time_field, cutoff):
+    """Учитывает события источника после отметки; возвращает их количество"""
+    weight = getattr(settings, 'TRENDING_WEIGHTS', DEFAULT_WEIGHTS).get(name, 0)
+    batch_size = getattr(settings, 'TRENDING_BATCH_SIZE', 5000)
+    rate = decay_rate()
+    processed = 0
+    TrendingWatermark.objects.get_or_create(source=name)
+    while True:
+        with transaction.atomic():
+            watermark = TrendingWatermark.objects.select_for_update().get(source=name)
+            rows = list(
+                queryset.filter(pk__gt=watermark.last_pk).order_by('pk')
+                .values_list('pk', item_field, time_field)[:batch_size]
+            )
+            # Недавние события ждут следующего запуска: транзакции с меньшими
+            # идентификаторами могут еще не завершиться
+            fresh = next((index for index, row in enumerate(rows) if row[2] > cutoff), len(rows))
+            complete = fresh == len(rows) and len(rows) == batch_size
+            rows = rows[:fresh]
+            if not rows:
+                return processed
+            if weight > 0:
+                _add_events(
+                    [row[1] for row in rows],
+                    [math.log(weight) + rate * (row[2] - EPOCH).total_seconds() for row in rows],
+                )
+            watermark.last_pk = rows[-1][0]
+            watermark.save(update_fields=['last_pk'])
+        processed += len(rows)
+        if not complete:
+            return processed
+
+
+def prune(now=None):
+    """Удаляет строки, популярность которых ниже TRENDING_MIN_SCORE"""
+    now = now or timezone.now()
+    threshold = math.log(getattr(settings, 'TRENDING_MIN_SCORE', 0.05)) + decay_rate() * (now - EPOCH).total_seconds()
+    deleted, _ = TrendingScore.objects.filter(log_score__lt=threshold).delete()
+    return deleted
+
+
+def current_score(log_score, now=None):
+    """Популярность с учетом затухания на момент now"""
+    now = now or timezone.now()
+    return math.exp(log_score - decay_rate() * (now - EPOCH).total_seconds())
+
+
+def update_trending(now=None):
+    """Учитывает новые события всех источников; возвращает ({источник: событий}, удалено строк)"""
+    now = now or timezone.now()
+    cutoff = now - datetime.timedelta(seconds=getattr(settings, 'TRENDING_LAG_SECONDS', 30))
+    processed = {
+        name: _process_source(name, queryset, item_field, time_field, cutoff)
+        for name, (queryset, item_field, time_field) in sources().items()
+    }
+    pruned = prune(now)
+    if any(processed.values()) or pruned:
+        invalidate_tags(TRENDING_TAG)
+    return processed, pruned
@@ -1,35 +1,78 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from functools import wraps
+
+from django.shortcuts import aget_object_or_404, render, get_object_or_404, redirect
+from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseRedirect
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.admin.views.decorators import staff_member_required
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, HttpResponseRedirect
 from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from django.utils.http import urlencode
 from django.contrib import messages
-from django.db.models import Count, Sum, Case, When, IntegerField
+from django.db import IntegrityError
+from django.db.models import Sum, Case, When, IntegerField
 from django.views.generic import ListView, DetailView
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.paginator import Paginator
+from django.db.models.functions import Left
 from hitcount.views import HitCountDetailView
 
 from .models import (
-    Category, CollectibleItem, Comment, Vote, UserCollection,
-    Poll, PollOption, PollVote
+    Category, CollectibleItem, CollectibleItemQuerySet, Comment, Vote, UserCollection,
+    Poll, PollVote
 )
+from .collection_stats import collection_stats, filter_panels, filtered_count, parse_collection_filters
+from .exports import FORMATS, catalog_rows, collection_rows, streaming_export
+from .facets import build_facets, filter_items, parse_filters
 from .forms import CommentForm, VoteForm, PollVoteForm
+from .hits import count_hit
+from .metrics import render_prometheus
+from .page_cache import (
+    CATEGORIES_TAG, ITEMS_TAG, POLLS_TAG, RECOMMENDATIONS_TAG, TRENDING_TAG, category_tag, item_tag, tag_page
+)
+from .pagination import KeysetPaginationMixin, KeysetPaginator
+from .polls import poll_results
+from .search import search_highlights, search_item_ids
+from .trending import top_trending, trending_items
 
 
-class IndexView(ListView):
+class IndexView(KeysetPaginationMixin, ListView):
     """Главная страница с последними добавленными предметами"""
+    read_from_replica = True
     model = CollectibleItem
     template_name = 'catalog/index.html'
     context_object_name = 'items'
     paginate_by = 12
     
     def get_queryset(self):
-        return CollectibleItem.objects.all().order_by('-created_at')
+        self.filters = parse_filters(self.request.GET)
+        # Порядок: новые (по умолчанию) или популярные сейчас
+        self.sort = 'trending' if self.request.GET.get('sort') == 'trending' else ''
+        queryset = filter_items(CollectibleItem.objects.cards(), self.filters)
+        if self.sort:
+            return trending_items(queryset)
+        return queryset.order_by('-created_at')
+
+    def get_keyset_paginator(self, queryset, page_size):
+        if self.sort:
+            return KeysetPaginator(queryset, page_size, key='trending_score', parse=float)
+        return super().get_keyset_paginator(queryset, page_size)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.annotate(
-            item_count=Count('items')
-        ).order_by('-item_count')[:5]
+        # Фасеты для фильтрации по стране, состоянию, категории и году
+        context['facets'] = build_facets(self.filters)
+        context['filters'] = self.filters
+        context['sort'] = self.sort
+        context['base_query'] = urlencode(sorted(self.filters.items()))
+        # Пагинация сохраняет и фильтры, и порядок
+        params = dict(self.filters, sort=self.sort) if self.sort else self.filters
+        context['filter_query'] = urlencode(sorted(params.items()))
+        context['trending'] = top_trending()
+        tag_page(self.request, ITEMS_TAG, CATEGORIES_TAG, POLLS_TAG, TRENDING_TAG)
+        context['categories'] = Category.objects.order_by('-item_count', 'name')[:5]
         
         # Добавляем активный опрос
         context['poll'] = Poll.objects.filter(is_active=True).first()
@@ -40,22 +83,9 @@ class IndexView(ListView):
                 user=self.request.user
             ).exists()
             
-            # Если пользователь голосовал, добавляем результаты
+            # Если пользователь голосовал, добавляем результаты из кэшированного снимка
             if context['user_voted']:
-                # Подсчитываем количество голосов для каждого варианта
-                options = context['poll'].options.annotate(
-                    vote_count=Count('votes')
-                ).order_by('-vote_count')
-                
-                # Считаем общее количество голосов
-                total_votes = sum(option.vote_count for option in options)
-                
-                # Добавляем процент для каждого варианта
-                for option in options:
-                    option.percentage = round(option.vote_count / total_votes * 100) if total_votes > 0 else 0
-                
-                context['poll_options'] = options
-                context['total_votes'] = total_votes
+                context['poll_options'], context['total_votes'] = poll_results(context['poll'])
             else:
                 context['poll_form'] = PollVoteForm(poll=context['poll'])
                 
@@ -64,38 +94,59 @@ class IndexView(ListView):
 
 class CategoryListView(ListView):
     """Список категорий"""
+    read_from_replica = True
     model = Category
     template_name = 'catalog/category_list.html'
     context_object_name = 'categories'
     
-    def get_queryset(self):
-        return Category.objects.annotate(item_count=Count('items'))
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        tag_page(self.request, CATEGORIES_TAG)
+        return context
 
 
 class CategoryDetailView(DetailView):
     """Детальная страница категории с предметами"""
+    read_from_replica = True
     model = Category
     template_name = 'catalog/category_detail.html'
     context_object_name = 'category'
+    paginate_by = 12
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['items'] = self.object.items.all()
+        paginator = KeysetPaginator(self.object.items.cards(), self.paginate_by)
+        page = paginator.page(self.request.GET.get('cursor'))
+        context['page_obj'] = page
+        context['items'] = page.object_list
+        tag_page(self.request, category_tag(self.object.pk))
         return context
 
 
 class ItemDetailView(HitCountDetailView):
     """Детальная страница предмета коллекции"""
+    read_from_replica = True
     model = CollectibleItem
+    queryset = CollectibleItem.objects.select_related('category')
     template_name = 'catalog/item_detail.html'
     context_object_name = 'item'
-    count_hit = True
+    # Просмотр учитывается через очередь catalog.hits, а не синхронно в запросе
+    count_hit = False
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        count_hit(self.request, context['hitcount']['pk'])
         
         # Добавляем форму комментария
         context['comment_form'] = CommentForm()
+
+        # Первая страница комментариев; остальные подгружаются через item_comments
+        context['comments_page'] = comments_page(self.object, None)
+
+        # Готовые рекомендации из catalog.recommendations, один запрос
+        context['recommendations'] = CollectibleItem.objects.filter(
+            recommended_for__item=self.object
+        ).order_by('-recommended_for__score', 'pk').only('name', 'slug', 'country')
         
         # Проверяем, добавлен ли предмет в коллекцию пользователя
         if self.request.user.is_authenticated:
@@ -111,13 +162,68 @@ class ItemDetailView(HitCountDetailView):
             except Vote.DoesNotExist:
                 context['user_vote'] = None
         
-        # Подсчитываем количество лайков и дизлайков
-        context['likes'] = self.object.votes.filter(value=True).count()
-        context['dislikes'] = self.object.votes.filter(value=False).count()
+        # Количество лайков и дизлайков хранится в самом предмете
+        context['likes'] = self.object.likes_count
+        context['dislikes'] = self.object.dislikes_count
+
+        tag_page(
+            self.request, item_tag(self.object.pk), category_tag(self.object.category_id), RECOMMENDATIONS_TAG,
+            hitcount_pk=context['hitcount']['pk'],
+        )
         
         return context
 
 
+COMMENTS_PER_PAGE = 10
+
+
+def comments_page(item, cursor):
+    """Страница комментариев к предмету вместе с авторами и их профилями"""
+    comments = Comment.objects.filter(item=item).select_related('user__profile').only(
+        'text', 'created_at', 'item_id', 'user__username', 'user__profile__avatar'
+    )
+    return KeysetPaginator(comments, COMMENTS_PER_PAGE).page(cursor)
+
+
+def item_comments(request, slug):
+    """Очередная страница комментариев к предмету (JSON с HTML-фрагментом)"""
+    item = get_object_or_404(CollectibleItem.objects.only('pk', 'slug'), slug=slug)
+    page = comments_page(item, request.GET.get('cursor'))
+    html = render_to_string('catalog/comment_list.html', {'comments': page.object_list}, request=request)
+
+    return JsonResponse({
+        'html': html,
+        'next_cursor': page.next_cursor,
+    })
+
+
+def search(request):
+    """Полнотекстовый поиск по каталогу"""
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    items = []
+
+    if query:
+        # Пагинация по списку id, отсортированному по релевантности
+        paginator = Paginator(search_item_ids(query), 12)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        page_ids = list(page_obj.object_list)
+
+        found = CollectibleItem.objects.cards().in_bulk(page_ids)
+        highlights = search_highlights(query, page_ids)
+        for pk in page_ids:
+            if pk in found:
+                item = found[pk]
+                item.highlight = highlights.get(pk)
+                items.append(item)
+
+    return render(request, 'catalog/search.html', {
+        'query': query,
+        'items': items,
+        'page_obj': page_obj,
+    })
+
+
 @login_required
 def add_comment(request, slug):
     """Добавление комментария к предмету"""
@@ -135,59 +241,73 @@ def add_comment(request, slug):
     return redirect('item_detail', slug=slug)
 
 
-@login_required
-def vote_item(request, slug):
+def async_login_required(view):
+    """
+    login_required для асинхронных представлений: в Django 5.0 стандартный
+    декоратор их не поддерживает. Проверенный пользователь кладется в request.user.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@async_login_required
+async def vote_item(request, slug):
     """Голосование за предмет коллекции"""
-    item = get_object_or_404(CollectibleItem, slug=slug)
+    item = await aget_object_or_404(CollectibleItem.objects.only('pk'), slug=slug)
     
     if request.method == 'POST':
         value = request.POST.get('value') == 'true'
         
         # Проверяем, голосовал ли пользователь ранее
-        vote, created = Vote.objects.get_or_create(
+        vote, created = await Vote.objects.aget_or_create(
             user=request.user,
             item=item,
             defaults={'value': value}
         )
         
         # Если пользователь уже голосовал, обновляем его выбор
-        if not created:
+        if not created and vote.value != value:
             vote.value = value
-            vote.save()
+            await vote.asave()
         
-        # Возвращаем новое количество лайков и дизлайков
-        likes = item.votes.filter(value=True).count()
-        dislikes = item.votes.filter(value=False).count()
+        # Возвращаем новое количество лайков и дизлайков (счетчики обновлены при сохранении голоса)
+        await item.arefresh_from_db(fields=['likes_count', 'dislikes_count'])
         
         return JsonResponse({
             'success': True,
-            'likes': likes,
-            'dislikes': dislikes
+            'likes': item.likes_count,
+            'dislikes': item.dislikes_count
         })
     
     return JsonResponse({'success': False})
 
 
-@login_required
-def toggle_collection(request, slug):
+@async_login_required
+async def toggle_collection(request, slug):
     """Добавление/удаление предмета в/из коллекции пользователя"""
-    item = get_object_or_404(CollectibleItem, slug=slug)
+    item = await aget_object_or_404(CollectibleItem.objects.only('pk'), slug=slug)
     
-    # Проверяем, есть ли уже предмет в коллекции
-    collection_item = UserCollection.objects.filter(user=request.user, item=item)
-    
-    if collection_item.exists():
-        # Если предмет уже в коллекции, удаляем его
-        collection_item.delete()
+    # Если предмет уже в коллекции, удаляем его, иначе добавляем
+    deleted, _ = await UserCollection.objects.filter(user=request.user, item=item).adelete()
+    if deleted:
         messages.success(request, 'Предмет удален из вашей коллекции')
         in_collection = False
     else:
-        # Если предмета нет в коллекции, добавляем его
-        UserCollection.objects.create(user=request.user, item=item)
+        try:
+            await UserCollection.objects.acreate(user=request.user, item=item)
+        except IntegrityError:
+            # Параллельный запрос уже добавил предмет
+            pass
         messages.success(request, 'Предмет добавлен в вашу коллекцию')
         in_collection = True
     
-    if request.is_ajax():
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
             'success': True,
             'in_collection': in_collection
@@ -196,16 +316,71 @@ def toggle_collection(request, slug):
     return redirect('item_detail', slug=slug)
 
 
+COLLECTION_PAGE_SIZE = 24
+
+
 @login_required
 def user_collection(request):
-    """Просмотр личной коллекции пользователя"""
-    collection_items = UserCollection.objects.filter(user=request.user).select_related('item')
-    
+    """Личная коллекция пользователя: фильтры, курсорная пагинация и панель статистики"""
+    stats = collection_stats(request.user.pk)
+    filters = parse_collection_filters(request.GET, stats)
+    # Карточки одним запросом: предмет и категория через JOIN, начало описания вместо полного текста
+    collection_items = filter_items(
+        UserCollection.objects.filter(user=request.user), filters, prefix='item__'
+    ).select_related('item__category').only(
+        'user_id', 'item_id', 'notes', 'added_at',
+        *(f'item__{field}' for field in CollectibleItemQuerySet.CARD_FIELDS),
+    ).annotate(short_description=Left('item__description', 101))
+
+    paginator = KeysetPaginator(
+        collection_items, COLLECTION_PAGE_SIZE, key='added_at', count=filtered_count(stats, filters)
+    )
+    page = paginator.page(request.GET.get('cursor'))
     return render(request, 'catalog/user_collection.html', {
-        'collection_items': collection_items
+        'collection_items': page.object_list,
+        'page_obj': page,
+        'stats': stats,
+        'filters': filters,
+        'filter_panels': filter_panels(stats, filters),
+        'filter_query': urlencode(sorted(filters.items())),
     })
 
 
+def _export_format(request):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in FORMATS:
+        raise Http404('Неизвестный формат выгрузки')
+    return fmt
+
+
+@staff_member_required
+def export_catalog(request):
+    """Потоковая выгрузка всего каталога"""
+    columns, rows = catalog_rows()
+    return streaming_export(request, columns, rows, _export_format(request), 'catalog')
+
+
+@login_required
+def export_collection(request):
+    """Потоковая выгрузка личной коллекции пользователя с заметками"""
+    columns, rows = collection_rows(request.user)
+    return streaming_export(request, columns, rows, _export_format(request), 'collection')
+
+
+def metrics(request):
+    """
+    Метрики процесса в текстовом формате Prometheus: по токену METRICS_TOKEN,
+    для персонала или при DEBUG; без токена для остальных адреса нет.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorized = bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not (authorized or settings.DEBUG or request.user.is_staff):
+        if token:
+            return HttpResponse(status=401)
+        raise Http404
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @login_required
 def vote_poll(request, poll_id):
     """Голосование в опросе"""
@@ -219,15 +394,19 @@ def vote_poll(request, poll_id):
     if request.method == 'POST':
         form = PollVoteForm(poll=poll, data=request.POST)
         if form.is_valid():
-            option_id = form.cleaned_data['option']
-            option = get_object_or_404(PollOption, id=option_id, poll=poll)
+            # Форма принимает только варианты этого опроса, повторно их не читаем
+            option_id = int(form.cleaned_data['option'])
             
-            # Создаем голос
-            PollVote.objects.create(
-                poll=poll,
-                option=option,
-                user=request.user
-            )
+            # Создаем голос; счетчик варианта увеличивается в той же транзакции
+            try:
+                PollVote.objects.create(
+                    poll=poll,
+                    option_id=option_id,
+                    user=request.user
+                )
+            except IntegrityError:
+                messages.error(request, 'Вы уже голосовали в этом опросе')
+                return redirect('index')
             
             messages.success(request, 'Ваш голос учтен!')
             return redirect('index')
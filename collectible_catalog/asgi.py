@@ -8,4 +8,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'collectible_catalog.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+application = get_asgi_application()
+
+# Каждый запрос ASGI работает с базой из своего потока, поэтому соединения
+# закрываются после запроса (ограничение пула к запросам ASGI не применяется)
+from catalog.db_pool import configure_asgi  # noqa: E402
+
+configure_asgi()
\ No newline at end of file
@@ -4,6 +4,7 @@ Django settings for collectible_catalog project.
 
 from pathlib import Path
 import os
+import sys
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -33,21 +34,27 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Статика и загруженные файлы отдаются до сессий и остальных middleware
+    'catalog.middleware.StaticFilesMiddleware',
+    'catalog.middleware.MediaFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'catalog.middleware.RequestMetricsMiddleware',
     'catalog.middleware.VisitCounterMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'catalog.middleware.AnonymousPageCacheMiddleware',
+    'catalog.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'collectible_catalog.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с учетом времени отрисовки в метриках запроса
+        'BACKEND': 'catalog.backends.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -65,9 +72,57 @@ TEMPLATES = [
 WSGI_APPLICATION = 'collectible_catalog.wsgi.application'
 
 # Database
+# Постоянные соединения с проверкой перед повторным использованием (см. catalog.db_pool);
+# под ASGI соединения закрываются после каждого запроса
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '600'))
 DATABASES = {
-    'default': dj_database_url.config(default=os.getenv('DATABASE_URL'))
+    'default': dj_database_url.config(
+        default=os.getenv('DATABASE_URL'), conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=True
+    )
 }
+# Сколько запросов WSGI процесса одновременно работают с базой и сколько секунд ждать места
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+
+# Read replicas: DATABASE_REPLICA_URLS — URL реплик через запятую.
+# Чтение каталога на страницах просмотра идет с реплик (см. catalog.routers).
+# В тестах реплика PostgreSQL — зеркало default, а SQLite-реплика создается
+# отдельной базой, чтобы маршрутизацию можно было проверить локально.
+# Под manage.py test чтение на реплики выключено: их включают только тесты
+# маршрутизации через override_settings(REPLICA_DATABASES=[...]).
+TESTING = sys.argv[1:2] == ['test']
+REPLICA_DATABASES = []
+for number, url in enumerate(filter(None, os.getenv('DATABASE_REPLICA_URLS', '').split(',')), 1):
+    alias = f'replica{number}'
+    DATABASES[alias] = dj_database_url.parse(
+        url.strip(), conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=True
+    )
+    if DATABASES[alias]['ENGINE'] != 'django.db.backends.sqlite3':
+        DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    if not TESTING:
+        REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['catalog.routers.ReplicaRouter']
+# После записи запросы пользователя читают с основной базы столько секунд
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '10'))
+
+# Cache
+# Кэш фасетов, снимков опросов, статистики коллекций и страниц сбрасывается
+# сигналами в процессе, который изменил данные. Без REDIS_URL кэш у каждого
+# процесса свой (LocMemCache) и остальные воркеры видят старые данные до
+# истечения срока, поэтому кэш страниц по умолчанию включается только с Redis,
+# а сроки снимков без общего кэша короче.
+SHARED_CACHE = bool(os.getenv('REDIS_URL'))
+CACHES = {
+    'default': {
+        'BACKEND': 'catalog.backends.LocMemCache',
+    }
+}
+if SHARED_CACHE:
+    CACHES['default'] = {
+        'BACKEND': 'catalog.backends.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    }
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -92,6 +147,91 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Файлы из MEDIA_ROOT отдает MediaFilesMiddleware; выключите, если их раздает веб-сервер
+MEDIA_SERVE_ENABLED = os.getenv('MEDIA_SERVE_ENABLED', 'True') == 'True'
+# Cache-Control для файлов без хэша содержимого в имени (секунды)
+MEDIA_CACHE_MAX_AGE = int(os.getenv('MEDIA_CACHE_MAX_AGE', '3600'))
+
+# Visit counter
+# При включенном буфере посещения сбрасываются в базу пачками
+# раз в VISIT_COUNTER_FLUSH_INTERVAL секунд или по достижении порога
+VISIT_COUNTER_BUFFERED = os.getenv('VISIT_COUNTER_BUFFERED', 'False') == 'True'
+VISIT_COUNTER_FLUSH_INTERVAL = int(os.getenv('VISIT_COUNTER_FLUSH_INTERVAL', '30'))
+VISIT_COUNTER_FLUSH_THRESHOLD = int(os.getenv('VISIT_COUNTER_FLUSH_THRESHOLD', '100'))
+# Время жизни закэшированной статистики посещений (секунды)
+VISIT_COUNTER_CACHE_TIMEOUT = int(os.getenv('VISIT_COUNTER_CACHE_TIMEOUT', '10'))
+# Уникальные посетители считаются наброском HyperLogLog из 2 ** VISIT_SKETCH_PRECISION
+# регистров (12: 4 КБ на день, ошибка около 1,6 %); набросок дня хранится в кэше.
+# Менять точность можно только вместе с очисткой сохраненных набросков
+VISIT_SKETCH_PRECISION = 12
+VISIT_SKETCH_CACHE_TIMEOUT = 2 * 24 * 3600
+
+# Search
+# Максимальное количество результатов поиска, ранжируемых за один запрос
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', '1000'))
+
+# Facets
+# Время жизни закэшированных счетчиков фасетов (секунды)
+FACETS_CACHE_TIMEOUT = int(os.getenv('FACETS_CACHE_TIMEOUT', '300' if SHARED_CACHE else '60'))
+
+# Pagination
+# Показывать приблизительное количество предметов (оценка планировщика PostgreSQL)
+PAGINATION_ESTIMATE_COUNT = os.getenv('PAGINATION_ESTIMATE_COUNT', 'True') == 'True'
+
+# Image derivatives
+# Ширины уменьшенных копий изображений предметов (WebP + исходный формат)
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 1280)
+# Генерировать производные в фоновом потоке после сохранения предмета
+IMAGE_DERIVATIVES_ASYNC = os.getenv('IMAGE_DERIVATIVES_ASYNC', 'True') == 'True'
+
+# Polls
+# Время жизни снимка результатов опроса (сбрасывается при каждом голосе)
+POLL_RESULTS_CACHE_TIMEOUT = int(os.getenv('POLL_RESULTS_CACHE_TIMEOUT', '3600' if SHARED_CACHE else '60'))
+
+# Collection stats
+# Время жизни статистики личной коллекции (сбрасывается при изменении коллекции)
+COLLECTION_STATS_CACHE_TIMEOUT = int(os.getenv('COLLECTION_STATS_CACHE_TIMEOUT', '3600' if SHARED_CACHE else '60'))
+
+# Recommendations
+# Сколько похожих предметов хранить для каждого предмета
+RECOMMENDATIONS_TOP_K = int(os.getenv('RECOMMENDATIONS_TOP_K', '6'))
+# Минимальное число общих владельцев, при котором предметы считаются похожими
+RECOMMENDATIONS_MIN_COMMON = int(os.getenv('RECOMMENDATIONS_MIN_COMMON', '2'))
+RECOMMENDATIONS_BATCH_SIZE = 1000
+
+# Trending
+# Популярность предметов с затуханием, пересчитывается командой update_trending
+TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS', '24'))
+TRENDING_WEIGHTS = {'hit': 1.0, 'like': 3.0, 'comment': 5.0, 'collection': 8.0}
+# Предметы с меньшей популярностью удаляются из таблицы
+TRENDING_MIN_SCORE = 0.05
+# События моложе этого учитываются при следующем запуске
+TRENDING_LAG_SECONDS = 30
+TRENDING_BATCH_SIZE = 5000
+# Сколько предметов показывать в блоке «Сейчас популярно»
+TRENDING_TOP_N = 8
+
+# Page cache
+# Кэш страниц для анонимных посетителей (сбрасывается сигналами моделей).
+# Включается по умолчанию только с общим кэшем (REDIS_URL), см. Cache выше
+PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', str(SHARED_CACHE)) == 'True'
+PAGE_CACHE_TIMEOUT = int(os.getenv('PAGE_CACHE_TIMEOUT', '300'))
+
+# Request metrics
+# Запросы дольше SLOW_QUERY_MS миллисекунд пишутся в журнал catalog.slow_queries
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_SQL_SAMPLE = 500
+# /metrics доступен с заголовком Authorization: Bearer <METRICS_TOKEN>, персоналу
+# или при DEBUG; без токена остальные получают 404
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Hit queue
+# Просмотры предметов пишутся в локальную очередь и учитываются командой process_hits.
+# Очередь — файлы в HIT_QUEUE_DIR, поэтому process_hits --loop должен работать на той же
+# файловой системе, что и веб-процессы (не отдельным dyno); по умолчанию выключена
+HIT_QUEUE_ENABLED = os.getenv('HIT_QUEUE_ENABLED', 'False') == 'True'
+HIT_QUEUE_DIR = os.getenv('HIT_QUEUE_DIR', os.path.join(BASE_DIR, 'var', 'hits'))
+HIT_QUEUE_SEGMENT_SECONDS = int(os.getenv('HIT_QUEUE_SEGMENT_SECONDS', '10'))
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -0,0 +1,20 @@
+"""
+Gunicorn config for collectible_catalog project.
+
+GUNICORN_ASGI=True запускает приложение под ASGI на воркерах uvicorn:
+асинхронные представления (голосование, коллекция) не занимают воркер
+на время запроса к базе.
+"""
+import os
+
+if os.getenv('GUNICORN_ASGI') == 'True':
+    wsgi_app = 'collectible_catalog.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'collectible_catalog.wsgi'
+
+
+def worker_exit(server, worker):
+    # Записываем в базу посещения, накопленные воркером в буфере
+    from catalog.counters import flush_visit_buffer
+    flush_visit_buffer()
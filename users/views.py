@@ -44,7 +44,10 @@ def profile(request):
     
     context = {
         'user_form': user_form,
-        'profile_form': profile_form
+        'profile_form': profile_form,
+        # Счетчики выводятся на странице дважды, считаем их один раз
+        'collections_count': request.user.collections.count(),
+        'comments_count': request.user.comments.count(),
     }
     
     return render(request, 'users/profile.html', context)
\ No newline at end of file